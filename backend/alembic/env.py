@@ -73,6 +73,10 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            # data migrations must see every row past the row-level security policies
+            connection.exec_driver_sql("SET app.rls_bypass = 'on'")
+            connection.commit()
         context.configure(
             connection=connection, target_metadata=target_metadata
         )
@@ -0,0 +1,44 @@
+"""add_keyset_pagination_indexes
+
+Revision ID: a1c5e9f3b7d2
+Revises: f2b8c4d6e1a7
+Create Date: 2025-05-11 16:02:51.934107
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c5e9f3b7d2'
+down_revision: Union[str, None] = 'f2b8c4d6e1a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (owner/folder, id) indexes for the list endpoints, and the single-column indexes they make redundant
+INDEXES = {
+    'ix_flashcards_folder_id_id': ('flashcards', ['folder_id', 'id']),
+    'ix_flashcards_user_id_id': ('flashcards', ['user_id', 'id']),
+    'ix_files_folder_id_id': ('files', ['folder_id', 'id']),
+}
+REPLACED = {
+    'ix_flashcards_folder_id': ('flashcards', ['folder_id']),
+    'ix_flashcards_user_id': ('flashcards', ['user_id']),
+}
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, (table, columns) in INDEXES.items():
+            op.create_index(name, table, columns, unique=False, if_not_exists=True, postgresql_concurrently=True)
+        for name, (table, columns) in REPLACED.items():
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, (table, columns) in REPLACED.items():
+            op.create_index(name, table, columns, unique=False, if_not_exists=True, postgresql_concurrently=True)
+        for name, (table, columns) in INDEXES.items():
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
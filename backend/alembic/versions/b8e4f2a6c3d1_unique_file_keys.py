@@ -0,0 +1,68 @@
+"""unique_file_keys
+
+Revision ID: b8e4f2a6c3d1
+Revises: a7d2c9e4b1f6
+Create Date: 2025-05-16 11:27:39.540286
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e4f2a6c3d1'
+down_revision: Union[str, None] = 'a7d2c9e4b1f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# files sharing a blob share its key, so only files stored under their own key must have one each
+OWN_KEY = 'blob_sha256 IS NULL'
+
+
+def _merge_duplicates(connection):
+    # concurrent completions of one upload used to be able to record it twice;
+    # keep the first record and point upload sessions at it
+    files = sa.table('files', sa.column('id'), sa.column('s3_key'), sa.column('blob_sha256'))
+    sessions = sa.table('upload_sessions', sa.column('file_id'))
+    duplicates = connection.execute(
+        sa.select(files.c.s3_key, sa.func.min(files.c.id))
+        .where(files.c.blob_sha256.is_(None))
+        .group_by(files.c.s3_key)
+        .having(sa.func.count() > 1)
+    ).all()
+    for s3_key, kept_id in duplicates:
+        extra = sa.select(files.c.id).where(files.c.s3_key == s3_key, files.c.blob_sha256.is_(None), files.c.id != kept_id)
+        connection.execute(sa.update(sessions).where(sessions.c.file_id.in_(extra)).values(file_id=kept_id))
+        connection.execute(sa.delete(files).where(files.c.id.in_(extra)))
+
+
+def _drop_invalid_index(connection, name):
+    # a failed CONCURRENTLY build leaves an INVALID index that if_not_exists would skip over (see d9b3f5a7e2c6)
+    if connection.dialect.name != 'postgresql':
+        return
+    invalid = connection.execute(sa.text(
+        "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid"
+        " WHERE pg_class.relname = :name AND NOT pg_index.indisvalid"
+    ), {'name': name}).first()
+    if invalid:
+        op.drop_index(name, table_name='files', postgresql_concurrently=True)
+
+
+def upgrade() -> None:
+    _merge_duplicates(op.get_bind())
+    # built CONCURRENTLY outside a transaction, like d9b3f5a7e2c6, so uploads keep working meanwhile
+    with op.get_context().autocommit_block():
+        _drop_invalid_index(op.get_bind(), 'uq_files_s3_key')
+        # merge what completions recorded twice since the merge above committed
+        _merge_duplicates(op.get_bind())
+        op.create_index(
+            'uq_files_s3_key', 'files', ['s3_key'], unique=True, if_not_exists=True, postgresql_concurrently=True,
+            postgresql_where=sa.text(OWN_KEY), sqlite_where=sa.text(OWN_KEY)
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('uq_files_s3_key', table_name='files', if_exists=True, postgresql_concurrently=True)
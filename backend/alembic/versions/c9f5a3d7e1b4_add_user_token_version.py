@@ -0,0 +1,27 @@
+"""add_user_token_version
+
+Revision ID: c9f5a3d7e1b4
+Revises: b8e4f2a6c3d1
+Create Date: 2025-05-17 09:48:15.204637
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9f5a3d7e1b4'
+down_revision: Union[str, None] = 'b8e4f2a6c3d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # existing tokens carry no version and count as 0, so they keep working until a password changes
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,73 @@
+"""unique_filenames_per_folder
+
+Revision ID: d9b3f5a7e2c6
+Revises: c4e8a2f6d1b9
+Create Date: 2025-05-14 10:42:07.915327
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9b3f5a7e2c6'
+down_revision: Union[str, None] = 'c4e8a2f6d1b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _rename_duplicates(connection):
+    # concurrent uploads used to be able to give two files in a folder the same name;
+    # keep the oldest under its name and number the rest the way uploads do
+    files = sa.table('files', sa.column('id'), sa.column('folder_id'), sa.column('filename'))
+    duplicates = connection.execute(
+        sa.select(files.c.folder_id, files.c.filename)
+        .group_by(files.c.folder_id, files.c.filename)
+        .having(sa.func.count() > 1)
+    ).all()
+    for folder_id, filename in duplicates:
+        taken = set(connection.execute(sa.select(files.c.filename).where(files.c.folder_id == folder_id)).scalars())
+        ids = connection.execute(
+            sa.select(files.c.id).where(files.c.folder_id == folder_id, files.c.filename == filename).order_by(files.c.id)
+        ).scalars().all()
+        base_name, extension = os.path.splitext(filename)
+        count = 1
+        for file_id in ids[1:]:
+            while f"{base_name} ({count}){extension}" in taken:
+                count += 1
+            name = f"{base_name} ({count}){extension}"
+            taken.add(name)
+            connection.execute(sa.update(files).where(files.c.id == file_id).values(filename=name))
+
+
+def _drop_invalid_index(connection, name):
+    # a CONCURRENTLY build that fails, e.g. on a duplicate, leaves an INVALID index behind that
+    # enforces nothing, and that if_not_exists would take for a finished one on the next run
+    if connection.dialect.name != 'postgresql':
+        return
+    invalid = connection.execute(sa.text(
+        "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid"
+        " WHERE pg_class.relname = :name AND NOT pg_index.indisvalid"
+    ), {'name': name}).first()
+    if invalid:
+        op.drop_index(name, table_name='files', postgresql_concurrently=True)
+
+
+def upgrade() -> None:
+    _rename_duplicates(op.get_bind())
+    # built CONCURRENTLY outside a transaction, like f2b8c4d6e1a7, so uploads keep working meanwhile
+    with op.get_context().autocommit_block():
+        _drop_invalid_index(op.get_bind(), 'uq_files_folder_id_filename')
+        # uploads keep running, so catch the duplicates they added since the rename above committed
+        _rename_duplicates(op.get_bind())
+        op.create_index('uq_files_folder_id_filename', 'files', ['folder_id', 'filename'], unique=True, if_not_exists=True, postgresql_concurrently=True)
+        op.drop_index('ix_files_folder_id_filename', table_name='files', if_exists=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_files_folder_id_filename', 'files', ['folder_id', 'filename'], unique=False, if_not_exists=True, postgresql_concurrently=True)
+        op.drop_index('uq_files_folder_id_filename', table_name='files', if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,66 @@
+"""add_row_level_security
+
+Revision ID: e7f3a9c1d5b2
+Revises: d5a1e7c93b04
+Create Date: 2025-05-09 10:41:27.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7f3a9c1d5b2'
+down_revision: Union[str, None] = 'd5a1e7c93b04'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table -> column holding the folder a row belongs to
+PROTECTED_TABLES = {
+    'study_folders': 'id',
+    'flashcards': 'folder_id',
+    'files': 'folder_id',
+}
+
+
+def upgrade() -> None:
+    # row-level security is Postgres only; other databases keep relying on the route checks
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # the request's user, set per transaction by the app when DB_ROW_LEVEL_SECURITY is on;
+    # NULL when unset, which is how migrations, workers and scripts keep seeing every row
+    op.execute("""
+        CREATE FUNCTION app_current_user_id() RETURNS integer
+        LANGUAGE sql STABLE
+        AS $$ SELECT NULLIF(current_setting('app.user_id', true), '')::integer $$
+    """)
+
+    for table, folder_column in PROTECTED_TABLES.items():
+        op.execute(f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY")
+        # also applies to the table owner, which is usually the role the app connects as
+        op.execute(f"ALTER TABLE {table} FORCE ROW LEVEL SECURITY")
+        op.execute(f"""
+            CREATE POLICY {table}_access ON {table}
+            USING (
+                app_current_user_id() IS NULL
+                OR user_id = app_current_user_id()
+                OR EXISTS (
+                    SELECT 1 FROM folder_acl
+                    WHERE folder_acl.folder_id = {table}.{folder_column}
+                    AND folder_acl.user_id = app_current_user_id()
+                )
+            )
+        """)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for table in PROTECTED_TABLES:
+        op.execute(f"DROP POLICY {table}_access ON {table}")
+        op.execute(f"ALTER TABLE {table} NO FORCE ROW LEVEL SECURITY")
+        op.execute(f"ALTER TABLE {table} DISABLE ROW LEVEL SECURITY")
+    op.execute("DROP FUNCTION app_current_user_id()")
@@ -0,0 +1,73 @@
+"""rls_fail_closed
+
+Revision ID: f1c3e5a7b9d2
+Revises: d9b3f5a7e2c6
+Create Date: 2025-05-15 09:18:44.602151
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c3e5a7b9d2'
+down_revision: Union[str, None] = 'd9b3f5a7e2c6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table -> column holding the folder a row belongs to, as in e7f3a9c1d5b2
+PROTECTED_TABLES = {
+    'study_folders': 'id',
+    'flashcards': 'folder_id',
+    'files': 'folder_id',
+}
+
+SHARED_WITH_USER = """
+    SELECT 1 FROM folder_acl
+    WHERE folder_acl.folder_id = {table}.{folder_column}
+    AND folder_acl.user_id = app_current_user_id()
+"""
+
+
+def _replace_policy(table, using):
+    op.execute(f"DROP POLICY {table}_access ON {table}")
+    op.execute(f"CREATE POLICY {table}_access ON {table} USING ({using})")
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # an unset user used to mean "see everything", so a connection that forgot to set it read
+    # every row; now it sees nothing, and migrations, workers and the ACL sync opt in explicitly
+    op.execute("""
+        CREATE FUNCTION app_rls_bypass() RETURNS boolean
+        LANGUAGE sql STABLE
+        AS $$ SELECT coalesce(current_setting('app.rls_bypass', true), '') = 'on' $$
+    """)
+
+    for table, folder_column in PROTECTED_TABLES.items():
+        _replace_policy(table, f"""
+            app_rls_bypass()
+            OR (
+                app_current_user_id() IS NOT NULL
+                AND (
+                    user_id = app_current_user_id()
+                    OR EXISTS ({SHARED_WITH_USER.format(table=table, folder_column=folder_column)})
+                )
+            )
+        """)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for table, folder_column in PROTECTED_TABLES.items():
+        _replace_policy(table, f"""
+            app_current_user_id() IS NULL
+            OR user_id = app_current_user_id()
+            OR EXISTS ({SHARED_WITH_USER.format(table=table, folder_column=folder_column)})
+        """)
+    op.execute("DROP FUNCTION app_rls_bypass()")
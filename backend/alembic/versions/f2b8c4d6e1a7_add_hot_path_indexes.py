@@ -0,0 +1,41 @@
+"""add_hot_path_indexes
+
+Revision ID: f2b8c4d6e1a7
+Revises: e7f3a9c1d5b2
+Create Date: 2025-05-10 09:17:43.602518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b8c4d6e1a7'
+down_revision: Union[str, None] = 'e7f3a9c1d5b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# index name -> (table, columns), matching app/models.py
+INDEXES = {
+    'ix_files_folder_id_filename': ('files', ['folder_id', 'filename']),
+    'ix_flashcards_folder_id': ('flashcards', ['folder_id']),
+    'ix_flashcards_user_id': ('flashcards', ['user_id']),
+    'ix_study_folders_user_id_name': ('study_folders', ['user_id', 'name']),
+    'ix_folder_shares_folder_id_user_id_accepted': ('folder_shares', ['folder_id', 'user_id', 'invitation_accepted']),
+    'ix_folder_shares_invitation_email_accepted': ('folder_shares', ['invitation_email', 'invitation_accepted']),
+}
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps the tables writable while Postgres builds the indexes, but can't run
+    # inside a transaction; if_not_exists skips indexes create_all already made at startup
+    with op.get_context().autocommit_block():
+        for name, (table, columns) in INDEXES.items():
+            op.create_index(name, table, columns, unique=False, if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, (table, columns) in INDEXES.items():
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
@@ -4,22 +4,190 @@ import jwt
 from jwt.exceptions import InvalidTokenError
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
+import asyncio
+import logging
 import os 
+import time
+import hashlib
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models import User
+from sqlalchemy import delete, event, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from app.database import AsyncSessionLocal, DATABASE_URL, get_async_db, bind_request_user
+from app.models import RevokedToken, User
 from app.schemas import TokenData
+from app.utils import metrics
+from app.utils.cache import TTLCache
+from app.utils.invalidation import create_channel
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 SECRET_KEY = os.getenv("SECRET_KEY")
 ACCESS_TOKEN_EXPIRATION = 3600 # 24 hours
 ALGORITHM = "HS256" # HS256 (HMAC with SHA-256) is a standard algorithm for JWT.
+TOKEN_VERSION_CLAIM = "ver" # the user's token_version when the token was issued; tokens from before a password change carry an older one
 
 # OAuth2PasswordBearer handles token extraction from requests
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30")) # seconds a looked-up user is reused, 0 disables
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_MAX_TTL = float(os.getenv("TOKEN_CACHE_MAX_TTL", "3600")) # entries otherwise live until the token's exp, 0 disables
+# seconds between reloads of revoked_tokens from the database, bounding how long a lost
+# notification leaves a revoked token usable; keep it below TOKEN_CACHE_MAX_TTL
+REVOKED_TOKENS_SYNC_INTERVAL = float(os.getenv("REVOKED_TOKENS_SYNC_INTERVAL", "60"))
+
+# verified claims by token digest, so a token seen before skips the HMAC check and JSON parsing
+token_cache = TTLCache("auth.token_cache", TOKEN_CACHE_SIZE, TOKEN_CACHE_MAX_TTL)
+# digests of revoked tokens -> the token's exp (epoch seconds, None if it has none), in this worker
+# The revoked_tokens table is the durable record, loaded when a worker starts, when its channel
+# reconnects and every REVOKED_TOKENS_SYNC_INTERVAL; revocations made by other workers arrive
+# over revocation_channel in between. Entries are only dropped once their token has expired
+revoked_tokens = {}
+revocation_channel = create_channel("token_revocations", DATABASE_URL)
+_revocation_sync = None # task reloading revoked_tokens periodically
+
+# authenticated users by (user id, token digest), so repeat requests skip the users query
+principal_cache = TTLCache("auth.principal_cache", PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+# Drop every cached principal of a user, e.g. after their row changes
+# param: user_id: ID of the user to forget
+def invalidate_principal(user_id: int):
+    principal_cache.discard_where(lambda key: key[0] == user_id)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    invalidate_principal(target.id)
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+# time.monotonic() deadline for a token's exp claim
+def _expiry_deadline(claims: dict):
+    exp = claims.get("exp")
+    if exp is None:
+        return None
+    return time.monotonic() + (exp - time.time())
+
+# Verify a JWT and return its claims, reusing the result for tokens seen before
+# param: token: encoded JWT
+# param: digest: SHA-256 digest of the token
+def decode_token(token: str, digest: str) -> dict:
+    if digest in revoked_tokens:
+        raise InvalidTokenError("Token has been revoked")
+    claims = token_cache.get(digest)
+    if claims is None:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.set(digest, claims, expires_at=_expiry_deadline(claims))
+    return claims
+
+# Remember a revoked token in this worker and purge everything cached for it
+# param: digest: SHA-256 digest of the token
+# param: expires_at: the token's exp, after which it fails verification anyway
+def _forget_token(digest: str, expires_at):
+    revoked_tokens[digest] = expires_at
+    token_cache.pop(digest)
+    principal_cache.discard_where(lambda key: key[1] == digest)
+
+# Drop revocations whose tokens have expired since
+def _prune_revoked_tokens():
+    now = time.time()
+    for digest in [digest for digest, exp in revoked_tokens.items() if exp is not None and exp <= now]:
+        del revoked_tokens[digest]
+
+def handle_revocation(message: dict):
+    if "user_id" in message:
+        invalidate_principal(message["user_id"])
+        return
+    _prune_revoked_tokens()
+    _forget_token(message["digest"], message["expires_at"])
+
+# Reject a token from now on, in every worker and across restarts; commits the session
+# param: db: Database session
+# param: token: encoded JWT to revoke
+async def revoke_token(db: AsyncSession, token: str):
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
+    except InvalidTokenError:
+        return # never valid, nothing to remember
+    digest = _token_digest(token)
+    expires_at = claims.get("exp")
+    # expired revocations are dead weight; the index on expires_at keeps this cheap
+    await db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= datetime.now(timezone.utc)))
+    db.add(RevokedToken(
+        digest=digest,
+        expires_at=None if expires_at is None else datetime.fromtimestamp(expires_at, timezone.utc),
+    ))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback() # revoked already, e.g. by a concurrent logout
+    _prune_revoked_tokens()
+    _forget_token(digest, expires_at)
+    await revocation_channel.publish({"digest": digest, "expires_at": expires_at})
+
+# Reject every token issued to a user before now, in every worker; call after committing a bump
+# of their token_version. Workers that miss the message reload the user within PRINCIPAL_CACHE_TTL
+# param: user_id: ID of the user whose tokens to reject
+async def revoke_user_tokens(user_id: int):
+    invalidate_principal(user_id)
+    await revocation_channel.publish({"user_id": user_id})
+
+# Load the revocations still in force, e.g. when a worker starts or may have missed notifications
+async def load_revoked_tokens():
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(RevokedToken).where(
+            or_(RevokedToken.expires_at.is_(None), RevokedToken.expires_at > datetime.now(timezone.utc))
+        ))).scalars()
+        _prune_revoked_tokens()
+        for row in rows:
+            expires_at = None if row.expires_at is None else row.expires_at.replace(tzinfo=timezone.utc).timestamp()
+            if row.digest not in revoked_tokens:
+                _forget_token(row.digest, expires_at)
+
+async def _sync_revoked_tokens():
+    while True:
+        await asyncio.sleep(REVOKED_TOKENS_SYNC_INTERVAL)
+        try:
+            await load_revoked_tokens()
+        except Exception:
+            logger.exception("Could not reload revoked tokens")
+
+async def start_token_revocation():
+    global _revocation_sync
+    revocation_channel.subscribe(handle_revocation)
+    revocation_channel.on_resync(load_revoked_tokens)
+    await revocation_channel.start()
+    await load_revoked_tokens()
+    _revocation_sync = asyncio.create_task(_sync_revoked_tokens())
+
+async def stop_token_revocation():
+    global _revocation_sync
+    if _revocation_sync is not None:
+        _revocation_sync.cancel()
+        try:
+            await _revocation_sync
+        except asyncio.CancelledError:
+            pass
+        _revocation_sync = None
+    await revocation_channel.stop()
+    revocation_channel.remove_resync(load_revoked_tokens)
+    revocation_channel.unsubscribe(handle_revocation)
+
+# Rebuild a cached user as a detached instance, so each request gets its own copy
+def _cached_principal(user_id: int, digest: str):
+    values = principal_cache.get((user_id, digest))
+    if values is None:
+        return None
+    user = User(**values)
+    make_transient_to_detached(user)
+    return user
+
 # Create a JWT token with the provided data and expiration time
 # param: data: Dictionary that contains data to include in the token (user ID)
 # param: expires_delta: Optional expiration time
@@ -37,16 +205,17 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 # Get the current user from the JWT token
 # param: token: JWT token (extracted by OAuth2PasswordBearer)
 # param: db: Database session
-def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)):
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSession = Depends(get_async_db)):
 
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    digest = _token_digest(token)
     try:
         # Decode and verify the JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token, digest)
         user_id = payload.get("user_id")
         if user_id is None:
             raise credentials_exception
@@ -56,10 +225,28 @@ def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session
         # Handle any JWT decoding errors
         raise credentials_exception
     
-    # Get user from database
-    user = db.query(User).filter(User.id == token_data.user_id).first()
-    if user is None:
+    start = time.perf_counter()
+    user = _cached_principal(token_data.user_id, digest)
+    if user is not None:
+        metrics.observe("auth.principal_lookup_seconds.cached", time.perf_counter() - start)
+    else:
+        # Get user from database
+        user = await db.get(User, token_data.user_id)
+        if user is None:
+            raise credentials_exception
+        principal_cache.set((user.id, digest), {
+            "id": user.id,
+            "name": user.name,
+            "email": user.email,
+            "hashed_password": user.hashed_password,
+            "token_version": user.token_version,
+        })
+        metrics.observe("auth.principal_lookup_seconds.db", time.perf_counter() - start)
+    # issued before the user's last password change
+    if payload.get(TOKEN_VERSION_CLAIM, 0) != user.token_version:
         raise credentials_exception
+    # lets sessions in this request route reads by user and, in RLS mode, run as the user (see RoutingSession)
+    await bind_request_user(db, user.id)
     return user
 
 # Get the current active user
@@ -1,20 +1,308 @@
 import os
-from sqlalchemy import create_engine 
-from sqlalchemy.orm import sessionmaker, declarative_base
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from dotenv import load_dotenv
+from app.utils import metrics
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()] # read replicas, comma separated
+DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "5")) # reads stay on the primary this long after a user's write
+DB_ROW_LEVEL_SECURITY = os.getenv("DB_ROW_LEVEL_SECURITY", "false").lower() == "true" # run request transactions as their user under Postgres RLS
 
+# connection pool settings, shared by every engine this process creates
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5")) # connections kept open
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10")) # extra connections allowed under load
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30")) # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800")) # seconds before a connection is replaced, -1 to never
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true" # test connections on checkout
 
-engine = create_engine(DATABASE_URL) # create a synchronous SQLAlchemy Engine, which knows how to talk to Postgres
+# async drivers for the same databases, used when ASYNC_DATABASE_URL isn't set explicitly
+ASYNC_DRIVERS = {
+  "postgresql": "postgresql+asyncpg",
+  "sqlite": "sqlite+aiosqlite",
+}
+
+def _async_url(url: str):
+  url = make_url(url)
+  return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+class _TimedCheckout:
+  # records how long callers wait for a connection, and how often they give up
+  def connect(self):
+    start = time.perf_counter()
+    try:
+      return super().connect()
+    except PoolTimeoutError:
+      metrics.incr(f"db.pool.{self.logging_name}.timeouts")
+      raise
+    finally:
+      metrics.observe(f"db.pool.{self.logging_name}.wait_seconds", time.perf_counter() - start)
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+  pass
+
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+  pass
+
+# engines whose pools are reported on the metrics endpoint, by name
+pools = {}
+
+# Keyword arguments for create_engine / create_async_engine with the configured pool
+# param: name: label used for the pool's metrics
+def _engine_options(url, name: str, is_async: bool = False) -> dict:
+  url = make_url(url)
+  if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+    return {} # in-memory SQLite lives on a single connection
+  return {
+    "poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+    "pool_logging_name": name,
+  }
+
+# Count connection churn and checkouts for an engine and list it on the metrics endpoint
+def _instrument(sync_engine, name: str):
+  for event_name, counter in (("connect", "connects"), ("close", "closes"), ("checkout", "checkouts"), ("checkin", "checkins"), ("invalidate", "invalidations")):
+    event.listen(sync_engine, event_name, lambda *args, counter=counter: metrics.incr(f"db.pool.{name}.{counter}"))
+  pools[name] = sync_engine
+  return sync_engine
+
+# Point-in-time view of every instrumented pool
+def pool_status() -> dict:
+  status = {}
+  for name, sync_engine in pools.items():
+    pool = sync_engine.pool
+    if not isinstance(pool, QueuePool):
+      status[name] = {"status": pool.status()}
+      continue
+    status[name] = {
+      "size": pool.size(),
+      "checked_out": pool.checkedout(),
+      "checked_in": pool.checkedin(),
+      "overflow": max(pool.overflow(), 0),
+      "max_overflow": DB_MAX_OVERFLOW,
+      "timeout": pool.timeout(),
+    }
+  return status
+
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL, "primary")) # create a synchronous SQLAlchemy Engine, which knows how to talk to Postgres
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL, "primary_async", is_async=True)) # same database through an asyncio driver, for async def routes
+_instrument(engine, "primary")
+_instrument(async_engine.sync_engine, "primary_async")
+
+replica_engines = []
+async_replica_engines = []
+for i, replica_url in enumerate(DATABASE_REPLICA_URLS):
+  replica_engines.append(_instrument(create_engine(replica_url, **_engine_options(replica_url, f"replica{i}")), f"replica{i}"))
+  async_replica = create_async_engine(_async_url(replica_url), **_engine_options(replica_url, f"replica{i}_async", is_async=True))
+  async_replica_engines.append(async_replica)
+  _instrument(async_replica.sync_engine, f"replica{i}_async")
+
+# id of the user the current request is authenticated as, set by get_current_user
+current_user_id = ContextVar("current_user_id", default=None)
+
+# Read-your-writes across workers: the time of a client's last write travels with the client,
+# in the last_write cookie or the X-Last-Write header for clients that echo it back, so whichever
+# worker serves its next read knows to use the primary (see carry_write_mark in main)
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+class WriteMark:
+  # when the current request's client last wrote (epoch seconds), updated by this request's commits
+  def __init__(self, at=None):
+    self.at = at
+    self.wrote = False
+
+  # mark from the cookie or header value a client sent back; anything unparseable counts as none
+  @classmethod
+  def from_client(cls, value):
+    try:
+      return cls(float(value))
+    except (TypeError, ValueError):
+      return cls()
+
+# set per request by the middleware; a mutable object so sessions in threadpool copies of the context can update it
+current_write_mark = ContextVar("current_write_mark", default=None)
+
+# when each user last committed a write through this worker, for clients that don't send the mark back
+_last_writes = {}
+
+def record_write(user_id: int):
+  now = time.time()
+  if len(_last_writes) > 10000:
+    for stale in [user for user, at in _last_writes.items() if now - at > DB_REPLICA_STICKY_SECONDS]:
+      del _last_writes[stale]
+  _last_writes[user_id] = now
+  mark = current_write_mark.get()
+  if mark is not None:
+    mark.at = now
+    mark.wrote = True
+
+def _recent(at) -> bool:
+  # abs() so a little clock skew between workers doesn't matter
+  return at is not None and abs(time.time() - at) < DB_REPLICA_STICKY_SECONDS
+
+def wrote_recently(user_id) -> bool:
+  mark = current_write_mark.get()
+  return (mark is not None and _recent(mark.at)) or _recent(_last_writes.get(user_id))
+
+# Session that sends read-only work to a replica
+# A session created with info={"read_only": True} reads from one of `replicas`, unless its client
+# or user wrote to the primary within DB_REPLICA_STICKY_SECONDS (read-your-writes). The choice is made
+# at the session's first statement and kept, so every query sees the same database; once the
+# session flushes, it stays on the primary
+class RoutingSession(Session):
+  def __init__(self, *args, replicas=(), **kwargs):
+    super().__init__(*args, **kwargs)
+    self.replicas = list(replicas)
+    self._replica = None
+    self._primary = False
+
+  # user whose writes this session records, and whose stickiness it honours
+  @property
+  def user_id(self):
+    return self.info.get("user_id") or current_user_id.get()
+
+  def get_bind(self, mapper=None, clause=None, **kwargs):
+    if self._flushing:
+      self._primary = True
+    if self._replica is None and not self._primary:
+      if self.replicas and self.info.get("read_only") and not wrote_recently(self.user_id):
+        self._replica = random.choice(self.replicas)
+      else:
+        self._primary = True
+    if self._primary:
+      return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+    return self._replica
+
+# Whether `session` (sync or async) has read from a replica, whose answers may lag behind the primary
+def reads_from_replica(session) -> bool:
+  session = getattr(session, "sync_session", session)
+  return isinstance(session, RoutingSession) and session._replica is not None
+
+# Postgres settings the row-level security policies read: the request's user, and an explicit
+# bypass for work that must see every row. With neither set, the policies hide everything
+RLS_USER_SETTING = "app.user_id"
+RLS_BYPASS_SETTING = "app.rls_bypass"
+
+def rls_active(connection) -> bool:
+  return DB_ROW_LEVEL_SECURITY and connection.dialect.name == "postgresql"
+
+# Scope the rest of the current transaction to `user_id` (None leaves it unscoped, which sees nothing)
+def set_rls_user(connection, user_id):
+  connection.execute(
+    text("SELECT set_config(:user_setting, :user_id, true), set_config(:bypass_setting, 'off', true)"),
+    {"user_setting": RLS_USER_SETTING, "user_id": "" if user_id is None else str(user_id), "bypass_setting": RLS_BYPASS_SETTING}
+  )
+
+def set_rls_bypass(connection, enabled: bool):
+  connection.execute(text("SELECT set_config(:setting, :value, true)"), {"setting": RLS_BYPASS_SETTING, "value": "on" if enabled else "off"})
+
+# Run bookkeeping that must see every row (e.g. the folder_acl sync) past the request's RLS user
+@contextmanager
+def rls_bypass(connection):
+  if not rls_active(connection):
+    yield
+    return
+  set_rls_bypass(connection, True)
+  try:
+    yield
+  finally:
+    set_rls_bypass(connection, False)
+
+# Without DB_ROW_LEVEL_SECURITY the app relies on its route checks alone, so its connections
+# opt out of the policies for their whole life; anything else connecting stays filtered
+def _bypass_rls_unless_enabled(sync_engine):
+  @event.listens_for(sync_engine, "connect")
+  def _connected(dbapi_connection, connection_record):
+    if DB_ROW_LEVEL_SECURITY or sync_engine.dialect.name != "postgresql":
+      return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"SET {RLS_BYPASS_SETTING} = 'on'")
+    cursor.close()
+
+for sync_engine in pools.values():
+  _bypass_rls_unless_enabled(sync_engine)
+
+# Record the authenticated user of this request on its session
+# Transactions that begin later pick the user up in after_begin; one already open is updated now
+async def bind_request_user(db, user_id: int):
+  current_user_id.set(user_id)
+  if DB_ROW_LEVEL_SECURITY and db.in_transaction():
+    connection = await db.connection()
+    if rls_active(connection.sync_connection):
+      await connection.run_sync(set_rls_user, user_id)
+
+@event.listens_for(RoutingSession, "after_begin")
+def _began(session, transaction, connection):
+  if session.user_id is not None and rls_active(connection):
+    set_rls_user(connection, session.user_id)
+
+@event.listens_for(RoutingSession, "after_flush")
+def _flushed(session, flush_context):
+  session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _executed(orm_execute_state):
+  # bulk insert/update/delete statements don't go through a flush
+  if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+    orm_execute_state.session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "after_commit")
+def _committed(session):
+  if session.info.pop("wrote", False) and session.user_id is not None:
+    record_write(session.user_id)
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _rolled_back(session):
+  session.info.pop("wrote", None)
 
 # this will manage transactions, and provide a session for database operations
 SessionLocal = sessionmaker(
+  class_=RoutingSession,
   autocommit=False, # I control when transactions are committed
   autoflush=False, # I control when pending changes are flushed to the database
   bind=engine # tell SQLAlchemy to use the engine we created
 )
 
+ReadSessionLocal = sessionmaker(
+  class_=RoutingSession,
+  autoflush=False,
+  bind=engine,
+  replicas=replica_engines,
+  info={"read_only": True}
+)
+
+AsyncSessionLocal = async_sessionmaker(
+  bind=async_engine,
+  sync_session_class=RoutingSession,
+  autoflush=False,
+  expire_on_commit=False # attributes can't be lazily reloaded in async code, so keep them after commit
+)
+
+AsyncReadSessionLocal = async_sessionmaker(
+  bind=async_engine,
+  sync_session_class=RoutingSession,
+  replicas=[replica.sync_engine for replica in async_replica_engines],
+  info={"read_only": True},
+  autoflush=False,
+  expire_on_commit=False
+)
+
 # this is a base class for all database models
 Base = declarative_base()
 
@@ -24,3 +312,20 @@ def get_db():
     yield db # route function runs
   finally:
     db.close() # close the session after the route function runs
+
+# same as get_db for async def routes; queries are awaited instead of holding a threadpool worker
+async def get_async_db():
+  async with AsyncSessionLocal() as db:
+    yield db
+
+# sessions for read-only routes; they read from a replica when one is configured
+def get_read_db():
+  db = ReadSessionLocal()
+  try:
+    yield db
+  finally:
+    db.close()
+
+async def get_async_read_db():
+  async with AsyncReadSessionLocal() as db:
+    yield db
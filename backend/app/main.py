@@ -1,12 +1,30 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import engine, Base
-from app.routes import files, users, flashcard, studyfolder, foldershare, chat
+from app.database import engine, async_engine, async_replica_engines, Base, DB_REPLICA_STICKY_SECONDS, LAST_WRITE_COOKIE, LAST_WRITE_HEADER, WriteMark, current_write_mark
+from app.routes import files, uploads, users, flashcard, studyfolder, foldershare, chat, jobs, metrics
+from app.auth import start_token_revocation, stop_token_revocation
+from app.services.jobs import start_workers, stop_workers
+from app.utils.passwords import configure_password_hashing
+from app.utils.permissions import start_permission_invalidation, stop_permission_invalidation
 
 # automatically create all tables in the database (only run once)
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  await configure_password_hashing() # pick the bcrypt cost for this machine
+  await start_workers() # background flashcard generation
+  await start_permission_invalidation() # hear about share changes made by other workers
+  await start_token_revocation() # reject tokens revoked by any worker, including before this one started
+  yield
+  await stop_token_revocation()
+  await stop_permission_invalidation()
+  await stop_workers()
+  for async_db_engine in (async_engine, *async_replica_engines):
+    await async_db_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
   "http://localhost:3000",
@@ -21,11 +39,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[LAST_WRITE_HEADER],
 )
 
+# Hand the client the time of its last write and take it back on the next request, so reads
+# that follow a write stay on the primary whichever worker serves them
+@app.middleware("http")
+async def carry_write_mark(request: Request, call_next):
+  mark = WriteMark.from_client(request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE))
+  current_write_mark.set(mark)
+  response = await call_next(request)
+  if mark.wrote:
+    response.headers[LAST_WRITE_HEADER] = repr(mark.at)
+    response.set_cookie(LAST_WRITE_COOKIE, repr(mark.at), max_age=max(int(DB_REPLICA_STICKY_SECONDS), 1), httponly=True, samesite="lax")
+  return response
+
 app.include_router(files.router)
+app.include_router(uploads.router)
 app.include_router(users.router)
 app.include_router(flashcard.router)
 app.include_router(studyfolder.router)
 app.include_router(foldershare.router)
 app.include_router(chat.router)
+app.include_router(jobs.router)
+app.include_router(metrics.router)
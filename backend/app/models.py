@@ -1,17 +1,41 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, Boolean, Index, text
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import relationship
 from app.database import Base
-from passlib.context import CryptContext
+from app.utils.passwords import pwd_context
 from datetime import datetime, timezone
 import enum
 
-myctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+myctx = pwd_context # blocking; request handlers use app.utils.passwords instead
+
+class UTCDateTime(TypeDecorator):
+  """Timestamp column stored as naive UTC.
+
+  asyncpg refuses timezone-aware values for TIMESTAMP WITHOUT TIME ZONE columns,
+  so aware datetimes are converted to UTC and stripped before they are sent.
+  """
+  impl = DateTime
+  cache_ok = True
+
+  def process_bind_param(self, value, dialect):
+    if value is not None and value.tzinfo is not None:
+      value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
 class PermissionType(enum.Enum):
     READ = "read"
     EDIT = "edit"
     ADMIN = "admin"
 
+# Effective permissions from weakest to strongest; a folder's owner can do everything
+PERMISSION_RANKS = {"read": 1, "edit": 2, "admin": 3, "owner": 4}
+
+class JobStatus(enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
 class User(Base):
   __tablename__ = "users"
 
@@ -19,6 +43,7 @@ class User(Base):
   name = Column(String, nullable=False)
   email = Column(String, nullable=False, unique=True)
   hashed_password = Column(String, nullable=False)
+  token_version = Column(Integer, nullable=False, default=0, server_default="0") # bumped on password change; tokens carrying an older one are rejected
 
   @classmethod
   def get_password_hash(cls, password):
@@ -28,6 +53,23 @@ class User(Base):
     return myctx.verify(password, self.hashed_password)
   
 
+class RevokedToken(Base):
+  __tablename__ = "revoked_tokens"
+
+  # a JWT rejected before its exp, e.g. at logout (see app/auth.py)
+  digest = Column(String(64), primary_key=True) # sha256 of the token
+  expires_at = Column(UTCDateTime, nullable=True, index=True) # the token's exp, after which the row is pruned; NULL if it has none
+
+class Blob(Base):
+  __tablename__ = "blobs"
+
+  # one stored S3 object, shared by every File with the same content (see app/services/blobs.py)
+  sha256 = Column(String(64), primary_key=True) # hex digest of the content
+  s3_key = Column(String, nullable=False) # blobs/<sha256>
+  size = Column(BigInteger, nullable=False)
+  refcount = Column(Integer, nullable=False, default=0) # File rows pointing at this blob; the object is deleted at 0
+  created_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
 class File(Base):
   __tablename__ = "files"
 
@@ -36,11 +78,21 @@ class File(Base):
   s3_key = Column(String, nullable=False) # unique identifier for the file in S3
   user_id = Column(Integer, nullable=False) # user id of the owner (extract from JWT token)
   content_type = Column(String, nullable=True) # MIME type of the file (e.g. "application/pdf", "image/png")
-  uploaded_at = Column(DateTime, nullable=False, default=datetime.now(timezone.utc)) # timestamp of when the file was uploaded
+  uploaded_at = Column(UTCDateTime, nullable=False, default=datetime.now(timezone.utc)) # timestamp of when the file was uploaded
   folder_id = Column(Integer, ForeignKey('study_folders.id'), nullable=False)
+  blob_sha256 = Column(String(64), ForeignKey('blobs.sha256'), nullable=True, index=True) # shared content; None for files stored under their own key
 
   folder = relationship("StudyFolder", back_populates="files") # back-reference to the folder it belongs to
 
+  __table_args__ = (
+    # duplicate-name checks on upload, and what stops two concurrent uploads taking the same name
+    Index("uq_files_folder_id_filename", "folder_id", "filename", unique=True),
+    Index("ix_files_folder_id_id", "folder_id", "id"), # a folder's files, page by page
+    # a file stored under its own key is recorded once, however many times its upload is completed;
+    # files sharing a blob share its key
+    Index("uq_files_s3_key", "s3_key", unique=True, postgresql_where=text("blob_sha256 IS NULL"), sqlite_where=text("blob_sha256 IS NULL")),
+  )
+
 class StudyFolder(Base):
   __tablename__ = "study_folders"
 
@@ -48,13 +100,17 @@ class StudyFolder(Base):
   name = Column(String, nullable=False)
   user_id = Column(Integer, nullable=False)  # Owner of the folder
   description = Column(String, nullable=True)
-  created_at = Column(DateTime, nullable=False, default=datetime.now(timezone.utc))
-  updated_at = Column(DateTime, nullable=False, default=datetime.now(timezone.utc))
+  created_at = Column(UTCDateTime, nullable=False, default=datetime.now(timezone.utc))
+  updated_at = Column(UTCDateTime, nullable=False, default=datetime.now(timezone.utc))
 
   files = relationship("File", back_populates="folder")
   flashcards = relationship("Flashcard", back_populates="folder")
   shares = relationship("FolderShare", back_populates="folder")
 
+  __table_args__ = (
+    Index("ix_study_folders_user_id_name", "user_id", "name"), # a user's folders, and their Default folder by name
+  )
+
 class Flashcard(Base):
   __tablename__ = "flashcards"
 
@@ -62,12 +118,18 @@ class Flashcard(Base):
   question = Column(String, nullable=False)
   answer = Column(String, nullable=False)
   user_id = Column(Integer, nullable=False)
-  created_at = Column(DateTime, nullable=False, default=datetime.now(timezone.utc))
-  updated_at = Column(DateTime, nullable=False, default=datetime.now(timezone.utc))
+  created_at = Column(UTCDateTime, nullable=False, default=datetime.now(timezone.utc))
+  updated_at = Column(UTCDateTime, nullable=False, default=datetime.now(timezone.utc))
   folder_id = Column(Integer, ForeignKey('study_folders.id'), nullable=False)
   
   folder = relationship("StudyFolder", back_populates="flashcards")
 
+  # keyset pagination reads these in id order for one folder or author
+  __table_args__ = (
+    Index("ix_flashcards_folder_id_id", "folder_id", "id"),
+    Index("ix_flashcards_user_id_id", "user_id", "id"),
+  )
+
 class FolderShare(Base):
   __tablename__ = "folder_shares"
   
@@ -75,10 +137,86 @@ class FolderShare(Base):
   folder_id = Column(Integer, ForeignKey('study_folders.id'), nullable=False)
   user_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # User who has access (can be null for invitations to non-registered users)
   permission_type = Column(String, nullable=False, default=PermissionType.READ.value)  # read, edit, admin
-  created_at = Column(DateTime, nullable=False, default=datetime.now(timezone.utc))
-  updated_at = Column(DateTime, nullable=False, default=datetime.now(timezone.utc))
+  created_at = Column(UTCDateTime, nullable=False, default=datetime.now(timezone.utc))
+  updated_at = Column(UTCDateTime, nullable=False, default=datetime.now(timezone.utc))
   invitation_accepted = Column(Boolean, nullable=False, default=False)
   invitation_email = Column(String, nullable=True)  # Used for invitations to users not yet registered
   
   folder = relationship("StudyFolder", back_populates="shares")
   user = relationship("User")
+
+  __table_args__ = (
+    Index("ix_folder_shares_folder_id_user_id_accepted", "folder_id", "user_id", "invitation_accepted"), # a user's share of a folder
+    Index("ix_folder_shares_invitation_email_accepted", "invitation_email", "invitation_accepted"), # pending invitations for an email
+  )
+
+class FolderACL(Base):
+  __tablename__ = "folder_acl"
+
+  # one row per user with access to a folder, kept in sync with folders and accepted shares (see app/services/acl.py)
+  user_id = Column(Integer, primary_key=True)
+  folder_id = Column(Integer, ForeignKey('study_folders.id', ondelete="CASCADE"), primary_key=True, index=True)
+  permission_rank = Column(Integer, nullable=False) # PERMISSION_RANKS value: 1 read, 2 edit, 3 admin, 4 owner
+
+class UploadStatus(enum.Enum):
+    OPEN = "open"
+    COMPLETED = "completed"
+    ABORTED = "aborted"
+
+class UploadSession(Base):
+  __tablename__ = "upload_sessions"
+
+  # a resumable upload backed by an S3 multipart upload (see app/routes/uploads.py)
+  id = Column(String(32), primary_key=True) # random hex, doubles as the client's handle on the upload
+  user_id = Column(Integer, nullable=False, index=True)
+  folder_id = Column(Integer, ForeignKey('study_folders.id', ondelete="CASCADE"), nullable=False)
+  filename = Column(String, nullable=False)
+  content_type = Column(String, nullable=False)
+  size = Column(BigInteger, nullable=False) # total bytes the client declared
+  part_size = Column(Integer, nullable=False) # bytes per part, the last one may be shorter
+  s3_key = Column(String, nullable=False)
+  s3_upload_id = Column(String, nullable=False)
+  status = Column(String, nullable=False, default=UploadStatus.OPEN.value) # open, completed, aborted
+  file_id = Column(Integer, ForeignKey('files.id', ondelete="SET NULL"), nullable=True) # set once completed
+  created_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+  updated_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+  expires_at = Column(UTCDateTime, nullable=False) # parts are refused after this
+
+  parts = relationship("UploadPart", order_by="UploadPart.part_number", cascade="all, delete-orphan", passive_deletes=True)
+
+class UploadPart(Base):
+  __tablename__ = "upload_parts"
+
+  # one acknowledged part of an upload session
+  session_id = Column(String(32), ForeignKey('upload_sessions.id', ondelete="CASCADE"), primary_key=True)
+  part_number = Column(Integer, primary_key=True) # 1-based
+  size = Column(Integer, nullable=False)
+  etag = Column(String, nullable=False) # returned by S3, needed to assemble the object
+  created_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+class FlashcardJob(Base):
+  __tablename__ = "flashcard_jobs"
+
+  id = Column(Integer, primary_key=True, index=True)
+  user_id = Column(Integer, nullable=False) # user who requested the generation
+  folder_id = Column(Integer, ForeignKey('study_folders.id'), nullable=False) # folder the cards are written to
+  topic = Column(String, nullable=False)
+  focus = Column(String, nullable=True)
+  num_flashcards = Column(Integer, nullable=False)
+  status = Column(String, nullable=False, default=JobStatus.PENDING.value) # pending, running, completed, failed
+  cards_created = Column(Integer, nullable=False, default=0)
+  error = Column(String, nullable=True) # failure reason shown to the user
+  created_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+  updated_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+class LLMCacheEntry(Base):
+  __tablename__ = "llm_cache"
+
+  key = Column(String(64), primary_key=True) # sha256 of the normalized prompt inputs
+  kind = Column(String, nullable=False) # flashcards or chat
+  model = Column(String, nullable=False)
+  value = Column(Text, nullable=False) # JSON encoded result
+  hits = Column(Integer, nullable=False, default=0)
+  created_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+  last_used_at = Column(UTCDateTime, nullable=False, index=True, default=lambda: datetime.now(timezone.utc)) # drives LRU eviction
+  expires_at = Column(UTCDateTime, nullable=False, index=True)
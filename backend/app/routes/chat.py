@@ -1,5 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException
-from app.utils.gpt import generate_response
+import json
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from openai import APITimeoutError
+from app.utils.gpt import generate_response, stream_response
 from app.auth import get_current_user
 from app import models
 from pydantic import BaseModel
@@ -15,7 +19,44 @@ async def chat(
     current_user: models.User = Depends(get_current_user)
 ):
     try:
-        response = generate_response(chat_message.message)
+        response = await generate_response(chat_message.message)
         return {"response": response}
+    except APITimeoutError:
+        raise HTTPException(status_code=504, detail="The assistant took too long to respond")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _sse(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+# Same as /chat but sends the answer as Server-Sent Events while the model writes it
+# Each token arrives as `data: {"delta": ...}`, followed by `event: done` (or `event: error`)
+@router.post("/chat/stream")
+async def chat_stream(
+    chat_message: ChatMessage,
+    request: Request,
+    current_user: models.User = Depends(get_current_user)
+):
+    async def events():
+        deltas = stream_response(chat_message.message)
+        try:
+            async for delta in deltas:
+                if await request.is_disconnected():
+                    return
+                yield _sse({"delta": delta})
+            yield _sse({}, event="done")
+        except APITimeoutError:
+            yield _sse({"detail": "The assistant took too long to respond"}, event="error")
+        except Exception as e:
+            yield _sse({"detail": str(e)}, event="error")
+        finally:
+            # runs on disconnect too; closing the generator aborts the upstream call
+            with anyio.CancelScope(shield=True):
+                await deltas.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
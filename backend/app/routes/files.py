@@ -1,93 +1,94 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db, get_async_db
 from app import models
-from app.services.s3 import upload_file, generate_presigned_url
+from app.services.s3 import delete_object, upload_file, generate_presigned_url, object_url
+from app.services.blobs import blob_key, claim_blobs, delete_released_objects, hash_file, release_blobs
+from app.services.uploads import add_files, default_folder_id
 from app.auth import get_current_user
-from uuid import uuid4
-from datetime import datetime, timezone
-import os
+from app.utils.pagination import Page, keyset, page_of, page_params
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+from urllib.parse import quote
 from typing import List
 # group all /files endpoints together
 router = APIRouter()
 
-# get all files from the postgresql database to the user
+# get a page of the files from the postgresql database to the user
 @router.get("/files")
-def get_files(db: Session = Depends(get_db)):
-  return db.query(models.File).all() # get all files from the postgresql database to the user
+def get_files(page: Page = Depends(page_params), db: Session = Depends(get_db)):
+  files, next_cursor = page_of(db.scalars(keyset(select(models.File), models.File.id, page)), page)
+  return {"files": files, "next_cursor": next_cursor}
 
 
-# Generate a unique S3 key under the user's folder
-# Upload the file to S3
-# Save the metadata and S3 key to the PostgreSQL database
+# Hash each file, store content we don't have yet under its content-addressed key
+# Save the metadata and blob reference to the PostgreSQL database
 # Return the file URL
 @router.post("/upload")
 async def upload_file_route(
     file: List[UploadFile] = File(...),
     folder_id: int = Form(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
     
-    user_id = str(current_user.id)
+    user_id = current_user.id
 
     # makes sure the folder exists and name it default if nothing provided
     if folder_id is None:
-        default_folder = db.query(models.StudyFolder).filter_by(user_id=user_id, name="Default").first()
-        if default_folder is None:
-            default_folder = models.StudyFolder(
-                name="Default",
-                user_id=user_id,
-                description="Default folder",
-                created_at=datetime.now(timezone.utc),
-                updated_at=datetime.now(timezone.utc)
-            )
-            db.add(default_folder)
-            db.commit()
-            db.refresh(default_folder)
-        folder_id = default_folder.id
-    uploaded_files = []
-    for f in file:
-      # make the filename unique if it already exists
-      original_filename = f.filename
-      base_name, extension = os.path.splitext(original_filename)
-      unique_filename = original_filename
-      duplicate_count = 1
-
-      # Check if the filename is unique in the folder and increment if needed 
-      while db.query(models.File).filter_by(folder_id=folder_id, filename=unique_filename).first():
-          unique_filename = f"{base_name} ({duplicate_count}){extension}"
-          duplicate_count += 1
-
-      # Generate a unique S3 key for storage
-      s3_key = f"{user_id}/{uuid4().hex}_{unique_filename}"
-
-      # Upload the file to S3
-      try:
-          url = await upload_file(f.file, s3_key)
-      except Exception as e:
-          raise HTTPException(status_code=500, detail=str(e))
-
-      # Save file metadata to the database
-      record = models.File(
-          filename=unique_filename,
-          s3_key=s3_key,
-          user_id=user_id,
-          content_type=f.content_type,
-          folder_id=folder_id,
-      )
-      db.add(record)
-      db.commit()
-      db.refresh(record)
-
-      # Return file info to the frontend
-      uploaded_files.append({
+        folder_id = await default_folder_id(db, user_id)
+    # hash the spooled uploads off the event loop; identical files share one S3 object
+    hashes = await asyncio.gather(*[run_in_threadpool(hash_file, f.file) for f in file])
+    created = await claim_blobs(db, hashes)
+
+    # Upload content S3 doesn't have yet concurrently, off the event loop (see app.services.s3.upload_file)
+    # Every transfer is waited for, even after one fails, so none is still running when we clean up
+    first_with_digest = {}
+    for f, (digest, _) in zip(file, hashes):
+      first_with_digest.setdefault(digest, f)
+    new_digests = sorted(created)
+    results = await asyncio.gather(
+      *[upload_file(first_with_digest[digest].file, blob_key(digest)) for digest in new_digests],
+      return_exceptions=True
+    )
+    stored = [blob_key(digest) for digest, result in zip(new_digests, results) if not isinstance(result, BaseException)]
+
+    try:
+        failures = [result for result in results if isinstance(result, BaseException)]
+        if failures:
+            raise HTTPException(status_code=500, detail=str(failures[0]))
+
+        # Save file metadata to the database, under names no other file in the folder has
+        records = await add_files(db, folder_id, [
+          models.File(
+              filename=f.filename,
+              s3_key=blob_key(digest),
+              user_id=user_id,
+              content_type=f.content_type,
+              folder_id=folder_id,
+              blob_sha256=digest,
+          )
+          for f, (digest, _) in zip(file, hashes)
+        ])
+        await db.commit()
+    except Exception:
+        # nothing was recorded, so remove what this request stored; the blob rows it created are
+        # still locked until the rollback, so no other upload can be counting on these objects yet
+        await asyncio.gather(*[run_in_threadpool(delete_object, key) for key in stored], return_exceptions=True)
+        await db.rollback()
+        raise
+
+    # Return file info to the frontend
+    return [
+      {
         "file_id": record.id,
-        "url": url,
+        "url": object_url(record.s3_key),
         "filename": record.filename
-      })
-
-    return uploaded_files
+      }
+      for record in records
+    ]
 
   # download the file from S3
 @router.get("/files/{file_id}/download")
@@ -106,7 +107,8 @@ def download_file(file_id: int, db: Session = Depends(get_db), current_user: mod
       record.s3_key, 
       expiration=3600,
       response_headers={
-        'ResponseContentDisposition': 'attachment',
+        # blob keys don't carry the name, so tell the browser what to save it as
+        'ResponseContentDisposition': f"attachment; filename*=UTF-8''{quote(record.filename)}",
         'ResponseContentType': record.content_type
       }
     )
@@ -142,14 +144,18 @@ def preview_file(file_id: int, db: Session = Depends(get_db), current_user: mode
   return {"url": signed_url}
 
 @router.delete("/files/{file_id}")
-def delete_file(file_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def delete_file(file_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
 
-  file = db.query(models.File).filter_by(id=file_id, user_id=current_user.id).first()
+  file = (await db.execute(select(models.File).where(models.File.id == file_id, models.File.user_id == current_user.id))).scalars().first()
   if not file:
     raise HTTPException(status_code=404, detail="File not found")
   
-  db.delete(file)
-  db.commit()
+  await db.delete(file)
+  await db.flush()
+  # the S3 object goes too once no other file shares it, but only after the delete is committed
+  freed = await release_blobs(db, {file.blob_sha256: 1}) if file.blob_sha256 else set()
+  await db.commit()
+  await delete_released_objects(db, freed)
   return {"message": "File deleted successfully"}
 
   
@@ -1,174 +1,145 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.database import get_db
+import json
+import anyio
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db, get_async_read_db
 from app import models
 from app.auth import get_current_user
-from app.schemas import FlashcardResponse, FlashcardCreate, FlashcardList, FlashcardGenerationRequest, FlashcardUpdate
-from app.utils.gpt import generate_flashcards
-from app.utils.permissions import verify_folder_access, verify_flashcard_access, verify_folder_ownership
+from app.schemas import FlashcardResponse, FlashcardCreate, FlashcardList, FlashcardGenerationRequest, FlashcardUpdate, JobResponse
+from app.services.jobs import enqueue_flashcard_job
+from app.services.flashcards import persist_in_batches
+from app.services.exports import ndjson_response
+from app.utils.gpt import stream_flashcards
+from app.utils.permissions import resolve_folder_access, resolve_flashcard_access, verify_folder_access, verify_flashcard_access, shared_folder_ids
+from app.utils.pagination import Page, keyset, page_of, page_params
 from datetime import datetime, timezone
-from typing import List
 
 router = APIRouter()
 
-@router.get("/folders/{folder_id}/flashcards", response_model=List[FlashcardResponse])
-def get_flashcards(folder_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+@router.get("/folders/{folder_id}/flashcards", response_model=FlashcardList)
+async def get_flashcards(folder_id: int, page: Page = Depends(page_params), db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(get_current_user)):
     # Verify folder exists and user has at least read access
-    folder = verify_folder_access(db, folder_id, current_user.id, ["owner", "write", "read"])
-    
-    flashcards = db.query(models.Flashcard).filter(models.Flashcard.folder_id == folder_id).all()
-    return flashcards
+    await verify_folder_access(db, folder_id, current_user.id)
+
+    result = await db.execute(keyset(select(models.Flashcard).where(models.Flashcard.folder_id == folder_id), models.Flashcard.id, page))
+    flashcards, next_cursor = page_of(result.scalars(), page)
+    return {"flashcards": flashcards, "next_cursor": next_cursor}
+
+# Every flashcard in the folder as newline-delimited JSON, streamed without loading them all at once
+@router.get("/folders/{folder_id}/flashcards/export")
+async def export_flashcards(folder_id: int, db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(get_current_user)):
+    await verify_folder_access(db, folder_id, current_user.id)
+
+    query = select(
+        models.Flashcard.id, models.Flashcard.question, models.Flashcard.answer, models.Flashcard.user_id,
+        models.Flashcard.folder_id, models.Flashcard.created_at, models.Flashcard.updated_at
+    ).where(models.Flashcard.folder_id == folder_id).order_by(models.Flashcard.id)
+    return ndjson_response(query, current_user.id, f"folder-{folder_id}-flashcards.ndjson")
 
 @router.post("/folders/{folder_id}/flashcards", response_model=FlashcardResponse)
-def create_flashcard(
+async def create_flashcard(
     folder_id: int,
     flashcard_data: FlashcardCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # Verify folder exists and user has write access
-    folder = verify_folder_access(db, folder_id, current_user.id, ["owner", "write"])
-    
+    await verify_folder_access(db, folder_id, current_user.id, ["edit", "admin"])
+
     flashcard = models.Flashcard(
-        front=flashcard_data.front,
-        back=flashcard_data.back,
-        difficulty=flashcard_data.difficulty,
-        folder_id=folder_id
+        question=flashcard_data.question,
+        answer=flashcard_data.answer,
+        folder_id=folder_id,
+        user_id=current_user.id
     )
     db.add(flashcard)
-    db.commit()
-    db.refresh(flashcard)
-    
-    return flashcard
+    await db.commit()
+    await db.refresh(flashcard)
 
-@router.get("/flashcards/{flashcard_id}", response_model=FlashcardResponse)
-def get_flashcard(
-    flashcard_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    flashcard = verify_flashcard_access(db, flashcard_id, current_user.id, ["owner", "write", "read"])
     return flashcard
 
-@router.put("/flashcards/{flashcard_id}", response_model=FlashcardResponse)
-def update_flashcard(
+@router.get("/flashcards/{flashcard_id}", response_model=FlashcardResponse)
+async def get_flashcard(
     flashcard_id: int,
-    flashcard_data: FlashcardUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    flashcard = verify_flashcard_access(db, flashcard_id, current_user.id, ["owner", "write"])
-    
-    if flashcard_data.front is not None:
-        flashcard.front = flashcard_data.front
-    if flashcard_data.back is not None:
-        flashcard.back = flashcard_data.back
-    if flashcard_data.difficulty is not None:
-        flashcard.difficulty = flashcard_data.difficulty
-    
-    flashcard.updated_at = datetime.now(timezone.utc)
-    db.commit()
-    db.refresh(flashcard)
-    
+    flashcard = await verify_flashcard_access(db, flashcard_id, current_user.id)
     return flashcard
 
-@router.delete("/flashcards/{flashcard_id}", status_code=204)
-def delete_flashcard(
-    flashcard_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    flashcard = verify_flashcard_access(db, flashcard_id, current_user.id, ["owner", "write"])
-    
-    db.delete(flashcard)
-    db.commit()
-    
-    return {"message": "Flashcard deleted successfully"}
-
-@router.post("/folders/{folder_id}/flashcards", response_model=FlashcardList)
-def create_flashcards(folder_id: int, flashcard_data: FlashcardGenerationRequest, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-  # Check if folder exists and user is the owner
-  folder = db.query(models.StudyFolder).filter(models.StudyFolder.id == folder_id, models.StudyFolder.user_id == current_user.id).first()
-  
-  # If user is not the owner, check if they have shared access with edit or admin permissions
-  if not folder:
-    # Check for shared access with edit permissions
-    shared_access = db.query(models.FolderShare).filter(
-      models.FolderShare.folder_id == folder_id,
-      models.FolderShare.user_id == current_user.id,
-      models.FolderShare.invitation_accepted == True,
-      models.FolderShare.permission_type.in_(["edit", "admin"])
-    ).first()
-    
-    # If no edit access, folder not found or not accessible
-    if not shared_access:
-      raise HTTPException(status_code=404, detail="Folder not found or you don't have edit permission")
-    
-    # Double-check folder exists
-    folder = db.query(models.StudyFolder).filter(models.StudyFolder.id == folder_id).first()
-    if not folder:
-      raise HTTPException(status_code=404, detail="Folder not found")
-  
-  flashcards = generate_flashcards(flashcard_data.topic, flashcard_data.num_flashcards)
-  created_flashcards = []
-
-  for flashcard in flashcards:
-    flashcard_create = models.Flashcard(
-      question = flashcard["question"],
-      answer = flashcard["answer"],
-      folder_id = folder_id,
-      user_id = current_user.id
-    )
-    db.add(flashcard_create)
-    created_flashcards.append(flashcard_create)
-
-  db.commit()
-  for flashcard in created_flashcards:
-    db.refresh(flashcard)
-
-  return {"flashcards": created_flashcards}
+@router.post("/folders/{folder_id}/flashcards/generate", response_model=JobResponse, status_code=202)
+async def create_flashcards(folder_id: int, flashcard_data: FlashcardGenerationRequest, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  # Owner, or shared access with edit or admin permissions
+  await verify_folder_access(db, folder_id, current_user.id, ["edit", "admin"])
+
+  # generation runs in the worker pool so this request doesn't hold a connection during the LLM call
+  job = models.FlashcardJob(
+    user_id = current_user.id,
+    folder_id = folder_id,
+    topic = flashcard_data.topic,
+    focus = flashcard_data.focus,
+    num_flashcards = flashcard_data.num_flashcards
+  )
+  db.add(job)
+  await db.commit()
+  await db.refresh(job)
+
+  enqueue_flashcard_job(job.id)
+  return job
+
+# Generate flashcards and stream them back as newline-delimited JSON while the model writes them
+# Cards are saved in small batches, each line is {"flashcard": {...}} for a saved card,
+# and the stream ends with {"done": true, "cards_created": n} or {"error": "..."}
+@router.post("/folders/{folder_id}/flashcards/generate/stream")
+async def stream_generated_flashcards(folder_id: int, flashcard_data: FlashcardGenerationRequest, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  await verify_folder_access(db, folder_id, current_user.id, ["edit", "admin"])
+  user_id = current_user.id
+
+  async def lines():
+    flashcards = stream_flashcards(flashcard_data.topic, flashcard_data.num_flashcards, flashcard_data.focus)
+    batches = persist_in_batches(flashcards, folder_id, user_id)
+    cards_created = 0
+    try:
+      async for saved in batches:
+        cards_created += len(saved)
+        for flashcard in saved:
+          yield json.dumps({"flashcard": flashcard.model_dump(mode="json")}) + "\n"
+      yield json.dumps({"done": True, "cards_created": cards_created}) + "\n"
+    except Exception as e:
+      yield json.dumps({"error": str(e), "cards_created": cards_created}) + "\n"
+    finally:
+      # a client that hangs up stops generation; batches already saved are kept
+      with anyio.CancelScope(shield=True):
+        await batches.aclose()
+        await flashcards.aclose()
+
+  return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @router.get("/flashcards", response_model=FlashcardList)
-def get_all_flashcards(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-  # Get all flashcards the user directly owns
-  own_flashcards = db.query(models.Flashcard).filter(models.Flashcard.user_id == current_user.id).all()
-  
-  # Get folder IDs where the user has shared access
-  shared_folder_ids = db.query(models.FolderShare.folder_id).filter(
-    models.FolderShare.user_id == current_user.id,
-    models.FolderShare.invitation_accepted == True
-  ).distinct()
-  
-  # Get flashcards from shared folders
-  shared_flashcards = db.query(models.Flashcard).filter(
-    models.Flashcard.folder_id.in_(shared_folder_ids)
-  ).all()
-  
-  # Combine both sets of flashcards
-  all_flashcards = own_flashcards + shared_flashcards
-  
-  return {"flashcards": all_flashcards}
+async def get_all_flashcards(page: Page = Depends(page_params), db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(get_current_user)):
+  # Flashcards the user created, plus every flashcard in folders shared with them; cards
+  # collaborators added to the user's own folders are listed per folder, not here
+  result = await db.execute(keyset(
+    select(models.Flashcard).where(or_(
+      models.Flashcard.user_id == current_user.id,
+      models.Flashcard.folder_id.in_(shared_folder_ids(current_user.id))
+    )),
+    models.Flashcard.id, page
+  ))
+  flashcards, next_cursor = page_of(result.scalars(), page)
+  return {"flashcards": flashcards, "next_cursor": next_cursor}
 
 @router.post("/flashcards", response_model=FlashcardResponse)
-def create_individual_flashcard(flashcard_data: FlashcardCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-  # Check if the folder exists
-  folder = db.query(models.StudyFolder).filter(models.StudyFolder.id == flashcard_data.folder_id).first()
-  if not folder:
+async def create_individual_flashcard(flashcard_data: FlashcardCreate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  # Check the folder exists and the user is its owner or has edit permission
+  access = await resolve_folder_access(db, flashcard_data.folder_id, current_user.id)
+  if not access.folder:
     raise HTTPException(status_code=404, detail="Folder not found")
-  
-  # Check if user is folder owner or has edit permission
-  if folder.user_id != current_user.id:
-    # Check for shared access with edit permissions
-    shared_access = db.query(models.FolderShare).filter(
-      models.FolderShare.folder_id == flashcard_data.folder_id,
-      models.FolderShare.user_id == current_user.id,
-      models.FolderShare.invitation_accepted == True,
-      models.FolderShare.permission_type.in_(["edit", "admin"])
-    ).first()
-    
-    if not shared_access:
-      raise HTTPException(status_code=403, detail="Not authorized to create flashcards in this folder")
-  
+  if not access.allows(["edit", "admin"]):
+    raise HTTPException(status_code=403, detail="Not authorized to create flashcards in this folder")
+
   flashcard = models.Flashcard(
     question = flashcard_data.question,
     answer = flashcard_data.answer,
@@ -176,110 +147,51 @@ def create_individual_flashcard(flashcard_data: FlashcardCreate, db: Session = D
     user_id = current_user.id
   )
   db.add(flashcard)
-  db.commit()
-  db.refresh(flashcard)
+  await db.commit()
+  await db.refresh(flashcard)
   return flashcard
 
 @router.put("/flashcards/{id}", response_model=FlashcardResponse)
-def update_flashcard(id: int, flashcard_data: FlashcardUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-  # First get the existing flashcard
-  existing_flashcard = db.query(models.Flashcard).filter(models.Flashcard.id == id).first()
+async def update_flashcard(id: int, flashcard_data: FlashcardUpdate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  # Get the existing flashcard with the user's access to its folder
+  existing_flashcard, current_access = await resolve_flashcard_access(db, id, current_user.id)
   if not existing_flashcard:
     raise HTTPException(status_code=404, detail="Flashcard not found")
-  
-  # Check current folder permissions
-  current_folder = db.query(models.StudyFolder).filter(models.StudyFolder.id == existing_flashcard.folder_id).first()
-  if not current_folder:
-    raise HTTPException(status_code=404, detail="Associated folder not found")
-    
+
   # Check if user has edit permission on current folder (owner or shared edit/admin access)
-  has_current_folder_permission = False
-  if current_folder.user_id == current_user.id: # if user is the owner of the folder
-    has_current_folder_permission = True
-  else:
-    # Check for shared access with edit permissions
-    shared_access = db.query(models.FolderShare).filter(
-      models.FolderShare.folder_id == existing_flashcard.folder_id,
-      models.FolderShare.user_id == current_user.id,
-      models.FolderShare.invitation_accepted == True,
-      models.FolderShare.permission_type.in_(["edit", "admin"])
-    ).first()
-    
-    if shared_access:
-      has_current_folder_permission = True
-      
-  if not has_current_folder_permission:
+  if not current_access.allows(["edit", "admin"]):
     raise HTTPException(status_code=403, detail="Not authorized to update this flashcard")
-  
+
   # Update fields if provided
   if flashcard_data.question is not None:
     existing_flashcard.question = flashcard_data.question
   if flashcard_data.answer is not None:
     existing_flashcard.answer = flashcard_data.answer
   if flashcard_data.folder_id is not None:
-    # Check if user has access to the target folder they're moving the flashcard to
-    target_folder = db.query(models.StudyFolder).filter(models.StudyFolder.id == flashcard_data.folder_id).first()
-    if not target_folder:
+    # Check if user has edit permission on the target folder they're moving the flashcard to
+    target_access = await resolve_folder_access(db, flashcard_data.folder_id, current_user.id)
+    if not target_access.folder:
       raise HTTPException(status_code=404, detail="Target folder not found")
-    
-    # Check if user has edit permission on target folder (either owner or shared edit/admin access)
-    has_target_folder_permission = False
-    if target_folder.user_id == current_user.id:
-      has_target_folder_permission = True
-    else:
-      # Check for edit permission on target folder
-      target_access = db.query(models.FolderShare).filter(
-        models.FolderShare.folder_id == flashcard_data.folder_id,
-        models.FolderShare.user_id == current_user.id,
-        models.FolderShare.invitation_accepted == True,
-        models.FolderShare.permission_type.in_(["edit", "admin"])
-      ).first()
-      
-      if target_access:
-        has_target_folder_permission = True
-        
-    if not has_target_folder_permission:
+    if not target_access.allows(["edit", "admin"]):
       raise HTTPException(status_code=403, detail="Not authorized to move flashcard to target folder")
-    
+
     existing_flashcard.folder_id = flashcard_data.folder_id
-  
-  db.commit()
-  db.refresh(existing_flashcard)
+
+  existing_flashcard.updated_at = datetime.now(timezone.utc)
+  await db.commit()
+  await db.refresh(existing_flashcard)
   return existing_flashcard
 
 @router.delete("/flashcards/{id}", status_code=204)
-def delete_flashcard(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-  flashcard = db.query(models.Flashcard).filter(models.Flashcard.id == id).first()
+async def delete_flashcard(id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  flashcard, access = await resolve_flashcard_access(db, id, current_user.id)
   if not flashcard:
     raise HTTPException(status_code=404, detail="Flashcard not found")
-  
-  # Check folder permissions
-  folder = db.query(models.StudyFolder).filter(models.StudyFolder.id == flashcard.folder_id).first()
-  if not folder:
-    raise HTTPException(status_code=404, detail="Associated folder not found")
-    
+
   # Check if user has admin permission on folder (either owner or shared admin access)
-  has_admin_permission = False
-  if folder.user_id == current_user.id:
-    has_admin_permission = True
-  else:
-    # Check for shared access with admin permissions
-    shared_access = db.query(models.FolderShare).filter(
-      models.FolderShare.folder_id == flashcard.folder_id,
-      models.FolderShare.user_id == current_user.id,
-      models.FolderShare.invitation_accepted == True,
-      models.FolderShare.permission_type == "admin"
-    ).first()
-    
-    if shared_access:
-      has_admin_permission = True
-      
-  if not has_admin_permission:
+  if not access.allows(["admin"]):
     raise HTTPException(status_code=403, detail="Not authorized to delete this flashcard")
-  
-  db.delete(flashcard)
-  db.commit()
-  return {"message": "Flashcard deleted successfully"}
-
-
 
+  await db.delete(flashcard)
+  await db.commit()
+  return {"message": "Flashcard deleted successfully"}
@@ -1,31 +1,36 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db, get_async_read_db
 from app import models
 from app.auth import get_current_user
 from app.schemas import ShareResponse, ShareCreate, ShareList, ShareUpdate
+from app.utils.permissions import resolve_folder_access, invalidate_permissions
+from app.utils.pagination import Page, keyset, page_of, page_params
+from app.services.exports import ndjson_response
 from datetime import datetime, timezone
 router = APIRouter()
 
 
 @router.post("/folders/{folder_id}/share", response_model=ShareResponse)
-def share_folder(folder_id: int, share_data: ShareCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def share_folder(folder_id: int, share_data: ShareCreate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
   # Verify folder exists and user is the owner
-  folder = db.query(models.StudyFolder).filter(models.StudyFolder.id == folder_id, models.StudyFolder.user_id == current_user.id).first()
-  if not folder:
+  access = await resolve_folder_access(db, folder_id, current_user.id)
+  if access.permission != "owner":
     raise HTTPException(status_code=404, detail="Folder not found or you don't have permission")
+  folder = access.folder
   
   # Check if a share already exists for this email and folder
-  existing_share = db.query(models.FolderShare).filter(
+  existing_share = (await db.execute(select(models.FolderShare).where(
     models.FolderShare.folder_id == folder_id,
     models.FolderShare.invitation_email == share_data.user_email
-  ).first()
+  ))).scalars().first()
   
   if existing_share:
     raise HTTPException(status_code=400, detail="A share invitation already exists for this email")
   
   # Check if user exists
-  user = db.query(models.User).filter(models.User.email == share_data.user_email).first()
+  user = (await db.execute(select(models.User).where(models.User.email == share_data.user_email))).scalars().first()
   
   if user:
     # Create share for existing user
@@ -47,8 +52,10 @@ def share_folder(folder_id: int, share_data: ShareCreate, db: Session = Depends(
     )
     
   db.add(new_share)
-  db.commit()
-  db.refresh(new_share)
+  await db.commit()
+  await db.refresh(new_share)
+  if new_share.user_id is not None:
+    await invalidate_permissions(folder_id, new_share.user_id)
   
   # TODO: Send invitation email 
   print(f"Would send invitation email to {share_data.user_email} for folder {folder.name}")
@@ -56,72 +63,80 @@ def share_folder(folder_id: int, share_data: ShareCreate, db: Session = Depends(
   return new_share
 
 @router.get("/folders/{folder_id}/shares", response_model=ShareList)
-def get_folder_shares(
+async def get_folder_shares(
     folder_id: int,
-    db: Session = Depends(get_db),
+    page: Page = Depends(page_params),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # Verify folder exists and user is the owner
-    folder = db.query(models.StudyFolder).filter(
-        models.StudyFolder.id == folder_id,
-        models.StudyFolder.user_id == current_user.id
-    ).first()
+    access = await resolve_folder_access(db, folder_id, current_user.id)
     
-    if not folder:
+    if access.permission != "owner":
         raise HTTPException(status_code=404, detail="Folder not found or you don't have permission")
     
-    # Get all shares for this folder
-    shares = db.query(models.FolderShare).filter(
-        models.FolderShare.folder_id == folder_id
-    ).all()
+    # Get a page of the shares for this folder
+    result = await db.execute(keyset(
+        select(models.FolderShare).where(models.FolderShare.folder_id == folder_id),
+        models.FolderShare.id, page
+    ))
+    shares, next_cursor = page_of(result.scalars(), page)
     
-    return {"shares": shares}
+    return {"shares": shares, "next_cursor": next_cursor}
+
+# Every share of the folder as newline-delimited JSON, streamed without loading them all at once
+@router.get("/folders/{folder_id}/shares/export")
+async def export_folder_shares(
+    folder_id: int,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # Verify folder exists and user is the owner
+    access = await resolve_folder_access(db, folder_id, current_user.id)
+    
+    if access.permission != "owner":
+        raise HTTPException(status_code=404, detail="Folder not found or you don't have permission")
+    
+    query = select(
+        models.FolderShare.id, models.FolderShare.folder_id, models.FolderShare.user_id, models.FolderShare.permission_type,
+        models.FolderShare.invitation_accepted, models.FolderShare.invitation_email,
+        models.FolderShare.created_at, models.FolderShare.updated_at
+    ).where(models.FolderShare.folder_id == folder_id).order_by(models.FolderShare.id)
+    return ndjson_response(query, current_user.id, f"folder-{folder_id}-shares.ndjson")
 
 @router.get("/shares/{share_id}", response_model=ShareResponse)
-def get_share(
+async def get_share(
     share_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # First get the share
-    share = db.query(models.FolderShare).filter(
-        models.FolderShare.id == share_id
-    ).first()
+    # Get the share together with the owner of its folder
+    share, folder_owner_id = await _get_share_with_owner(db, share_id)
     
     if not share:
         raise HTTPException(status_code=404, detail="Share not found")
     
     # Then check if current user is either owner of the folder or the recipient
-    folder = db.query(models.StudyFolder).filter(
-        models.StudyFolder.id == share.folder_id
-    ).first()
-    
-    if folder.user_id != current_user.id and share.user_id != current_user.id:
+    if folder_owner_id != current_user.id and share.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to view this share")
     
     return share
 
 @router.put("/shares/{share_id}", response_model=ShareResponse)
-def update_share(
+async def update_share(
     share_id: int,
     share_data: ShareUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # First get the share
-    share = db.query(models.FolderShare).filter(
-        models.FolderShare.id == share_id
-    ).first()
+    # Get the share together with the owner of its folder
+    share, folder_owner_id = await _get_share_with_owner(db, share_id)
     
     if not share:
         raise HTTPException(status_code=404, detail="Share not found")
     
     # Check if current user is the folder owner
-    folder = db.query(models.StudyFolder).filter(
-        models.StudyFolder.id == share.folder_id
-    ).first()
-    
-    if folder.user_id != current_user.id:
+    if folder_owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Only folder owner can update shares")
     
     # Update permission type if provided
@@ -130,50 +145,48 @@ def update_share(
     
     share.updated_at = datetime.now(timezone.utc)
     
-    db.commit()
-    db.refresh(share)
+    await db.commit()
+    await db.refresh(share)
+    if share.user_id is not None:
+        await invalidate_permissions(share.folder_id, share.user_id)
     
     return share
 
 @router.delete("/shares/{share_id}", status_code=204)
-def delete_share(
+async def delete_share(
     share_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # First get the share
-    share = db.query(models.FolderShare).filter(
-        models.FolderShare.id == share_id
-    ).first()
+    # Get the share together with the owner of its folder
+    share, folder_owner_id = await _get_share_with_owner(db, share_id)
     
     if not share:
         raise HTTPException(status_code=404, detail="Share not found")
     
     # Check if current user is the folder owner
-    folder = db.query(models.StudyFolder).filter(
-        models.StudyFolder.id == share.folder_id
-    ).first()
-    
-    if folder.user_id != current_user.id:
+    if folder_owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Only folder owner can delete shares")
     
-    db.delete(share)
-    db.commit()
+    await db.delete(share)
+    await db.commit()
+    if share.user_id is not None:
+        await invalidate_permissions(share.folder_id, share.user_id)
     
     return {"message": "Share deleted successfully"}
 
 @router.post("/shares/{share_id}/accept", response_model=ShareResponse)
-def accept_share(
+async def accept_share(
     share_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # First get the share
-    share = db.query(models.FolderShare).filter(
+    share = (await db.execute(select(models.FolderShare).where(
         models.FolderShare.id == share_id,
         models.FolderShare.invitation_email == current_user.email,
         models.FolderShare.invitation_accepted == False
-    ).first()
+    ))).scalars().first()
     
     if not share:
         raise HTTPException(status_code=404, detail="Share invitation not found or already accepted")
@@ -183,20 +196,35 @@ def accept_share(
     share.invitation_accepted = True
     share.updated_at = datetime.now(timezone.utc)
     
-    db.commit()
-    db.refresh(share)
+    await db.commit()
+    await db.refresh(share)
+    await invalidate_permissions(share.folder_id, current_user.id)
     
     return share
 
 @router.get("/pending-invitations", response_model=ShareList)
-def get_pending_invitations(
-    db: Session = Depends(get_db),
+async def get_pending_invitations(
+    page: Page = Depends(page_params),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # Get all pending share invitations for the current user's email
-    pending_invitations = db.query(models.FolderShare).filter(
-        models.FolderShare.invitation_email == current_user.email,
-        models.FolderShare.invitation_accepted == False
-    ).all()
-    
-    return {"shares": pending_invitations}
\ No newline at end of file
+    # Get a page of the pending share invitations for the current user's email
+    result = await db.execute(keyset(
+        select(models.FolderShare).where(
+            models.FolderShare.invitation_email == current_user.email,
+            models.FolderShare.invitation_accepted == False
+        ),
+        models.FolderShare.id, page
+    ))
+    pending_invitations, next_cursor = page_of(result.scalars(), page)
+    
+    return {"shares": pending_invitations, "next_cursor": next_cursor}
+
+# a share and the user id of its folder's owner, in one query; (None, None) if there is no such share
+async def _get_share_with_owner(db: AsyncSession, share_id: int):
+    result = await db.execute(
+        select(models.FolderShare, models.StudyFolder.user_id)
+        .join(models.StudyFolder, models.StudyFolder.id == models.FolderShare.folder_id)
+        .where(models.FolderShare.id == share_id)
+    )
+    return result.first() or (None, None)
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
+from app import models
+from app.auth import get_current_user
+from app.schemas import JobResponse
+router = APIRouter()
+
+# poll the progress of a background flashcard generation job
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  result = await db.execute(select(models.FlashcardJob).where(
+    models.FlashcardJob.id == job_id,
+    models.FlashcardJob.user_id == current_user.id
+  ))
+  job = result.scalars().first()
+  if not job:
+    raise HTTPException(status_code=404, detail="Job not found")
+  return job
@@ -0,0 +1,16 @@
+import os
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException
+from app.database import pool_status
+from app.utils import metrics
+router = APIRouter()
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") # callers must send it in X-Metrics-Token; unset hides the endpoint
+
+# counters and histograms for this process, plus a live view of each connection pool
+@router.get("/internal/metrics", include_in_schema=False)
+async def get_metrics(x_metrics_token: Optional[str] = Header(default=None)):
+  if not METRICS_TOKEN or not x_metrics_token or not secrets.compare_digest(x_metrics_token, METRICS_TOKEN):
+    raise HTTPException(status_code=404, detail="Not Found")
+  return {"pools": pool_status(), **metrics.snapshot()}
@@ -1,40 +1,59 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db, get_async_read_db
 from app import models
 from app.auth import get_current_user
 from app.schemas import FolderResponse, FolderCreate, FolderUpdate, FolderList
-from app.utils.permissions import verify_folder_ownership
+from app.utils.permissions import PERMISSION_NAMES, invalidate_permissions, verify_folder_ownership
+from app.utils.pagination import Page, keyset, page_of, page_params
+from app.services.exports import ndjson_response
+from app.services.blobs import delete_released_objects, release_blobs
 from datetime import datetime, timezone
 router = APIRouter()
 
 @router.get("/folders")
-def get_folder(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-  folders = db.query(models.StudyFolder).filter(models.StudyFolder.user_id == current_user.id).all()
-  return FolderList(folders=folders)
+async def get_folder(include_shared: bool = False, page: Page = Depends(page_params), db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(get_current_user)):
+  # the user's own folders, plus those they have accepted a share of with ?include_shared=true,
+  # each with the user's permission on it; folder_acl's (user_id, folder_id) key serves both the
+  # filter and the page order
+  query = (
+    select(models.StudyFolder, models.FolderACL.permission_rank)
+    .join(models.FolderACL, models.FolderACL.folder_id == models.StudyFolder.id)
+    .where(models.FolderACL.user_id == current_user.id)
+  )
+  if not include_shared:
+    query = query.where(models.FolderACL.permission_rank == models.PERMISSION_RANKS["owner"])
+  result = await db.execute(keyset(query, models.FolderACL.folder_id, page))
+  rows, next_cursor = page_of(result.all(), page, key=lambda row: row[0].id)
+  folders = [
+    FolderResponse.model_validate(folder).model_copy(update={"permission": PERMISSION_NAMES[rank]})
+    for folder, rank in rows
+  ]
+  return FolderList(folders=folders, next_cursor=next_cursor)
 
 @router.post("/folders", response_model=FolderResponse)
-def create_folder(folder_data: FolderCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def create_folder(folder_data: FolderCreate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
   new_folder = models.StudyFolder(
     name=folder_data.name,
     description=folder_data.description,
     user_id=current_user.id
   )
   db.add(new_folder)
-  db.commit()
-  db.refresh(new_folder)
+  await db.commit()
+  await db.refresh(new_folder)
   return new_folder
 
 @router.get("/folders/{folder_id}", response_model=FolderResponse)
-def get_folder_by_id(folder_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-  folder = verify_folder_ownership(db, folder_id, current_user.id)
+async def get_folder_by_id(folder_id: int, db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(get_current_user)):
+  folder = await verify_folder_ownership(db, folder_id, current_user.id)
   if not folder:
     raise HTTPException(status_code=404, detail="Folder not found")
   return folder
 
 @router.put("/folders/{folder_id}", response_model=FolderResponse)
-def update_folder(folder_id: int, folder_data: FolderUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-  folder = verify_folder_ownership(db, folder_id, current_user.id)
+async def update_folder(folder_id: int, folder_data: FolderUpdate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  folder = await verify_folder_ownership(db, folder_id, current_user.id)
   if not folder:
     raise HTTPException(status_code=404, detail="Folder not found")
 
@@ -45,35 +64,68 @@ def update_folder(folder_id: int, folder_data: FolderUpdate, db: Session = Depen
 
   folder.updated_at = datetime.now(timezone.utc)
 
-  db.commit()
-  db.refresh(folder)
+  await db.commit()
+  await db.refresh(folder)
 
   return folder
 
 @router.delete("/folders/{folder_id}", status_code=204)
-def delete_folder(folder_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-  folder = verify_folder_ownership(db, folder_id, current_user.id)
+async def delete_folder(folder_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  folder = await verify_folder_ownership(db, folder_id, current_user.id)
   if not folder:
     raise HTTPException(status_code=404, detail="Folder not found")
-  db.query(models.File).filter_by(folder_id = folder_id).delete()
-  db.commit()
-  db.delete(folder)
-  db.commit()
+  # remove everything that points at the folder with plain deletes; the ORM would
+  # otherwise lazy-load each relationship, which isn't possible on an async session
+  # (parts of unfinished uploads left in S3 are cleared by the bucket's multipart lifecycle rule)
+  sessions = select(models.UploadSession.id).where(models.UploadSession.folder_id == folder_id)
+  await db.execute(delete(models.UploadPart).where(models.UploadPart.session_id.in_(sessions)))
+  await db.execute(delete(models.UploadSession).where(models.UploadSession.folder_id == folder_id))
+  shared = await db.execute(
+    select(models.File.blob_sha256, func.count())
+    .where(models.File.folder_id == folder_id, models.File.blob_sha256.is_not(None))
+    .group_by(models.File.blob_sha256)
+  )
+  releases = dict(shared.all())
+  for model in (models.File, models.Flashcard, models.FolderShare, models.FlashcardJob, models.FolderACL):
+    await db.execute(delete(model).where(model.folder_id == folder_id))
+  await db.execute(delete(models.StudyFolder).where(models.StudyFolder.id == folder_id))
+  # with the files gone, drop their blob references and free content no other folder uses
+  freed = await release_blobs(db, releases)
+  await db.commit()
+  await invalidate_permissions(folder_id)
+  await delete_released_objects(db, freed)
   return {"message": "Folder deleted successfully"}
 
 
 @router.get("/folders/{folder_id}/files")
-def get_files_in_folder(folder_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-  folder = verify_folder_ownership(db, folder_id, current_user.id)
+async def get_files_in_folder(folder_id: int, page: Page = Depends(page_params), db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(get_current_user)):
+  folder = await verify_folder_ownership(db, folder_id, current_user.id)
   if not folder:
     raise HTTPException(status_code=404, detail="Folder not found")
-  
-  files = db.query(models.File).filter(models.File.folder_id == folder_id).all()
-  return [
+
+  result = await db.execute(keyset(select(models.File).where(models.File.folder_id == folder_id), models.File.id, page))
+  files, next_cursor = page_of(result.scalars(), page)
+  return {
+    "files": [
       {
           "id": file.id,
           "filename": file.filename,
           "url": file.s3_key,
       }
       for file in files
-  ]
+    ],
+    "next_cursor": next_cursor
+  }
+
+# Metadata of every file in the folder as newline-delimited JSON, streamed without loading it all at once
+@router.get("/folders/{folder_id}/files/export")
+async def export_files_in_folder(folder_id: int, db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(get_current_user)):
+  folder = await verify_folder_ownership(db, folder_id, current_user.id)
+  if not folder:
+    raise HTTPException(status_code=404, detail="Folder not found")
+
+  query = select(
+    models.File.id, models.File.filename, models.File.content_type, models.File.user_id,
+    models.File.folder_id, models.File.uploaded_at
+  ).where(models.File.folder_id == folder_id).order_by(models.File.id)
+  return ndjson_response(query, current_user.id, f"folder-{folder_id}-files.ndjson")
@@ -0,0 +1,339 @@
+import math
+import tempfile
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+from botocore.exceptions import ClientError
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
+from app import models
+from app.auth import get_current_user
+from app.schemas import (
+  FileUploadResponse, UploadComplete, UploadInitiate, UploadInitiateResponse, UploadSessionCreate, UploadSessionResponse
+)
+from app.services import s3
+from app.services.uploads import (
+  UPLOAD_MAX_SIZE, UPLOAD_PART_SPOOL_SIZE, UPLOAD_SESSION_TTL, UPLOAD_URL_EXPIRATION, UploadAlreadyRecorded, add_files,
+  create_upload_token, default_folder_id, part_size_for, read_upload_token, recorded_file
+)
+from app.utils.permissions import verify_folder_access
+
+# Direct uploads: the client sends the bytes to S3 itself and the API only signs and verifies.
+# Resumable uploads (/uploads/sessions): the client sends one part at a time through the API, which
+# remembers every acknowledged part so an interrupted upload continues from where it stopped
+router = APIRouter()
+
+# Reserve a key and return presigned POST fields, or one presigned URL per part for files above S3_MULTIPART_THRESHOLD
+@router.post("/uploads/initiate", response_model=UploadInitiateResponse)
+async def initiate_upload(upload: UploadInitiate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  _check_size(upload.size)
+  if upload.folder_id is None:
+    folder_id = await default_folder_id(db, current_user.id)
+  else:
+    await verify_folder_access(db, upload.folder_id, current_user.id, ["edit", "admin"])
+    folder_id = upload.folder_id
+
+  key = f"{current_user.id}/{uuid4().hex}_{upload.filename}"
+  claims = {"key": key, "folder_id": folder_id, "filename": upload.filename, "content_type": upload.content_type, "size": upload.size}
+
+  if upload.size <= s3.S3_MULTIPART_THRESHOLD:
+    post = s3.generate_presigned_post(key, upload.size, upload.content_type, expiration=UPLOAD_URL_EXPIRATION)
+    return UploadInitiateResponse(
+      upload_token=create_upload_token(current_user.id, {**claims, "md5": upload.md5}),
+      method="post",
+      url=post["url"],
+      fields=post["fields"]
+    )
+
+  part_size = part_size_for(upload.size)
+  part_count = math.ceil(upload.size / part_size)
+  upload_id = await run_in_threadpool(s3.create_multipart_upload, key, upload.content_type)
+  return UploadInitiateResponse(
+    upload_token=create_upload_token(current_user.id, {**claims, "upload_id": upload_id, "part_count": part_count}),
+    method="multipart",
+    part_size=part_size,
+    parts=[
+      {"part_number": number, "url": s3.generate_presigned_part_url(key, upload_id, number, expiration=UPLOAD_URL_EXPIRATION)}
+      for number in range(1, part_count + 1)
+    ]
+  )
+
+# Check the uploaded object matches what was initiated, then record the File
+# The size is always checked, the content only for single-request uploads given an md5: a multipart
+# object's ETag is derived from the part ETags the client reports, so it can't vouch for the bytes
+# Completing the same upload again, even concurrently, returns the file recorded the first time
+@router.post("/uploads/complete", response_model=FileUploadResponse)
+async def complete_upload(completion: UploadComplete, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  claims = read_upload_token(completion.upload_token, current_user.id)
+  key = claims["key"]
+
+  # the token outlives a share, so the folder must still be writable now
+  try:
+    await verify_folder_access(db, claims["folder_id"], current_user.id, ["edit", "admin"])
+  except HTTPException:
+    if not await recorded_file(db, [key]):
+      await run_in_threadpool(_discard_upload, claims)
+    raise
+
+  existing = await recorded_file(db, [key])
+  if existing:
+    return _file_response(existing)
+
+  expected_etag = claims.get("md5")
+  if "upload_id" in claims:
+    parts = sorted(completion.parts, key=lambda part: part.part_number)
+    if [part.part_number for part in parts] != list(range(1, claims["part_count"] + 1)):
+      raise HTTPException(status_code=400, detail="Every part must be listed exactly once")
+    try:
+      await run_in_threadpool(s3.complete_multipart_upload, key, claims["upload_id"], [(part.part_number, part.etag) for part in parts])
+    except ClientError as e:
+      # a concurrent completion may have assembled it already; the object checks below still apply
+      if not _assembled_elsewhere(e):
+        raise HTTPException(status_code=400, detail=f"Could not assemble the upload: {e.response['Error'].get('Message', e)}")
+
+  head = await run_in_threadpool(s3.head_object, key)
+  if head is None:
+    raise HTTPException(status_code=400, detail="Nothing was uploaded for this upload")
+  if head["ContentLength"] != claims["size"] or (expected_etag and head["ETag"].strip('"') != expected_etag):
+    # don't leave an object nobody will ever reference
+    await run_in_threadpool(s3.delete_object, key)
+    raise HTTPException(status_code=400, detail="Uploaded object doesn't match the size or checksum given at initiation")
+
+  record = models.File(
+    filename=claims["filename"],
+    s3_key=key,
+    user_id=current_user.id,
+    content_type=claims["content_type"],
+    folder_id=claims["folder_id"]
+  )
+  try:
+    await add_files(db, claims["folder_id"], [record])
+  except UploadAlreadyRecorded as e:
+    return _file_response(e.record)
+  await db.commit()
+  return _file_response(record)
+
+# Start a resumable upload; the client then PUTs parts of part_size bytes, in any order, until offset reaches size
+@router.post("/uploads/sessions", response_model=UploadSessionResponse, status_code=201)
+async def create_upload_session(upload: UploadSessionCreate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  _check_size(upload.size)
+  if upload.folder_id is None:
+    folder_id = await default_folder_id(db, current_user.id)
+  else:
+    await verify_folder_access(db, upload.folder_id, current_user.id, ["edit", "admin"])
+    folder_id = upload.folder_id
+
+  key = f"{current_user.id}/{uuid4().hex}_{upload.filename}"
+  upload_id = await run_in_threadpool(s3.create_multipart_upload, key, upload.content_type)
+  now = datetime.now(timezone.utc)
+  session = models.UploadSession(
+    id=uuid4().hex,
+    user_id=current_user.id,
+    folder_id=folder_id,
+    filename=upload.filename,
+    content_type=upload.content_type,
+    size=upload.size,
+    part_size=part_size_for(upload.size),
+    s3_key=key,
+    s3_upload_id=upload_id,
+    created_at=now,
+    updated_at=now,
+    expires_at=now + timedelta(seconds=UPLOAD_SESSION_TTL),
+    parts=[]
+  )
+  db.add(session)
+  await db.commit()
+  return _session_response(session)
+
+# Where an upload stands; a client resuming after an interruption sends the parts after `offset`
+# (or any listed as missing) and ignores the rest
+@router.get("/uploads/sessions/{session_id}", response_model=UploadSessionResponse)
+async def get_upload_session(session_id: str, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  return _session_response(await _get_session(db, session_id, current_user.id))
+
+# Store one part; the body is the raw bytes. Sending a part again replaces it, so retrying after a dropped response,
+# or sending the same part twice at once, is safe
+@router.put("/uploads/sessions/{session_id}/parts/{part_number}", response_model=UploadSessionResponse)
+async def upload_session_part(session_id: str, part_number: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  session = await _get_session(db, session_id, current_user.id)
+  _check_open(session)
+  part_count = _part_count(session)
+  if not 1 <= part_number <= part_count:
+    raise HTTPException(status_code=400, detail=f"Part number must be between 1 and {part_count}")
+
+  expected = min(session.part_size, session.size - (part_number - 1) * session.part_size)
+  # refuse a wrongly sized part before reading it when the client says how long it is
+  declared = request.headers.get("content-length")
+  if declared is not None and declared.isdigit() and int(declared) != expected:
+    raise HTTPException(status_code=400, detail=f"Part {part_number} must be {expected} bytes")
+
+  # parts can be hundreds of MB, so they go through a temporary file rather than memory
+  with tempfile.SpooledTemporaryFile(max_size=UPLOAD_PART_SPOOL_SIZE) as body:
+    received = 0
+    async for chunk in request.stream():
+      received += len(chunk)
+      if received > expected:
+        raise HTTPException(status_code=400, detail=f"Part {part_number} must be {expected} bytes")
+      await run_in_threadpool(body.write, chunk)
+    if received != expected:
+      raise HTTPException(status_code=400, detail=f"Part {part_number} must be {expected} bytes")
+    body.seek(0)
+
+    try:
+      etag = await s3.upload_part(session.s3_key, session.s3_upload_id, part_number, body)
+    except ClientError as e:
+      raise HTTPException(status_code=502, detail=f"Could not store the part: {e.response['Error'].get('Message', e)}")
+
+  part = next((part for part in session.parts if part.part_number == part_number), None)
+  if part is None:
+    session.parts.append(models.UploadPart(part_number=part_number, size=received, etag=etag))
+  else:
+    part.size = received
+    part.etag = etag
+  session.updated_at = datetime.now(timezone.utc)
+  try:
+    await db.commit()
+  except IntegrityError:
+    # a concurrent PUT of the same part recorded it first; like any resend, this one replaces it
+    await db.rollback()
+    await db.execute(update(models.UploadPart).where(
+      models.UploadPart.session_id == session_id,
+      models.UploadPart.part_number == part_number
+    ).values(size=received, etag=etag))
+    await db.commit()
+    session = await _get_session(db, session_id, current_user.id)
+  return _session_response(session)
+
+# Assemble the parts and record the File; completing again returns the file recorded the first time
+@router.post("/uploads/sessions/{session_id}/complete", response_model=FileUploadResponse)
+async def complete_upload_session(session_id: str, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  session = await _get_session(db, session_id, current_user.id)
+  # sessions live for UPLOAD_SESSION_TTL, so access checked when it was created may be gone
+  await verify_folder_access(db, session.folder_id, current_user.id, ["edit", "admin"])
+  if session.status == models.UploadStatus.COMPLETED.value:
+    record = await db.get(models.File, session.file_id) if session.file_id else None
+    if record is None:
+      raise HTTPException(status_code=410, detail="The uploaded file has since been deleted")
+    return FileUploadResponse(file_id=record.id, url=s3.object_url(record.s3_key), filename=record.filename)
+  _check_open(session)
+
+  missing = _missing_parts(session)
+  if missing:
+    raise HTTPException(status_code=400, detail=f"Parts still missing: {missing[:20]}")
+  try:
+    await run_in_threadpool(
+      s3.complete_multipart_upload, session.s3_key, session.s3_upload_id, [(part.part_number, part.etag) for part in session.parts]
+    )
+  except ClientError as e:
+    # a concurrent completion may have assembled it already, in which case the object is there
+    if not _assembled_elsewhere(e) or await run_in_threadpool(s3.head_object, session.s3_key) is None:
+      raise HTTPException(status_code=400, detail=f"Could not assemble the upload: {e.response['Error'].get('Message', e)}")
+
+  record = models.File(
+    filename=session.filename,
+    s3_key=session.s3_key,
+    user_id=current_user.id,
+    content_type=session.content_type,
+    folder_id=session.folder_id
+  )
+  try:
+    await add_files(db, session.folder_id, [record])
+  except UploadAlreadyRecorded as e:
+    # a concurrent completion of this session got there first
+    return _file_response(e.record)
+  session.status = models.UploadStatus.COMPLETED.value
+  session.file_id = record.id
+  session.updated_at = datetime.now(timezone.utc)
+  await db.commit()
+  return FileUploadResponse(file_id=record.id, url=s3.object_url(session.s3_key), filename=record.filename)
+
+# Give up on an upload and free the parts already stored in S3
+@router.delete("/uploads/sessions/{session_id}", status_code=204)
+async def abort_upload_session(session_id: str, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+  session = await _get_session(db, session_id, current_user.id)
+  # sessions live for UPLOAD_SESSION_TTL, so access checked when it was created may be gone
+  await verify_folder_access(db, session.folder_id, current_user.id, ["edit", "admin"])
+  if session.status == models.UploadStatus.COMPLETED.value:
+    raise HTTPException(status_code=409, detail="Upload is already complete")
+  if session.status == models.UploadStatus.OPEN.value:
+    try:
+      await run_in_threadpool(s3.abort_multipart_upload, session.s3_key, session.s3_upload_id)
+    except ClientError as e:
+      # already gone (for instance removed by a lifecycle rule); nothing left to free
+      if e.response["Error"].get("Code") != "NoSuchUpload":
+        raise
+    session.status = models.UploadStatus.ABORTED.value
+    session.parts.clear()
+    session.updated_at = datetime.now(timezone.utc)
+    await db.commit()
+
+# The caller's session with its parts loaded; other users' sessions look missing
+async def _get_session(db: AsyncSession, session_id: str, user_id: int) -> models.UploadSession:
+  session = (await db.execute(
+    select(models.UploadSession)
+    .options(selectinload(models.UploadSession.parts))
+    .where(models.UploadSession.id == session_id, models.UploadSession.user_id == user_id)
+  )).scalars().first()
+  if not session:
+    raise HTTPException(status_code=404, detail="Upload not found")
+  return session
+
+def _check_size(size: int):
+  if size > UPLOAD_MAX_SIZE:
+    raise HTTPException(status_code=413, detail=f"Files can be at most {UPLOAD_MAX_SIZE} bytes")
+
+def _check_open(session: models.UploadSession):
+  if session.status != models.UploadStatus.OPEN.value:
+    raise HTTPException(status_code=409, detail=f"Upload is {session.status}")
+  # loaded timestamps come back naive (UTCDateTime stores naive UTC), fresh ones are still aware
+  expires_at = session.expires_at.replace(tzinfo=session.expires_at.tzinfo or timezone.utc)
+  if expires_at <= datetime.now(timezone.utc):
+    raise HTTPException(status_code=410, detail="Upload has expired, start a new one")
+
+def _part_count(session: models.UploadSession) -> int:
+  return math.ceil(session.size / session.part_size)
+
+def _missing_parts(session: models.UploadSession) -> list:
+  received = {part.part_number for part in session.parts}
+  return [number for number in range(1, _part_count(session) + 1) if number not in received]
+
+# Free what a direct upload stored when it won't be recorded; S3 already dropping it is fine
+def _discard_upload(claims: dict):
+  if "upload_id" in claims:
+    try:
+      s3.abort_multipart_upload(claims["key"], claims["upload_id"])
+    except ClientError:
+      pass # assembled or aborted already
+  s3.delete_object(claims["key"])
+
+# S3 forgets a multipart upload once it is assembled, so the loser of two concurrent completions sees NoSuchUpload
+def _assembled_elsewhere(error: ClientError) -> bool:
+  return error.response["Error"].get("Code") == "NoSuchUpload"
+
+def _file_response(record: models.File) -> FileUploadResponse:
+  return FileUploadResponse(file_id=record.id, url=s3.object_url(record.s3_key), filename=record.filename)
+
+def _session_response(session: models.UploadSession) -> UploadSessionResponse:
+  # offset counts only the unbroken run of parts from the start, so it's always safe to resume from
+  parts = sorted(session.parts, key=lambda part: part.part_number) # a part added in this request sits at the end
+  offset = 0
+  for number, part in enumerate(parts, start=1):
+    if part.part_number != number:
+      break
+    offset += part.size
+  return UploadSessionResponse(
+    id=session.id,
+    filename=session.filename,
+    size=session.size,
+    part_size=session.part_size,
+    part_count=_part_count(session),
+    offset=offset,
+    received_parts=[part.part_number for part in parts],
+    status=session.status,
+    file_id=session.file_id,
+    expires_at=session.expires_at
+  )
@@ -1,13 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from pydantic import BaseModel
 
-from app.database import get_db
+from app.database import get_async_db
 from app.models import User
-from app.schemas import UserCreate, UserResponse, Token
-from app.auth import create_access_token, get_current_user, ACCESS_TOKEN_EXPIRATION
+from app.schemas import UserCreate, UserResponse, Token, PasswordChange
+from app.auth import create_access_token, get_current_user, oauth2_scheme, revoke_token, revoke_user_tokens, ACCESS_TOKEN_EXPIRATION, TOKEN_VERSION_CLAIM
+from app.utils.passwords import hash_password, verify_and_update
 
 router = APIRouter()
 
@@ -16,12 +18,13 @@ class LoginRequest(BaseModel):
     password: str
 
 @router.post("/signup", response_model=UserResponse)
-def create_user(user: UserCreate, db: Session = Depends(get_db)): 
-  db_user = db.query(User).filter(User.email == user.email).first()
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)): 
+  db_user = (await db.execute(select(User).where(User.email == user.email))).scalars().first()
   if db_user:
     raise HTTPException(status_code=400, detail="Email already registered")
   
-  hashed_password = User.get_password_hash(user.password)
+  # bcrypt runs on the password pool so a burst of signups can't starve other requests
+  hashed_password = await hash_password(user.password)
   db_user = User(
     email = user.email,
     name = user.name,
@@ -29,24 +32,52 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
   )
 
   db.add(db_user)
-  db.commit()
-  db.refresh(db_user)
+  await db.commit()
+  await db.refresh(db_user)
   return db_user
   
 @router.post("/login", response_model=Token)
-def login(login_data: LoginRequest, db: Session = Depends(get_db)):
-  user = db.query(User).filter(User.email == login_data.email).first()
-  if not user or not user.verify_password(login_data.password):
+async def login(login_data: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+  user = (await db.execute(select(User).where(User.email == login_data.email))).scalars().first()
+  valid, new_hash = await verify_and_update(login_data.password, user.hashed_password) if user else (False, None)
+  if not valid:
     raise HTTPException(
       status_code=status.HTTP_401_UNAUTHORIZED,
       detail="Invalid credentials",
       headers={"WWW-Authenticate": "Bearer"},
     )
+
+  # the stored hash used an older, cheaper cost; upgrade it while we have the password
+  if new_hash:
+    user.hashed_password = new_hash
+    await db.commit()
   
   access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRATION)
-  access_token = create_access_token(data={"user_id": str(user.id)}, expires_delta=access_token_expires)
+  access_token = create_access_token(data={"user_id": str(user.id), TOKEN_VERSION_CLAIM: user.token_version}, expires_delta=access_token_expires)
   return {"access_token": access_token, "token_type": "Bearer"}
 
 @router.get("/me", response_model=UserResponse)
 def read_users_me(current_user: User = Depends(get_current_user)):
   return current_user
+
+# The token used for this request stops working, on every worker
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(token: str = Depends(oauth2_scheme), current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+  await revoke_token(db, token)
+
+# Change the password and hand out a new token; every token issued before, on any device, stops working
+@router.put("/me/password", response_model=Token)
+async def change_password(change: PasswordChange, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+  valid, _ = await verify_and_update(change.current_password, current_user.hashed_password)
+  if not valid:
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Current password is incorrect")
+
+  user = await db.get(User, current_user.id)
+  user.hashed_password = await hash_password(change.new_password)
+  user.token_version = User.token_version + 1 # in SQL, so concurrent changes each count
+  await db.commit()
+  await db.refresh(user, ["token_version"])
+  await revoke_user_tokens(user.id)
+
+  access_token = create_access_token(data={"user_id": str(user.id), TOKEN_VERSION_CLAIM: user.token_version}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRATION))
+  return {"access_token": access_token, "token_type": "Bearer"}
@@ -12,6 +12,10 @@ class UserLogin(BaseModel):
   email: EmailStr
   password: str  
 
+class PasswordChange(BaseModel):
+  current_password: str
+  new_password: str = Field(..., min_length=8)
+
 class UserResponse(BaseModel):
   id: int
   name: str
@@ -44,11 +48,13 @@ class FolderResponse(BaseModel):
   user_id: int
   created_at: datetime
   updated_at: datetime
+  permission: Optional[str] = None # caller's access in folder listings: owner, admin, edit or read
 
   model_config = ConfigDict(from_attributes=True)
 
 class FolderList(BaseModel):
   folders: List[FolderResponse]
+  next_cursor: Optional[str] = None # pass back as ?cursor= for the next page, None on the last page
 
 class FlashcardBase(BaseModel):
   question: str
@@ -81,6 +87,21 @@ class FlashcardGenerationRequest(BaseModel):
 
 class FlashcardList(BaseModel):
   flashcards: List[FlashcardResponse]
+  next_cursor: Optional[str] = None
+
+class JobResponse(BaseModel):
+  id: int
+  folder_id: int
+  topic: str
+  focus: Optional[str] = None
+  num_flashcards: int
+  status: str
+  cards_created: int
+  error: Optional[str] = None
+  created_at: datetime
+  updated_at: datetime
+
+  model_config = ConfigDict(from_attributes=True)
 
 
 class ShareBase(BaseModel):
@@ -110,4 +131,56 @@ class ShareResponse(BaseModel):
 
 class ShareList(BaseModel):
   shares: List[ShareResponse]
-    
\ No newline at end of file
+  next_cursor: Optional[str] = None
+    
+
+class FileUploadResponse(BaseModel):
+  file_id: int
+  url: str
+  filename: str
+
+class UploadInitiate(BaseModel):
+  filename: str
+  size: int = Field(..., gt=0) # bytes; the upload must be exactly this long
+  content_type: str = "application/octet-stream"
+  folder_id: Optional[int] = None # the user's Default folder when omitted
+  md5: Optional[str] = None # hex MD5 of the whole file, checked against the stored object for single-request uploads; multipart uploads are checked for size only
+
+class UploadPartURL(BaseModel):
+  part_number: int
+  url: str
+
+class UploadInitiateResponse(BaseModel):
+  upload_token: str # hand back to /uploads/complete
+  method: str # "post": send the file as a form to url with fields; "multipart": PUT each part to its url
+  url: Optional[str] = None
+  fields: Optional[dict] = None
+  part_size: Optional[int] = None # bytes per part, the last one may be shorter
+  parts: List[UploadPartURL] = []
+
+class CompletedPart(BaseModel):
+  part_number: int
+  etag: str # ETag header S3 returned for the part
+
+class UploadComplete(BaseModel):
+  upload_token: str
+  parts: List[CompletedPart] = [] # multipart uploads only
+
+class UploadSessionCreate(BaseModel):
+  filename: str
+  size: int = Field(..., gt=0) # bytes the finished file will have
+  content_type: str = "application/octet-stream"
+  folder_id: Optional[int] = None # the user's Default folder when omitted
+
+class UploadSessionResponse(BaseModel):
+  id: str
+  filename: str
+  size: int
+  part_size: int # bytes per part, the last one may be shorter
+  part_count: int
+  offset: int # bytes stored without gaps from the start of the file
+  received_parts: List[int] # part numbers already stored
+  status: str # open, completed or aborted
+  file_id: Optional[int] = None # set once completed
+  expires_at: datetime
+
@@ -0,0 +1,127 @@
+import argparse
+from sqlalchemy import case, delete, event, func, insert, inspect, literal, select, union_all
+from sqlalchemy.orm import Session
+from app import models
+from app.database import rls_bypass
+from app.models import PERMISSION_RANKS
+
+# rank of an accepted share's permission type, 0 for anything unknown
+share_rank = case(
+  {name: rank for name, rank in PERMISSION_RANKS.items() if name != "owner"},
+  value=models.FolderShare.permission_type,
+  else_=0
+)
+
+# Effective rank of a user on a folder, computed from the source tables; None if the folder doesn't exist
+def _rank_query(folder_id: int, user_id: int):
+  return (
+    select(case(
+      (models.StudyFolder.user_id == user_id, PERMISSION_RANKS["owner"]),
+      else_=func.coalesce(func.max(share_rank), 0)
+    ))
+    .select_from(models.StudyFolder)
+    .outerjoin(models.FolderShare, (models.FolderShare.folder_id == models.StudyFolder.id)
+      & (models.FolderShare.user_id == user_id)
+      & (models.FolderShare.invitation_accepted == True))
+    .where(models.StudyFolder.id == folder_id)
+    .group_by(models.StudyFolder.user_id)
+  )
+
+# Recompute folder_acl rows for (user_id, folder_id) pairs on `connection`, inside its transaction
+def sync_folder_acl(connection, pairs):
+  # the ranks come from folders the request's user may not see yet, e.g. one they're accepting a share of
+  with rls_bypass(connection):
+    for user_id, folder_id in pairs:
+      rank = connection.execute(_rank_query(folder_id, user_id)).scalar()
+      connection.execute(delete(models.FolderACL).where(
+        models.FolderACL.user_id == user_id,
+        models.FolderACL.folder_id == folder_id
+      ))
+      if rank:
+        connection.execute(insert(models.FolderACL).values(user_id=user_id, folder_id=folder_id, permission_rank=rank))
+
+# attributes whose changes can alter someone's access
+_ACL_ATTRIBUTES = {
+  models.StudyFolder: ("user_id",),
+  models.FolderShare: ("user_id", "folder_id", "permission_type", "invitation_accepted"),
+}
+
+def _affected_pairs(instance, is_dirty: bool):
+  """(user_id, folder_id) pairs whose access an added, changed or deleted row may alter."""
+  state = inspect(instance)
+  if is_dirty and not any(state.attrs[name].history.has_changes() for name in _ACL_ATTRIBUTES[type(instance)]):
+    return set()
+  folder_attribute = "id" if isinstance(instance, models.StudyFolder) else "folder_id"
+  pairs = set()
+  # before and after the change, so access is taken away from a previous owner or share holder too
+  users = {getattr(instance, "user_id"), *state.attrs["user_id"].history.deleted}
+  folders = {getattr(instance, folder_attribute), *state.attrs[folder_attribute].history.deleted}
+  for user_id in users:
+    for folder_id in folders:
+      if user_id is not None and folder_id is not None:
+        pairs.add((user_id, folder_id))
+  return pairs
+
+# After every flush, recompute the ACL of the folders and users it touched, on the same connection,
+# so folder_acl commits or rolls back together with the change that caused it
+@event.listens_for(Session, "after_flush")
+def _sync_after_flush(session, flush_context):
+  pairs = set()
+  for instances, is_dirty in ((session.new, False), (session.dirty, True), (session.deleted, False)):
+    for instance in instances:
+      if type(instance) in _ACL_ATTRIBUTES:
+        pairs |= _affected_pairs(instance, is_dirty)
+  if pairs:
+    sync_folder_acl(session.connection(), sorted(pairs))
+
+# Every (user_id, folder_id) -> rank the ACL should hold, derived from folders and accepted shares
+def expected_acl(db: Session) -> dict:
+  grants = union_all(
+    select(models.StudyFolder.user_id.label("user_id"), models.StudyFolder.id.label("folder_id"), literal(PERMISSION_RANKS["owner"]).label("rank")),
+    select(models.FolderShare.user_id, models.FolderShare.folder_id, share_rank).where(
+      models.FolderShare.invitation_accepted == True,
+      models.FolderShare.user_id.is_not(None)
+    )
+  ).subquery()
+  rows = db.execute(
+    select(grants.c.user_id, grants.c.folder_id, func.max(grants.c.rank))
+    .group_by(grants.c.user_id, grants.c.folder_id)
+  )
+  return {(user_id, folder_id): rank for user_id, folder_id, rank in rows if rank}
+
+# Bring folder_acl back in line with the source tables
+# Returns how many rows were added, removed and changed
+def rebuild_folder_acl(db: Session, dry_run: bool = False):
+  # every user's folders and shares, whoever the session is scoped to
+  with rls_bypass(db.connection()):
+    expected = expected_acl(db)
+  actual = {
+    (row.user_id, row.folder_id): row.permission_rank
+    for row in db.execute(select(models.FolderACL.user_id, models.FolderACL.folder_id, models.FolderACL.permission_rank))
+  }
+  added = [key for key in expected if key not in actual]
+  removed = [key for key in actual if key not in expected]
+  changed = [key for key in expected if key in actual and expected[key] != actual[key]]
+
+  if not dry_run:
+    for user_id, folder_id in removed + changed:
+      db.execute(delete(models.FolderACL).where(models.FolderACL.user_id == user_id, models.FolderACL.folder_id == folder_id))
+    rows = [{"user_id": user_id, "folder_id": folder_id, "permission_rank": expected[(user_id, folder_id)]} for user_id, folder_id in added + changed]
+    if rows:
+      db.execute(insert(models.FolderACL.__table__), rows)
+    db.commit()
+  return len(added), len(removed), len(changed)
+
+def main():
+  from app.database import SessionLocal
+  parser = argparse.ArgumentParser(description="Rebuild folder_acl from study folders and accepted shares.")
+  parser.add_argument("--dry-run", action="store_true", help="only report drift")
+  args = parser.parse_args()
+
+  with SessionLocal() as db:
+    added, removed, changed = rebuild_folder_acl(db, dry_run=args.dry_run)
+  verb = "would be" if args.dry_run else "were"
+  print(f"{added} rows {verb} added, {removed} removed, {changed} changed")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,97 @@
+import hashlib
+import logging
+from collections import Counter
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.concurrency import run_in_threadpool
+from app import models
+from app.services import s3
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024 # bytes read at a time while hashing, so large files never sit in memory whole
+
+# Content-addressed storage: identical uploads share one S3 object under blobs/<sha256>, and the
+# blobs table counts the File rows pointing at each object so the last one to go can free it
+
+def blob_key(digest: str) -> str:
+  return f"blobs/{digest}"
+
+# SHA-256 hex digest and size of a file-like object, read in chunks and rewound for the upload after it
+def hash_file(file_object):
+  digest = hashlib.sha256()
+  size = 0
+  file_object.seek(0)
+  while chunk := file_object.read(HASH_CHUNK_SIZE):
+    digest.update(chunk)
+    size += len(chunk)
+  file_object.seek(0)
+  return digest.hexdigest(), size
+
+# Add a reference for every (digest, size) in `hashes` (from hash_file), creating missing blob rows
+# Returns the digests that had no blob yet; the caller must upload those objects before committing.
+# Each blob row stays locked until the transaction ends, so a concurrent release can't free an object
+# this transaction has just counted on, and two uploads of new content don't both store it
+async def claim_blobs(db: AsyncSession, hashes) -> set:
+  counts = Counter(digest for digest, _ in hashes)
+  sizes = dict(hashes)
+  created = set()
+  # a fixed lock order keeps two multi-file uploads from deadlocking on each other's blobs
+  for digest in sorted(counts):
+    size, count = sizes[digest], counts[digest]
+    while True:
+      refcount = (await db.execute(
+        update(models.Blob).where(models.Blob.sha256 == digest)
+        .values(refcount=models.Blob.refcount + count)
+        .returning(models.Blob.refcount)
+        .execution_options(synchronize_session=False)
+      )).scalar()
+      if refcount is not None:
+        break
+      try:
+        async with db.begin_nested():
+          db.add(models.Blob(sha256=digest, s3_key=blob_key(digest), size=size, refcount=count))
+        created.add(digest)
+        break
+      except IntegrityError:
+        # someone else stored it first; count on theirs
+        continue
+  return created
+
+# Drop `count` references from each blob in `releases` (digest -> count), deleting the rows nobody uses anymore
+# Returns the digests whose rows were deleted; once the caller has committed, it passes them to
+# delete_released_objects. A rollback leaves both the rows and the objects as they were
+async def release_blobs(db: AsyncSession, releases: dict) -> set:
+  freed = set()
+  for digest in sorted(releases):
+    refcount = (await db.execute(
+      update(models.Blob).where(models.Blob.sha256 == digest)
+      .values(refcount=models.Blob.refcount - releases[digest])
+      .returning(models.Blob.refcount)
+      .execution_options(synchronize_session=False)
+    )).scalar()
+    if refcount is not None and refcount <= 0:
+      await db.execute(delete(models.Blob).where(models.Blob.sha256 == digest))
+      freed.add(digest)
+  return freed
+
+# Delete the S3 objects of blobs a committed release_blobs freed, unless their content was stored again since
+# Each digest is first claimed with a placeholder row: if an upload has recreated the blob, its row
+# is there and the object stays; otherwise the placeholder holds back new uploads of that content
+# until the object is gone, so none of them can count on an object that is about to disappear
+async def delete_released_objects(db: AsyncSession, digests):
+  for digest in sorted(digests):
+    try:
+      async with db.begin_nested():
+        db.add(models.Blob(sha256=digest, s3_key=blob_key(digest), size=0, refcount=0))
+    except IntegrityError:
+      await db.rollback() # stored again; the new blob owns the object
+      continue
+    try:
+      await run_in_threadpool(s3.delete_object, blob_key(digest))
+    except Exception:
+      # the file is already gone for the user; an orphaned object only costs storage
+      logger.exception("Could not delete %s", blob_key(digest))
+    await db.execute(delete(models.Blob).where(models.Blob.sha256 == digest))
+    await db.commit()
@@ -0,0 +1,28 @@
+import json
+import os
+from datetime import datetime
+from fastapi.responses import StreamingResponse
+from app.database import AsyncReadSessionLocal
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000")) # rows per fetch from the server-side cursor
+
+def _json_default(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+# Stream the rows of `query`, a select of plain columns, as newline-delimited JSON objects
+# The request's session is closed before a streamed body is sent, so the rows are read in a session of their own,
+# EXPORT_BATCH_SIZE at a time from a server-side cursor; memory stays flat however many rows there are
+async def export_ndjson(query, user_id: int):
+  async with AsyncReadSessionLocal(info={"user_id": user_id}) as db:
+    result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    async for rows in result.mappings().partitions():
+      yield "".join(json.dumps(dict(row), default=_json_default) + "\n" for row in rows)
+
+def ndjson_response(query, user_id: int, filename: str) -> StreamingResponse:
+  return StreamingResponse(
+    export_ndjson(query, user_id),
+    media_type="application/x-ndjson",
+    headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+  )
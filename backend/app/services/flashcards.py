@@ -0,0 +1,37 @@
+import os
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert
+from app.database import SessionLocal
+from app import models
+from app.schemas import FlashcardResponse
+
+FLASHCARD_BATCH_SIZE = int(os.getenv("FLASHCARD_BATCH_SIZE", "5")) # streamed cards committed together
+
+# Insert generated cards in one statement and return them as response models
+def insert_flashcards(folder_id: int, user_id: int, flashcards: list):
+  rows = [
+    {
+      "question": flashcard["question"],
+      "answer": flashcard["answer"],
+      "folder_id": folder_id,
+      "user_id": user_id,
+    }
+    for flashcard in flashcards
+  ]
+  with SessionLocal(info={"user_id": user_id}) as db:
+    created = db.scalars(insert(models.Flashcard).returning(models.Flashcard), rows).all()
+    saved = [FlashcardResponse.model_validate(flashcard) for flashcard in created]
+    db.commit()
+  return saved
+
+# Persist an async stream of generated cards in batches of FLASHCARD_BATCH_SIZE
+# Yields the saved cards of each batch once it is committed
+async def persist_in_batches(flashcards, folder_id: int, user_id: int):
+  batch = []
+  async for flashcard in flashcards:
+    batch.append(flashcard)
+    if len(batch) >= FLASHCARD_BATCH_SIZE:
+      yield await run_in_threadpool(insert_flashcards, folder_id, user_id, batch)
+      batch = []
+  if batch:
+    yield await run_in_threadpool(insert_flashcards, folder_id, user_id, batch)
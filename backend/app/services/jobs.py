@@ -0,0 +1,189 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, insert, or_, update
+from app.database import SessionLocal
+from app import models
+from app.utils.gpt import generate_flashcards
+
+logger = logging.getLogger(__name__)
+
+FLASHCARD_JOB_WORKERS = int(os.getenv("FLASHCARD_JOB_WORKERS", "4")) # jobs generated at the same time per process
+# a running job whose updated_at is older than this is taken to be orphaned by a dead worker and may be claimed again;
+# live workers refresh updated_at every FLASHCARD_JOB_LEASE / 3 seconds while they wait on the LLM
+FLASHCARD_JOB_LEASE = float(os.getenv("FLASHCARD_JOB_LEASE", "300"))
+
+_queue = None
+_loop = None
+_workers = []
+_sweeper = None
+_queued = set() # ids waiting in _queue, so the sweep doesn't queue a job twice
+
+# Start the worker pool on the running event loop
+# Pending jobs, and running jobs whose worker stopped renewing their lease, are queued now and
+# again every FLASHCARD_JOB_LEASE seconds, so a job orphaned while its lease was still live isn't lost
+# param: count: number of worker tasks
+async def start_workers(count: int = FLASHCARD_JOB_WORKERS):
+  global _queue, _loop, _sweeper
+  _loop = asyncio.get_running_loop()
+  _queue = asyncio.Queue()
+  for _ in range(count):
+    _workers.append(asyncio.create_task(_worker()))
+
+  await _queue_unfinished_jobs()
+  _sweeper = asyncio.create_task(_sweep())
+
+# Cancel the worker tasks; unfinished jobs stay in the database and are resumed on the next start
+async def stop_workers():
+  global _queue, _loop, _sweeper
+  for task in (*_workers, _sweeper):
+    if task is not None:
+      task.cancel()
+  await asyncio.gather(*_workers, *([_sweeper] if _sweeper else []), return_exceptions=True)
+  _workers.clear()
+  _queued.clear()
+  _queue = None
+  _loop = None
+  _sweeper = None
+
+# Hand a persisted job to the worker pool
+# Safe to call from threadpool routes as well as from the event loop
+# param: job_id: id of a FlashcardJob row in the pending state
+def enqueue_flashcard_job(job_id: int):
+  if _loop is None:
+    # no pool in this process yet, the job is picked up when the workers start
+    logger.warning("Flashcard job %s queued before the worker pool started", job_id)
+    return
+  _loop.call_soon_threadsafe(_put, job_id)
+
+def _put(job_id: int):
+  if job_id not in _queued:
+    _queued.add(job_id)
+    _queue.put_nowait(job_id)
+
+async def _queue_unfinished_jobs():
+  for job_id in await run_in_threadpool(_unfinished_job_ids):
+    _put(job_id)
+
+async def _sweep():
+  while True:
+    await asyncio.sleep(FLASHCARD_JOB_LEASE)
+    try:
+      await _queue_unfinished_jobs()
+    except Exception:
+      logger.exception("Could not look for orphaned flashcard jobs")
+
+async def _worker():
+  while True:
+    job_id = await _queue.get()
+    _queued.discard(job_id)
+    try:
+      await _run_job(job_id)
+    except Exception:
+      logger.exception("Flashcard job %s crashed", job_id)
+    finally:
+      _queue.task_done()
+
+async def _run_job(job_id: int):
+  job = await run_in_threadpool(_start_job, job_id)
+  if job is None:
+    return
+
+  # no database connection is held while waiting on the LLM
+  heartbeat = asyncio.create_task(_renew_lease(job_id))
+  try:
+    flashcards = await generate_flashcards(job["topic"], job["num_flashcards"], job["focus"])
+  except Exception as e:
+    await run_in_threadpool(_finish_job, job_id, models.JobStatus.FAILED, error=str(e))
+    return
+  finally:
+    heartbeat.cancel()
+
+  await run_in_threadpool(_save_flashcards, job, flashcards)
+
+async def _renew_lease(job_id: int):
+  while True:
+    await asyncio.sleep(FLASHCARD_JOB_LEASE / 3)
+    await run_in_threadpool(_touch_job, job_id)
+
+def _touch_job(job_id: int):
+  with SessionLocal() as db:
+    db.execute(update(models.FlashcardJob).where(
+      models.FlashcardJob.id == job_id,
+      models.FlashcardJob.status == models.JobStatus.RUNNING.value
+    ).values(updated_at=datetime.now(timezone.utc)))
+    db.commit()
+
+# Jobs a worker may take: pending ones, and running ones whose lease ran out
+def _claimable():
+  expired = datetime.now(timezone.utc) - timedelta(seconds=FLASHCARD_JOB_LEASE)
+  return or_(
+    models.FlashcardJob.status == models.JobStatus.PENDING.value,
+    and_(models.FlashcardJob.status == models.JobStatus.RUNNING.value, models.FlashcardJob.updated_at < expired)
+  )
+
+def _unfinished_job_ids():
+  with SessionLocal() as db:
+    rows = db.query(models.FlashcardJob.id).filter(_claimable()).order_by(models.FlashcardJob.id).all()
+    return [row.id for row in rows]
+
+# Claim a job for this worker, returning the inputs needed to run it
+# The claim is a single conditional UPDATE, so of several workers (or processes) handed the same job only one gets it
+def _start_job(job_id: int):
+  with SessionLocal() as db:
+    claimed = db.execute(update(models.FlashcardJob).where(models.FlashcardJob.id == job_id, _claimable()).values(
+      status=models.JobStatus.RUNNING.value,
+      updated_at=datetime.now(timezone.utc)
+    ).execution_options(synchronize_session=False))
+    db.commit()
+    if claimed.rowcount != 1:
+      return None
+    job = db.get(models.FlashcardJob, job_id)
+    return {
+      "id": job.id,
+      "user_id": job.user_id,
+      "folder_id": job.folder_id,
+      "topic": job.topic,
+      "focus": job.focus,
+      "num_flashcards": job.num_flashcards,
+    }
+
+def _save_flashcards(job: dict, flashcards: list):
+  rows = [
+    {
+      "question": flashcard["question"],
+      "answer": flashcard["answer"],
+      "folder_id": job["folder_id"],
+      "user_id": job["user_id"],
+    }
+    for flashcard in flashcards
+    if flashcard.get("question") and flashcard.get("answer")
+  ]
+  with SessionLocal(info={"user_id": job["user_id"]}) as db:
+    # complete the job first, and only if it is still running: a worker that lost its lease
+    # and finishes late must not insert a second set of cards
+    if not _update_job(db, job["id"], models.JobStatus.COMPLETED, cards_created=len(rows)):
+      logger.warning("Flashcard job %s was finished by another worker, dropping its cards", job["id"])
+      return
+    # one multi-row insert for the whole batch, committed together with the job status
+    if rows:
+      db.execute(insert(models.Flashcard), rows)
+    db.commit()
+
+def _finish_job(job_id: int, status: models.JobStatus, error: str = None):
+  with SessionLocal() as db:
+    _update_job(db, job_id, status, error=error)
+    db.commit()
+
+# Move a running job to `status`; returns False if it is no longer running
+def _update_job(db, job_id: int, status: models.JobStatus, **values) -> bool:
+  return db.query(models.FlashcardJob).filter(
+    models.FlashcardJob.id == job_id,
+    models.FlashcardJob.status == models.JobStatus.RUNNING.value
+  ).update({
+    "status": status.value,
+    "updated_at": datetime.now(timezone.utc),
+    **values,
+  }) == 1
@@ -1,7 +1,13 @@
+import asyncio
 import os 
+import time
+from concurrent.futures import ThreadPoolExecutor
 from boto3 import client as boto3_client
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
+from app.utils import metrics
 
 load_dotenv()
 
@@ -9,18 +15,46 @@ S3_BUCKET = os.getenv('S3_BUCKET_NAME')
 AWS_REGION = os.getenv('AWS_REGION')
 AWS_ACCESS_KEY = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') # S3-compatible server such as MinIO or moto; unset for AWS
 
-s3 = boto3_client(
-  's3',
-  region_name=AWS_REGION,
-  aws_access_key_id=AWS_ACCESS_KEY,
-  aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+MB = 1024 * 1024
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "8")) # files transferred at the same time per worker
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * MB))) # larger files are sent in parts
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * MB)))
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", "4")) # parts of one file sent at the same time
+
+transfer_config = TransferConfig(
+  multipart_threshold=S3_MULTIPART_THRESHOLD,
+  multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+  max_concurrency=S3_MULTIPART_CONCURRENCY
 )
 
-# upload a file-like object under `key` in your bucket
-# param: file_object: The file-like object to upload
-# param: key: The key of the file in the bucket
-async def upload_file(file_object, key) -> str:
+# param: endpoint_url: S3-compatible endpoint, defaults to S3_ENDPOINT_URL
+def create_client(endpoint_url: str = None):
+  return boto3_client(
+    's3',
+    region_name=AWS_REGION,
+    aws_access_key_id=AWS_ACCESS_KEY,
+    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+    endpoint_url=endpoint_url or S3_ENDPOINT_URL,
+    # every part of every concurrent upload needs its own connection
+    config=Config(max_pool_connections=S3_UPLOAD_CONCURRENCY * S3_MULTIPART_CONCURRENCY)
+  )
+
+s3 = create_client()
+
+_executor = None
+
+# transfers block on the network, so they run here instead of on the event loop;
+# the pool size is the cap on files uploading at once
+def _get_executor() -> ThreadPoolExecutor:
+  global _executor
+  if _executor is None:
+    _executor = ThreadPoolExecutor(max_workers=S3_UPLOAD_CONCURRENCY, thread_name_prefix="s3-upload")
+  return _executor
+
+def _upload_blocking(file_object, key):
+  started = time.perf_counter()
   try:
     s3.upload_fileobj(
       Fileobj=file_object,
@@ -28,12 +62,42 @@ async def upload_file(file_object, key) -> str:
       Key=key,
       ExtraArgs={
         "ACL": "private"  # Only bucket owner can access directly
-      }
+      },
+      Config=transfer_config
     )
+  finally:
+    metrics.observe("s3.upload_seconds", time.perf_counter() - started)
+
+# upload a file-like object under `key` in your bucket
+# Waits for a slot on the upload pool, so callers can start many uploads and at most
+# S3_UPLOAD_CONCURRENCY run at once; files above S3_MULTIPART_THRESHOLD go up in parallel parts
+# param: file_object: The file-like object to upload
+# param: key: The key of the file in the bucket
+async def upload_file(file_object, key) -> str:
+  try:
+    await asyncio.wrap_future(_get_executor().submit(_upload_blocking, file_object, key))
   except ClientError as e:
     raise Exception(f"Error uploading file to S3: {e}")
   
-  # Generate a URL for immediate reference (won't be accessible without authentication)
+  return object_url(key)
+
+def _upload_part_blocking(key, upload_id, part_number, body):
+  started = time.perf_counter()
+  try:
+    return s3.upload_part(Bucket=S3_BUCKET, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body)["ETag"]
+  finally:
+    metrics.observe("s3.upload_part_seconds", time.perf_counter() - started)
+
+# upload one part of a multipart upload on the upload pool and return the part's ETag
+# param: part_number: 1-based position of the part
+# param: body: the part's bytes, or a seekable file object holding them
+async def upload_part(key: str, upload_id: str, part_number: int, body) -> str:
+  return await asyncio.wrap_future(_get_executor().submit(_upload_part_blocking, key, upload_id, part_number, body))
+
+# Generate a URL for immediate reference (won't be accessible without authentication)
+def object_url(key: str) -> str:
+  if S3_ENDPOINT_URL:
+    return f"{S3_ENDPOINT_URL.rstrip('/')}/{S3_BUCKET}/{key}"
   return f"https://{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}"
 
 # generate a presigned URL for the file under `key` in your bucket
@@ -59,7 +123,63 @@ def generate_presigned_url(key: str, expiration: int = 300, response_headers: di
     return response
   except ClientError as e:
     raise Exception(f"Error generating presigned URL: {e}")
-  
-  
-  
-    
\ No newline at end of file
+
+# presigned POST that lets a client upload the object under `key` straight to S3
+# The policy pins the exact size and content type, so the client can't send something else under the key
+# param: key: The key of the file in the bucket
+# param: size: The exact size of the upload in bytes
+# param: content_type: MIME type the client must send
+# param: expiration: The expiration time of the presigned POST
+def generate_presigned_post(key: str, size: int, content_type: str, expiration: int = 3600) -> dict:
+  try:
+    return s3.generate_presigned_post(
+      Bucket=S3_BUCKET,
+      Key=key,
+      Fields={"Content-Type": content_type},
+      Conditions=[{"Content-Type": content_type}, ["content-length-range", size, size]],
+      ExpiresIn=expiration
+    )
+  except ClientError as e:
+    raise Exception(f"Error generating presigned POST: {e}")
+
+# start a multipart upload under `key` and return its upload id
+def create_multipart_upload(key: str, content_type: str) -> str:
+  response = s3.create_multipart_upload(Bucket=S3_BUCKET, Key=key, ContentType=content_type, ACL="private")
+  return response["UploadId"]
+
+# presigned URL a client PUTs one part of a multipart upload to
+# param: part_number: 1-based position of the part
+def generate_presigned_part_url(key: str, upload_id: str, part_number: int, expiration: int = 3600) -> str:
+  try:
+    return s3.generate_presigned_url(
+      ClientMethod='upload_part',
+      Params={'Bucket': S3_BUCKET, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number},
+      ExpiresIn=expiration
+    )
+  except ClientError as e:
+    raise Exception(f"Error generating presigned part URL: {e}")
+
+# assemble the uploaded parts into the object
+# param: parts: list of (part_number, etag) in part order
+def complete_multipart_upload(key: str, upload_id: str, parts) -> None:
+  s3.complete_multipart_upload(
+    Bucket=S3_BUCKET,
+    Key=key,
+    UploadId=upload_id,
+    MultipartUpload={"Parts": [{"PartNumber": number, "ETag": etag} for number, etag in parts]}
+  )
+
+def abort_multipart_upload(key: str, upload_id: str) -> None:
+  s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=key, UploadId=upload_id)
+
+# metadata of the object under `key`, or None if there is no such object
+def head_object(key: str):
+  try:
+    return s3.head_object(Bucket=S3_BUCKET, Key=key)
+  except ClientError as e:
+    if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+      return None
+    raise
+
+def delete_object(key: str) -> None:
+  s3.delete_object(Bucket=S3_BUCKET, Key=key)
@@ -0,0 +1,130 @@
+import math
+import os
+import re
+from datetime import datetime, timedelta, timezone
+import jwt
+from fastapi import HTTPException
+from jwt.exceptions import InvalidTokenError
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import models
+from app.auth import ALGORITHM, SECRET_KEY
+from app.services import s3
+
+UPLOAD_URL_EXPIRATION = int(os.getenv("UPLOAD_URL_EXPIRATION", "3600")) # seconds a client has to send a direct upload
+UPLOAD_TOKEN_PURPOSE = "upload" # keeps upload tokens and access tokens from standing in for each other
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600))) # seconds a resumable upload stays open
+UNIQUE_NAME_ATTEMPTS = 10 # times add_files picks names; each lost race for a name costs one
+
+S3_MIN_PART_SIZE = 5 * s3.MB # S3 rejects smaller parts, except the last one
+S3_MAX_PARTS = 10000
+S3_MAX_OBJECT_SIZE = 5 * 1024 * 1024 * s3.MB # 5 TiB
+# largest file a client may upload; bounds part_size_for, and so the bytes one part request carries
+UPLOAD_MAX_SIZE = min(int(os.getenv("UPLOAD_MAX_SIZE", str(S3_MAX_OBJECT_SIZE))), S3_MAX_OBJECT_SIZE)
+UPLOAD_PART_SPOOL_SIZE = int(os.getenv("UPLOAD_PART_SPOOL_SIZE", str(8 * s3.MB))) # bytes of a part held in memory before it spills to disk
+
+# Bytes per part for a multipart upload of `size` bytes: S3_MULTIPART_CHUNKSIZE, grown to stay within S3's part limits
+def part_size_for(size: int) -> int:
+  return max(s3.S3_MULTIPART_CHUNKSIZE, S3_MIN_PART_SIZE, math.ceil(size / S3_MAX_PARTS))
+
+# The user's "Default" folder, created on first use
+async def default_folder_id(db: AsyncSession, user_id: int) -> int:
+  default_folder = (await db.execute(
+    select(models.StudyFolder).filter_by(user_id=user_id, name="Default")
+  )).scalars().first()
+  if default_folder is None:
+    default_folder = models.StudyFolder(
+      name="Default",
+      user_id=user_id,
+      description="Default folder",
+      created_at=datetime.now(timezone.utc),
+      updated_at=datetime.now(timezone.utc)
+    )
+    db.add(default_folder)
+    await db.commit()
+    await db.refresh(default_folder)
+  return default_folder.id
+
+# Query for the names in the folder any of `filenames` could clash with: the name itself and "name (n).ext" variants
+# (the LIKE patterns can match a few names the numbering doesn't use; unique_filenames skips those)
+def clashing_filenames(folder_id: int, filenames):
+  matches = []
+  for filename in set(filenames):
+    base_name, extension = os.path.splitext(filename)
+    matches.append(or_(models.File.filename == filename, and_(
+      models.File.filename.startswith(f"{base_name} (", autoescape=True),
+      models.File.filename.endswith(f"){extension}", autoescape=True)
+    )))
+  return select(models.File.filename).where(models.File.folder_id == folder_id, or_(*matches))
+
+# For each of `filenames`: the name itself, or "name (n).ext" for the lowest n that isn't used in the
+# folder or by an earlier file of the same list, with one query for the whole list
+async def unique_filenames(db: AsyncSession, folder_id: int, filenames) -> list:
+  if not filenames:
+    return []
+  taken = set((await db.execute(clashing_filenames(folder_id, filenames))).scalars())
+
+  names = []
+  for filename in filenames:
+    base_name, extension = os.path.splitext(filename)
+    candidate = filename
+    if candidate in taken:
+      numbers = set()
+      for name in taken:
+        match = re.fullmatch(rf"{re.escape(base_name)} \((\d+)\){re.escape(extension)}", name)
+        if match:
+          numbers.add(int(match.group(1)))
+      duplicate_count = next(n for n in range(1, len(numbers) + 2) if n not in numbers)
+      candidate = f"{base_name} ({duplicate_count}){extension}"
+    taken.add(candidate)
+    names.append(candidate)
+  return names
+
+# Raised by add_files when a concurrent request has already recorded a file under the same key
+class UploadAlreadyRecorded(Exception):
+  def __init__(self, record: models.File):
+    super().__init__(record.s3_key)
+    self.record = record
+
+# The File recorded under one of `keys` for content stored under its own key (not a shared blob), if any
+async def recorded_file(db: AsyncSession, keys):
+  return (await db.execute(
+    select(models.File).where(models.File.s3_key.in_(keys), models.File.blob_sha256.is_(None))
+  )).scalars().first()
+
+# Add File rows to a folder under unique names, picking the names again if a concurrent upload
+# takes one of them first (the folder_id, filename unique index rejects the insert)
+# A concurrent completion of the same upload trips uq_files_s3_key instead; that raises UploadAlreadyRecorded
+async def add_files(db: AsyncSession, folder_id: int, records: list) -> list:
+  requested = [record.filename for record in records]
+  own_keys = [record.s3_key for record in records if record.blob_sha256 is None]
+  for _ in range(UNIQUE_NAME_ATTEMPTS):
+    for record, name in zip(records, await unique_filenames(db, folder_id, requested)):
+      record.filename = name
+    try:
+      async with db.begin_nested():
+        db.add_all(records)
+      return records
+    except IntegrityError:
+      recorded = await recorded_file(db, own_keys) if own_keys else None
+      if recorded is not None:
+        raise UploadAlreadyRecorded(recorded)
+      continue
+  raise HTTPException(status_code=409, detail="Too many uploads with the same name at once, try again")
+
+# Sign what /uploads/complete needs to know about a direct upload, so the server keeps no state in between
+def create_upload_token(user_id: int, claims: dict) -> str:
+  expire = datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_URL_EXPIRATION)
+  return jwt.encode({**claims, "purpose": UPLOAD_TOKEN_PURPOSE, "uploader": user_id, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
+def read_upload_token(token: str, user_id: int) -> dict:
+  try:
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+  except InvalidTokenError:
+    raise HTTPException(status_code=400, detail="Invalid or expired upload token")
+  if claims.get("purpose") != UPLOAD_TOKEN_PURPOSE:
+    raise HTTPException(status_code=400, detail="Invalid or expired upload token")
+  if claims["uploader"] != user_id:
+    raise HTTPException(status_code=403, detail="Not authorized to complete this upload")
+  return claims
@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+from app.utils import metrics
+
+_MISSING = object()
+
+class TTLCache:
+  """A thread-safe LRU cache whose entries expire.
+
+  Entries live for `ttl` seconds unless `set` is given an explicit `expires_at`
+  (a time.monotonic() deadline). Once `maxsize` entries are held, the least
+  recently used one is dropped. Hits, misses and evictions are counted under `name`.
+  """
+
+  def __init__(self, name: str, maxsize: int, ttl: float):
+    self.name = name
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self._entries = OrderedDict() # key -> (expires_at, value)
+    self._lock = threading.Lock()
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._entries.get(key, _MISSING)
+      if entry is not _MISSING and entry[0] > time.monotonic():
+        self._entries.move_to_end(key)
+        metrics.incr(f"{self.name}.hits")
+        return entry[1]
+      if entry is not _MISSING:
+        del self._entries[key]
+    metrics.incr(f"{self.name}.misses")
+    return default
+
+  def set(self, key, value, expires_at: float = None):
+    if self.maxsize <= 0 or self.ttl <= 0:
+      return
+    deadline = time.monotonic() + self.ttl
+    if expires_at is not None:
+      deadline = min(deadline, expires_at)
+    with self._lock:
+      self._entries[key] = (deadline, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+        metrics.incr(f"{self.name}.evictions")
+
+  def pop(self, key):
+    with self._lock:
+      entry = self._entries.pop(key, None)
+    return entry[1] if entry else None
+
+  # drop every entry whose key matches, returning how many were removed
+  def discard_where(self, predicate) -> int:
+    with self._lock:
+      keys = [key for key in self._entries if predicate(key)]
+      for key in keys:
+        del self._entries[key]
+    return len(keys)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def __len__(self):
+    return len(self._entries)
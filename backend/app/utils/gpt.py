@@ -1,22 +1,76 @@
 import os
-from openai import OpenAI
+import asyncio
+import weakref
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 from typing import Optional
 import json
+from app.utils import llm_cache
+from app.utils.singleflight import SingleFlight
+from app.utils.json_stream import JsonArrayObjectParser
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+FLASHCARD_MODEL = 'gpt-4o-mini'
+CHAT_MODEL = 'gpt-3.5-turbo'
 
-def generate_flashcards(
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60")) # seconds allowed for a single upstream call
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "20")) # upstream calls in flight per worker
+
+# identical requests that arrive while one is already running wait for its result
+_inflight = SingleFlight("llm.singleflight")
+
+# the async client and its concurrency limiter are bound to the event loop that created them,
+# so keep one pair per loop (uvicorn only ever has one, the test client may start several)
+_async_clients = weakref.WeakKeyDictionary()
+
+def _get_async_client():
+    loop = asyncio.get_running_loop()
+    state = _async_clients.get(loop)
+    if state is None:
+        state = (
+            AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES),
+            asyncio.Semaphore(LLM_MAX_CONCURRENCY),
+        )
+        _async_clients[loop] = state
+    return state
+
+# Send a chat completion request through the async client
+# Waits for a free slot so at most LLM_MAX_CONCURRENCY calls hit the upstream at once
+# param: kwargs: arguments for client.chat.completions.create
+async def _create_completion(**kwargs):
+    async_client, limiter = _get_async_client()
+    async with limiter:
+        return await async_client.chat.completions.create(timeout=LLM_TIMEOUT, **kwargs)
+
+# Run an LLM call at most once for concurrent identical inputs, going through the cache first
+# param: compute: zero-argument coroutine function doing the actual LLM call
+async def _deduplicated_call(kind: str, model: str, inputs: dict, compute):
+    key = llm_cache.make_key(kind, model, inputs)
+    return await _inflight.do(key, lambda: llm_cache.memoize(kind, model, inputs, compute))
+
+# Generate flashcards for a topic, answering repeated requests from the LLM cache
+# param: focus: Optional aspect of the topic to concentrate on
+async def generate_flashcards(
     topic: str,  #WILL CHANGE LATER TO PROJECT FILES
-    card_count: int = 10
+    card_count: int = 10,
+    focus: Optional[str] = None
 ):
+    inputs = {"topic": topic, "card_count": card_count, "focus": focus}
+    return await _deduplicated_call(
+        "flashcards", FLASHCARD_MODEL, inputs,
+        lambda: _generate_flashcards(topic, card_count, focus)
+    )
+
+def _flashcard_messages(topic: str, card_count: int, focus: Optional[str]):
+    focus_line = f"Focus the flashcards on {focus}." if focus else ""
     prompt = f"""
     Create {card_count} flashcards about {topic}.
-    
+    {focus_line}
+
     Format your response as a JSON object with an array of flashcards.
     Each flashcard should have a 'question' and 'answer' field.
-    For example: 
+    For example:
     {{
       "flashcards": [
         {{ "question": "What is X?", "answer": "X is Y." }},
@@ -24,29 +78,126 @@ def generate_flashcards(
       ]
     }}
     """
+    return [{"role": "developer", "content": prompt},
+            {"role": "user", "content": "Please generate flashcards based on the topic provided."}]
 
-    response = client.chat.completions.create(
-        model = 'gpt-4o-mini',
+async def _generate_flashcards(topic: str, card_count: int, focus: Optional[str]):
+    response = await _create_completion(
+        model = FLASHCARD_MODEL,
         response_format={"type": "json_object"},
-        messages=[{"role": "developer", "content": prompt},
-                  {"role": "user", "content": "Please generate flashcards based on the topic provided."}],
+        messages=_flashcard_messages(topic, card_count, focus),
     )
 
     response_content = response.choices[0].message.content
     flashcards_data = json.loads(response_content)
     flashcards = flashcards_data.get("flashcards", []) # asking chatgpt to return the flashcards as "flashcards" as a list
     return flashcards
-    
-def generate_response(
+
+# Stream flashcards for a topic, yielding each {question, answer} dict as soon as the model finishes it
+# Cards already yielded are kept if the rest of the response turns out to be malformed
+async def stream_flashcards(
+    topic: str,
+    card_count: int = 10,
+    focus: Optional[str] = None
+):
+    inputs = {"topic": topic, "card_count": card_count, "focus": focus}
+    cached = await llm_cache.lookup("flashcards", FLASHCARD_MODEL, inputs)
+    if cached is not None:
+        for flashcard in cached:
+            yield flashcard
+        return
+
+    async_client, limiter = _get_async_client()
+    parser = JsonArrayObjectParser()
+    flashcards = []
+    finish_reason = None
+    skipped = 0
+    async with limiter:
+        stream = await async_client.chat.completions.create(
+            model = FLASHCARD_MODEL,
+            response_format={"type": "json_object"},
+            messages=_flashcard_messages(topic, card_count, focus),
+            stream = True,
+            timeout = LLM_TIMEOUT,
+        )
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                for flashcard in parser.feed(delta):
+                    if flashcard.get("question") and flashcard.get("answer"):
+                        flashcards.append(flashcard)
+                        yield flashcard
+                    else:
+                        skipped += 1
+        finally:
+            await stream.close()
+
+    # only a whole, well-formed answer goes into the shared cache; a truncated or partly
+    # malformed one would otherwise be served to generate_flashcards and jobs until it expires
+    if flashcards and finish_reason == "stop" and parser.complete and not parser.errors and not skipped:
+        await llm_cache.store("flashcards", FLASHCARD_MODEL, inputs, flashcards)
+
+async def generate_response(
     chatMessage: str
-): 
+):
+    return await _deduplicated_call(
+        "chat", CHAT_MODEL, {"message": chatMessage},
+        lambda: _generate_response(chatMessage)
+    )
+
+def _chat_messages(chatMessage: str):
     prompt = "You are a helpful assistant that can answer questions and help with tasks."
+    return [{"role": "assistant", "content": prompt},
+            {"role": "user", "content": chatMessage}]
 
-    response = client.chat.completions.create(
-        model = 'gpt-3.5-turbo',
-        messages = [{"role": "assistant", "content": prompt},
-                    {"role": "user", "content": chatMessage}],
+async def _generate_response(chatMessage: str):
+    response = await _create_completion(
+        model = CHAT_MODEL,
+        messages = _chat_messages(chatMessage),
     )
 
     response_content = response.choices[0].message.content
-    return response_content
\ No newline at end of file
+    # a reply cut off by the token limit is still shown, but isn't served to everyone asking for the TTL
+    if response.choices[0].finish_reason != "stop":
+        return llm_cache.Uncached(response_content)
+    return response_content
+
+# Stream the answer to a chat message as it is generated, yielding text deltas
+# Closing the generator early closes the upstream HTTP response, which stops generation
+async def stream_response(chatMessage: str):
+    inputs = {"message": chatMessage}
+    cached = await llm_cache.lookup("chat", CHAT_MODEL, inputs)
+    if cached is not None:
+        yield cached
+        return
+
+    async_client, limiter = _get_async_client()
+    parts = []
+    finish_reason = None
+    async with limiter:
+        stream = await async_client.chat.completions.create(
+            model = CHAT_MODEL,
+            messages = _chat_messages(chatMessage),
+            stream = True,
+            timeout = LLM_TIMEOUT,
+        )
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            await stream.close()
+
+    # like stream_flashcards, only an answer the model finished goes into the shared cache
+    if finish_reason == "stop":
+        await llm_cache.store("chat", CHAT_MODEL, inputs, "".join(parts))
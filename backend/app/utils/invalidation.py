@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import os
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+# "postgres" or "memory"; defaults to postgres when the database is Postgres
+INVALIDATION_BACKEND = os.getenv("INVALIDATION_BACKEND")
+INVALIDATION_RECONNECT_INTERVAL = float(os.getenv("INVALIDATION_RECONNECT_INTERVAL", "5")) # seconds between checks of the listening connection
+
+class InMemoryChannel:
+  """Delivers published messages to the subscribers in this process.
+
+  Enough for a single worker, and a stand-in for a shared channel in tests.
+  """
+
+  def __init__(self, name: str):
+    self.name = name
+    self._handlers = []
+    self._resync_handlers = []
+
+  def subscribe(self, handler):
+    self._handlers.append(handler)
+
+  def unsubscribe(self, handler):
+    self._handlers.remove(handler)
+
+  # `handler` is awaited whenever messages may have been missed, e.g. after the channel reconnects,
+  # so the subscriber can reload what it caches from the database
+  def on_resync(self, handler):
+    self._resync_handlers.append(handler)
+
+  def remove_resync(self, handler):
+    self._resync_handlers.remove(handler)
+
+  async def start(self):
+    pass
+
+  async def stop(self):
+    pass
+
+  async def publish(self, message: dict):
+    self._deliver(message)
+
+  def _deliver(self, message: dict):
+    for handler in list(self._handlers):
+      try:
+        handler(message)
+      except Exception:
+        logger.exception("Invalidation handler for %s failed", self.name)
+
+  async def _resync(self):
+    for handler in list(self._resync_handlers):
+      try:
+        await handler()
+      except Exception:
+        logger.exception("Resync handler for %s failed", self.name)
+
+class PostgresChannel(InMemoryChannel):
+  """Fans messages out to every worker with Postgres LISTEN/NOTIFY.
+
+  Each worker keeps one connection listening on the channel, and publishing sends
+  pg_notify over it, so the worker that made a change also hears about it.
+  The connection is checked every INVALIDATION_RECONNECT_INTERVAL seconds and reopened
+  when it has dropped; since notifications sent meanwhile are lost, subscribers are then
+  asked to resync. While it is down, messages only reach this worker.
+  """
+
+  def __init__(self, name: str, database_url: str):
+    super().__init__(name)
+    # asyncpg wants a plain postgresql:// DSN, without SQLAlchemy's driver suffix
+    self._dsn = make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+    self._connection = None
+    self._lock = asyncio.Lock()
+    self._watcher = None
+
+  async def start(self):
+    await self._connect()
+    self._watcher = asyncio.create_task(self._watch())
+
+  async def stop(self):
+    if self._watcher is not None:
+      self._watcher.cancel()
+      try:
+        await self._watcher
+      except asyncio.CancelledError:
+        pass
+      self._watcher = None
+    await self._disconnect()
+
+  async def _connect(self) -> bool:
+    import asyncpg
+    try:
+      self._connection = await asyncpg.connect(self._dsn)
+      await self._connection.add_listener(self.name, self._on_notify)
+      return True
+    except Exception:
+      logger.exception("Could not listen on %s; invalidations stay local to this worker until it reconnects", self.name)
+      await self._disconnect()
+      return False
+
+  async def _disconnect(self):
+    connection, self._connection = self._connection, None
+    if connection is not None:
+      try:
+        await connection.close(timeout=INVALIDATION_RECONNECT_INTERVAL)
+      except Exception:
+        connection.terminate()
+
+  async def _alive(self) -> bool:
+    if self._connection is None or self._connection.is_closed():
+      return False
+    try:
+      # a dropped network path doesn't always close the socket, so ask the server
+      async with self._lock:
+        await self._connection.fetchval("SELECT 1", timeout=INVALIDATION_RECONNECT_INTERVAL)
+      return True
+    except Exception:
+      return False
+
+  async def _watch(self):
+    while True:
+      await asyncio.sleep(INVALIDATION_RECONNECT_INTERVAL)
+      if await self._alive():
+        continue
+      logger.warning("Lost the listening connection on %s; reconnecting", self.name)
+      await self._disconnect()
+      if await self._connect():
+        await self._resync()
+
+  async def publish(self, message: dict):
+    if self._connection is None or self._connection.is_closed():
+      self._deliver(message)
+      return
+    try:
+      # one connection can't run two statements at once
+      async with self._lock:
+        await self._connection.execute("SELECT pg_notify($1, $2)", self.name, json.dumps(message))
+    except Exception:
+      logger.exception("Could not notify %s; invalidating this worker only", self.name)
+      self._deliver(message)
+
+  def _on_notify(self, connection, pid, channel, payload):
+    self._deliver(json.loads(payload))
+
+# Channel called `name` for the configured backend
+def create_channel(name: str, database_url: str):
+  backend = INVALIDATION_BACKEND
+  if backend is None:
+    backend = "postgres" if make_url(database_url).get_backend_name() == "postgresql" else "memory"
+  if backend == "postgres":
+    return PostgresChannel(name, database_url)
+  return InMemoryChannel(name)
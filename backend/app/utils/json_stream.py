@@ -0,0 +1,61 @@
+import json
+
+class JsonArrayObjectParser:
+  """Pull complete objects out of a JSON document while it is still being received.
+
+  Every object that is a direct element of an array is returned as soon as its
+  closing brace arrives, so `{"flashcards": [{...}, {...}, {` yields the first two
+  cards and keeps the third buffered. Objects that fail to decode are skipped, which
+  means a malformed or truncated tail only loses the object it breaks; `errors` counts
+  them and `complete` tells whether the whole document was closed.
+  """
+
+  def __init__(self):
+    self._stack = [] # open containers, "{" or "["
+    self._in_string = False
+    self._escaped = False
+    self._capture = None # characters of the array element being collected
+    self._capture_depth = None
+    self._opened = False
+    self.errors = 0 # array elements that failed to decode
+
+  @property
+  def complete(self) -> bool:
+    """Whether the outermost container has been closed."""
+    return self._opened and not self._stack
+
+  # Consume the next piece of the document, returning the objects it completed
+  def feed(self, text: str) -> list:
+    completed = []
+    for char in text:
+      if self._capture is not None:
+        self._capture.append(char)
+
+      if self._in_string:
+        if self._escaped:
+          self._escaped = False
+        elif char == "\\":
+          self._escaped = True
+        elif char == '"':
+          self._in_string = False
+        continue
+
+      if char == '"':
+        self._in_string = True
+      elif char in "{[":
+        if char == "{" and self._capture is None and self._stack and self._stack[-1] == "[":
+          self._capture = [char]
+          self._capture_depth = len(self._stack)
+        self._stack.append(char)
+        self._opened = True
+      elif char in "}]":
+        if self._stack:
+          self._stack.pop()
+        if self._capture is not None and len(self._stack) == self._capture_depth:
+          raw = "".join(self._capture)
+          self._capture = None
+          try:
+            completed.append(json.loads(raw))
+          except json.JSONDecodeError:
+            self.errors += 1
+    return completed
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
+from app.database import SessionLocal
+from app import models
+from app.utils import metrics
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))) # seconds an entry stays valid
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000")) # least recently used entries are evicted past this
+LLM_CACHE_TOUCH_INTERVAL = float(os.getenv("LLM_CACHE_TOUCH_INTERVAL", "60")) # seconds a hit leaves last_used_at alone after it was updated
+LLM_CACHE_EVICT_INTERVAL = float(os.getenv("LLM_CACHE_EVICT_INTERVAL", "60")) # seconds between eviction passes in a process
+
+# time.monotonic() of this process's last eviction pass
+_last_eviction = None
+
+# Inputs whose case and spacing don't change the answer; everything else, like a chat message,
+# is keyed by its exact text, since "ls -L" and "ls -l" (or differently indented code) are different questions
+NORMALIZED_INPUTS = {"topic", "focus"}
+# part of every key; bumped when the keying changes so entries stored under the old scheme are never served
+KEY_VERSION = 2
+
+def _normalize(value):
+  # "  Photosynthesis " and "photosynthesis" are the same request
+  if isinstance(value, str):
+    return " ".join(value.split()).casefold()
+  return value
+
+# Build the content address of an LLM call from its inputs, normalizing those in NORMALIZED_INPUTS
+# param: kind: which generator produced the value ("flashcards", "chat")
+# param: model: model name, so switching models never serves stale answers
+# param: inputs: prompt inputs, e.g. topic, card_count, focus
+def make_key(kind: str, model: str, inputs: dict) -> str:
+  keyed = {name: _normalize(value) if name in NORMALIZED_INPUTS else value for name, value in inputs.items()}
+  payload = json.dumps({"version": KEY_VERSION, "kind": kind, "model": model, "inputs": keyed}, sort_keys=True)
+  return hashlib.sha256(payload.encode()).hexdigest()
+
+def get(key: str):
+  now = datetime.now(timezone.utc)
+  with SessionLocal() as db:
+    entry = db.query(models.LLMCacheEntry).filter(
+      models.LLMCacheEntry.key == key,
+      models.LLMCacheEntry.expires_at > now
+    ).first()
+    if entry is None:
+      metrics.incr("llm_cache.misses")
+      return None
+
+    value = json.loads(entry.value)
+    # touching last_used_at is what makes eviction least-recently-used; to the minute is close
+    # enough for that, so a hot entry is written once per interval rather than on every hit
+    # (hits counts those touches; the llm_cache.hits metric has the exact number)
+    if entry.last_used_at.replace(tzinfo=timezone.utc) <= now - timedelta(seconds=LLM_CACHE_TOUCH_INTERVAL):
+      entry.last_used_at = now
+      entry.hits += 1
+      db.commit()
+  metrics.incr("llm_cache.hits")
+  return value
+
+def put(key: str, kind: str, model: str, value):
+  now = datetime.now(timezone.utc)
+  with SessionLocal() as db:
+    db.merge(models.LLMCacheEntry(
+      key=key,
+      kind=kind,
+      model=model,
+      value=json.dumps(value),
+      created_at=now,
+      last_used_at=now,
+      expires_at=now + timedelta(seconds=LLM_CACHE_TTL),
+      hits=0
+    ))
+    db.commit()
+  _maybe_evict(now)
+
+# Evict at most once per LLM_CACHE_EVICT_INTERVAL, so inserts don't each pay for counting the table;
+# in between, the store can run past LLM_CACHE_MAX_ENTRIES by the entries added meanwhile
+def _maybe_evict(now):
+  global _last_eviction
+  if _last_eviction is not None and time.monotonic() - _last_eviction < LLM_CACHE_EVICT_INTERVAL:
+    return
+  _last_eviction = time.monotonic()
+  with SessionLocal() as db:
+    _evict(db, now)
+    db.commit()
+
+def _evict(db, now):
+  expired = db.query(models.LLMCacheEntry).filter(models.LLMCacheEntry.expires_at <= now).delete(synchronize_session=False)
+
+  excess = db.query(func.count(models.LLMCacheEntry.key)).scalar() - LLM_CACHE_MAX_ENTRIES
+  if excess > 0:
+    oldest = db.query(models.LLMCacheEntry.key).order_by(models.LLMCacheEntry.last_used_at).limit(excess)
+    db.query(models.LLMCacheEntry).filter(models.LLMCacheEntry.key.in_([row.key for row in oldest])).delete(synchronize_session=False)
+  metrics.incr("llm_cache.evictions", expired + max(excess, 0))
+
+def clear():
+  with SessionLocal() as db:
+    db.query(models.LLMCacheEntry).delete()
+    db.commit()
+
+# Look up a previous result for these inputs, None when there is none
+async def lookup(kind: str, model: str, inputs: dict):
+  if not LLM_CACHE_ENABLED:
+    return None
+  return await run_in_threadpool(get, make_key(kind, model, inputs))
+
+async def store(kind: str, model: str, inputs: dict, value):
+  if not LLM_CACHE_ENABLED:
+    return
+  await run_in_threadpool(put, make_key(kind, model, inputs), kind, model, value)
+
+class Uncached:
+  """A result `compute` hands back to memoize for the caller only, e.g. an answer cut off by the token limit."""
+
+  def __init__(self, value):
+    self.value = value
+
+# Return the cached value for this call, or await `compute` and store its result
+# param: compute: zero-argument coroutine function doing the actual LLM call; results wrapped in Uncached aren't stored
+async def memoize(kind: str, model: str, inputs: dict, compute):
+  value = await lookup(kind, model, inputs)
+  if value is not None:
+    return value
+
+  value = await compute()
+  if isinstance(value, Uncached):
+    return value.value
+  await store(kind, model, inputs, value)
+  return value
+
+def stats() -> dict:
+  return {
+    "hits": metrics.get_counter("llm_cache.hits"),
+    "misses": metrics.get_counter("llm_cache.misses"),
+    "evictions": metrics.get_counter("llm_cache.evictions"),
+  }
@@ -0,0 +1,58 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+# In-process counters, gauges and histograms for the current worker.
+# Values are cheap to update from any thread and are read back with snapshot().
+
+# upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_histograms = {}
+
+# Add `value` to the counter called `name`
+def incr(name: str, value: int = 1):
+  with _lock:
+    _counters[name] += value
+
+# Set the gauge called `name` to its current value, e.g. a queue depth
+def set_gauge(name: str, value: float):
+  with _lock:
+    _gauges[name] = value
+
+# Record one observation (usually a duration in seconds) in the histogram called `name`
+def observe(name: str, value: float, buckets: tuple = DEFAULT_BUCKETS):
+  with _lock:
+    histogram = _histograms.get(name)
+    if histogram is None:
+      histogram = _histograms[name] = {"buckets": buckets, "counts": [0] * (len(buckets) + 1), "count": 0, "sum": 0.0}
+    histogram["counts"][bisect_left(histogram["buckets"], value)] += 1
+    histogram["count"] += 1
+    histogram["sum"] += value
+
+def get_counter(name: str) -> int:
+  with _lock:
+    return _counters.get(name, 0)
+
+def get_gauge(name: str):
+  with _lock:
+    return _gauges.get(name)
+
+# Copy of every counter, gauge and histogram, safe to serialize as JSON
+def snapshot() -> dict:
+  with _lock:
+    histograms = {}
+    for name, histogram in _histograms.items():
+      buckets = {str(bound): count for bound, count in zip(histogram["buckets"], histogram["counts"])}
+      buckets["+Inf"] = histogram["counts"][-1]
+      histograms[name] = {"buckets": buckets, "count": histogram["count"], "sum": histogram["sum"]}
+    return {"counters": dict(_counters), "gauges": dict(_gauges), "histograms": histograms}
+
+def reset():
+  with _lock:
+    _counters.clear()
+    _gauges.clear()
+    _histograms.clear()
@@ -0,0 +1,43 @@
+import base64
+import json
+import os
+from typing import NamedTuple, Optional
+from fastapi import HTTPException, Query
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+class Page(NamedTuple):
+  after: Optional[int] # id of the last row on the previous page, None for the first page
+  limit: int
+
+# Cursors are opaque to clients so the key behind them can change without breaking anyone
+def encode_cursor(last_id: int) -> str:
+  return base64.urlsafe_b64encode(json.dumps({"after": last_id}).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+  try:
+    after = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))["after"]
+  except (ValueError, TypeError, KeyError):
+    after = None
+  if not isinstance(after, int):
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+  return after
+
+# Dependency for list endpoints: ?cursor=<next_cursor of the previous page>&limit=<page size>
+def page_params(cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)) -> Page:
+  return Page(decode_cursor(cursor) if cursor else None, limit)
+
+# Restrict `query` to one page in `id_column` order, fetching a single extra row to tell whether more follow
+# The filters already on `query` (owner or folder) plus this id range is what the (owner/folder, id) indexes serve
+def keyset(query, id_column, page: Page):
+  if page.after is not None:
+    query = query.where(id_column > page.after)
+  return query.order_by(id_column).limit(page.limit + 1)
+
+# Split the rows of a keyset query into this page and the cursor of the next one (None on the last page)
+def page_of(rows, page: Page, key=lambda row: row.id):
+  rows = list(rows)
+  if len(rows) <= page.limit:
+    return rows, None
+  return rows[:page.limit], encode_cursor(key(rows[page.limit - 1]))
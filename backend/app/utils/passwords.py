@@ -0,0 +1,94 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from app.utils import metrics
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))) # threads doing bcrypt work
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64")) # hashes queued or running before new ones get a 503
+PASSWORD_HASH_TARGET_SECONDS = float(os.getenv("PASSWORD_HASH_TARGET_SECONDS", "0.25")) # calibration aims for one hash to take this long
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "0")) # fixed bcrypt cost, skips calibration when set
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", "10")) # calibration never goes below this
+BCRYPT_MAX_ROUNDS = 16
+
+# hashes below the configured cost are reported as needing an update, which triggers rehash on login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_executor = None
+_pending = 0
+_pending_lock = threading.Lock()
+_calibrated = False
+
+def _get_executor() -> ThreadPoolExecutor:
+  global _executor
+  if _executor is None:
+    _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+  return _executor
+
+# Run blocking password work on the password pool instead of the event loop or AnyIO's threads
+# Raises a 503 once PASSWORD_HASH_QUEUE_LIMIT hashes are already waiting or running
+async def _run(fn, *args):
+  global _pending
+  with _pending_lock:
+    if _pending >= PASSWORD_HASH_QUEUE_LIMIT:
+      metrics.incr("passwords.rejected")
+      raise HTTPException(status_code=503, detail="Too many sign-in attempts right now, please retry", headers={"Retry-After": "1"})
+    _pending += 1
+    metrics.set_gauge("passwords.queue_depth", _pending)
+
+  submitted = time.perf_counter()
+  def timed():
+    started = time.perf_counter()
+    metrics.observe("passwords.wait_seconds", started - submitted)
+    try:
+      return fn(*args)
+    finally:
+      metrics.observe("passwords.hash_seconds", time.perf_counter() - started)
+
+  try:
+    return await asyncio.wrap_future(_get_executor().submit(timed))
+  finally:
+    with _pending_lock:
+      _pending -= 1
+      metrics.set_gauge("passwords.queue_depth", _pending)
+
+async def hash_password(password: str) -> str:
+  return await _run(pwd_context.hash, password)
+
+# Check a password against its stored hash
+# Returns (valid, new_hash); new_hash is set when the stored hash uses an outdated cost and should be replaced
+async def verify_and_update(password: str, hashed_password: str):
+  return await _run(pwd_context.verify_and_update, password, hashed_password)
+
+# Use `rounds` for new hashes and treat anything cheaper as outdated
+def set_bcrypt_rounds(rounds: int):
+  pwd_context.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+  metrics.set_gauge("passwords.bcrypt_rounds", rounds)
+
+# Highest bcrypt cost whose hash takes no longer than `target` seconds on this machine
+# Each extra round doubles the work, so one timing at BCRYPT_MIN_ROUNDS is enough to extrapolate
+def calibrate_bcrypt_rounds(target: float = PASSWORD_HASH_TARGET_SECONDS) -> int:
+  handler = pwd_context.handler("bcrypt").using(rounds=BCRYPT_MIN_ROUNDS)
+  elapsed = float("inf")
+  for _ in range(2):
+    start = time.perf_counter()
+    handler.hash("calibration")
+    elapsed = min(elapsed, time.perf_counter() - start)
+
+  rounds = BCRYPT_MIN_ROUNDS
+  while rounds < BCRYPT_MAX_ROUNDS and elapsed * 2 <= target:
+    rounds += 1
+    elapsed *= 2
+  return rounds
+
+# Pick the bcrypt cost once per process, on the password pool; called at startup
+async def configure_password_hashing():
+  global _calibrated
+  if _calibrated:
+    return
+  rounds = BCRYPT_ROUNDS or await _run(calibrate_bcrypt_rounds)
+  set_bcrypt_rounds(rounds)
+  _calibrated = True
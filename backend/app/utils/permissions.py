@@ -1,63 +1,165 @@
+import os
+from typing import NamedTuple, Optional
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select, and_
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models
+from app.models import PERMISSION_RANKS
+from app.database import DATABASE_URL, reads_from_replica
+from app.services import acl # keeps folder_acl, which every check below reads, in sync
+from app.utils.cache import TTLCache
+from app.utils.invalidation import create_channel
 
-def verify_folder_ownership(db: Session, folder_id: int, user_id: int):
+PERMISSION_NAMES = {rank: name for name, rank in PERMISSION_RANKS.items()}
+
+PERMISSION_CACHE_TTL = float(os.getenv("PERMISSION_CACHE_TTL", "60")) # upper bound on staleness if an invalidation is lost, 0 disables
+PERMISSION_CACHE_SIZE = int(os.getenv("PERMISSION_CACHE_SIZE", "50000"))
+
+# (user_id, folder_id) -> (effective permission,); only grants read from the primary are kept, so
+# a lagging replica can't bring back a revoked share and newly created access is seen at once
+permission_cache = TTLCache("permissions.cache", PERMISSION_CACHE_SIZE, PERMISSION_CACHE_TTL)
+# tells every worker which cached permissions to drop after a share or folder changes
+invalidation_channel = create_channel("permission_invalidations", DATABASE_URL)
+
+class FolderAccess(NamedTuple):
+    folder: Optional[models.StudyFolder] # None when the folder doesn't exist
+    permission: Optional[str] # "owner", a share's permission type, or None without access
+
+    def allows(self, permission_types=None) -> bool:
+        """Whether the caller may act with one of `permission_types` (any access when omitted)."""
+        if self.permission is None:
+            return False
+        return self.permission == "owner" or not permission_types or self.permission in permission_types
+
+def _acl_entry(user_id: int):
+    """Join condition matching the user's folder_acl row for StudyFolder (a primary-key lookup)."""
+    return and_(
+        models.FolderACL.folder_id == models.StudyFolder.id,
+        models.FolderACL.user_id == user_id
+    )
+
+async def resolve_folder_access(db: AsyncSession, folder_id: int, user_id: int) -> FolderAccess:
+    """Load a folder together with the user's effective permission on it, in one query."""
+    result = await db.execute(
+        select(models.StudyFolder, models.FolderACL.permission_rank)
+        .outerjoin(models.FolderACL, _acl_entry(user_id))
+        .where(models.StudyFolder.id == folder_id)
+    )
+    row = result.first()
+    if row is None:
+        return FolderAccess(None, None)
+    return FolderAccess(row[0], PERMISSION_NAMES.get(row[1]))
+
+async def resolve_flashcard_access(db: AsyncSession, flashcard_id: int, user_id: int):
+    """Load a flashcard and the user's FolderAccess on its folder, in one query.
+
+    Returns (None, FolderAccess(None, None)) when the flashcard doesn't exist.
+    """
+    result = await db.execute(
+        select(models.Flashcard, models.StudyFolder, models.FolderACL.permission_rank)
+        .join(models.StudyFolder, models.StudyFolder.id == models.Flashcard.folder_id)
+        .outerjoin(models.FolderACL, _acl_entry(user_id))
+        .where(models.Flashcard.id == flashcard_id)
+    )
+    row = result.first()
+    if row is None:
+        return None, FolderAccess(None, None)
+    return row[0], FolderAccess(row[1], PERMISSION_NAMES.get(row[2]))
+
+async def resolve_folder_permissions(db: AsyncSession, user_id: int, folder_ids=None) -> dict:
+    """Map folder id to the user's effective permission for many folders, in one query.
+
+    Only folders the user can access appear in the result. Without `folder_ids`, every
+    folder the user owns or has an accepted share of is returned.
+    """
+    query = select(models.FolderACL.folder_id, models.FolderACL.permission_rank).where(models.FolderACL.user_id == user_id)
+    if folder_ids is not None:
+        query = query.where(models.FolderACL.folder_id.in_(set(folder_ids)))
+    return {folder_id: PERMISSION_NAMES[rank] for folder_id, rank in (await db.execute(query)).all()}
+
+def shared_folder_ids(user_id: int):
+    """Subquery of the ids of the folders the user has an accepted share of, leaving out their own."""
+    return select(models.FolderACL.folder_id).where(
+        models.FolderACL.user_id == user_id,
+        models.FolderACL.permission_rank < PERMISSION_RANKS["owner"]
+    )
+
+def forget_permissions(folder_id: int, user_id: int = None, cache: TTLCache = permission_cache):
+    """Drop cached permissions on a folder, for one user or (without `user_id`) for everyone."""
+    if user_id is None:
+        cache.discard_where(lambda key: key[1] == folder_id)
+    else:
+        cache.pop((user_id, folder_id))
+
+def handle_invalidation(message: dict):
+    forget_permissions(message["folder_id"], message.get("user_id"))
+
+async def invalidate_permissions(folder_id: int, user_id: int = None):
+    """Call after committing a change to a folder or its shares; reaches every worker."""
+    forget_permissions(folder_id, user_id)
+    await invalidation_channel.publish({"folder_id": folder_id, "user_id": user_id})
+
+async def forget_all_permissions():
+    """Drop every cached permission, e.g. after invalidations may have been missed."""
+    permission_cache.clear()
+
+async def start_permission_invalidation():
+    invalidation_channel.subscribe(handle_invalidation)
+    invalidation_channel.on_resync(forget_all_permissions)
+    await invalidation_channel.start()
+
+async def stop_permission_invalidation():
+    await invalidation_channel.stop()
+    invalidation_channel.remove_resync(forget_all_permissions)
+    invalidation_channel.unsubscribe(handle_invalidation)
+
+async def get_folder_permission(db: AsyncSession, folder_id: int, user_id: int) -> Optional[str]:
+    """The user's effective permission on a folder (None without access), cached per (user, folder)."""
+    cached = permission_cache.get((user_id, folder_id))
+    if cached is not None:
+        return cached[0]
+    access = await resolve_folder_access(db, folder_id, user_id)
+    remember_permission(db, user_id, folder_id, access.permission)
+    return access.permission
+
+def remember_permission(db: AsyncSession, user_id: int, folder_id: int, permission: Optional[str]):
+    """Cache a permission `db` just read, unless it's a denial or may be stale (read from a replica)."""
+    if permission is not None and not reads_from_replica(db):
+        permission_cache.set((user_id, folder_id), (permission,))
+
+async def verify_folder_ownership(db: AsyncSession, folder_id: int, user_id: int):
     """Verify if a user is the owner of a folder, returning the folder if true."""
-    folder = db.query(models.StudyFolder).filter(
+    result = await db.execute(select(models.StudyFolder).where(
         models.StudyFolder.id == folder_id,
         models.StudyFolder.user_id == user_id
-    ).first()
-    return folder
-
-def verify_folder_access(db: Session, folder_id: int, user_id: int, permission_types=None):
-    # First check if user is the owner
-    folder = verify_folder_ownership(db, folder_id, user_id)
-    if folder:
-        return folder
-    
-    # If not owner, check for shared access
-    share_query = db.query(models.FolderShare).filter(
-        models.FolderShare.folder_id == folder_id,
-        models.FolderShare.user_id == user_id,
-        models.FolderShare.invitation_accepted == True
-    )
-    
-    # If specific permission types required, add that filter
-    if permission_types:
-        share_query = share_query.filter(
-            models.FolderShare.permission_type.in_(permission_types)
-        )
-    
-    shared_access = share_query.first()
-    
-    # If no shared access either, folder not found or not accessible
-    if not shared_access:
+    ))
+    return result.scalars().first()
+
+# Returns the user's effective permission on the folder, raising 404 without the required access
+async def verify_folder_access(db: AsyncSession, folder_id: int, user_id: int, permission_types=None):
+    permission = await get_folder_permission(db, folder_id, user_id)
+
+    # Missing folders and folders without the required access look the same to the caller
+    if not FolderAccess(None, permission).allows(permission_types):
         raise HTTPException(
-            status_code=404, 
+            status_code=404,
             detail="Folder not found or you don't have required permissions"
         )
-    
-    # Double-check folder exists
-    folder = db.query(models.StudyFolder).filter(models.StudyFolder.id == folder_id).first()
-    if not folder:
-        raise HTTPException(status_code=404, detail="Folder not found")
-    
-    return folder
-
-def verify_flashcard_access(db: Session, flashcard_id: int, user_id: int, permission_types=None):
-    flashcard = db.query(models.Flashcard).filter(models.Flashcard.id == flashcard_id).first()
-    
+
+    return permission
+
+async def verify_flashcard_access(db: AsyncSession, flashcard_id: int, user_id: int, permission_types=None):
+    flashcard, access = await resolve_flashcard_access(db, flashcard_id, user_id)
+
     if not flashcard:
         raise HTTPException(status_code=404, detail="Flashcard not found")
-    
+    remember_permission(db, user_id, flashcard.folder_id, access.permission)
+
     # If user owns the flashcard, return it
     if flashcard.user_id == user_id:
         return flashcard
-    
+
     # Otherwise, check folder permissions
-    try:
-        verify_folder_access(db, flashcard.folder_id, user_id, permission_types)
-        return flashcard
-    except HTTPException:
-        raise HTTPException(status_code=403, detail="Not authorized to access this flashcard") 
\ No newline at end of file
+    if not access.allows(permission_types):
+        raise HTTPException(status_code=403, detail="Not authorized to access this flashcard")
+    return flashcard
@@ -0,0 +1,37 @@
+import asyncio
+import weakref
+from app.utils import metrics
+
+class SingleFlight:
+  """Collapse concurrent calls that share a key into one execution.
+
+  The first caller for a key starts the work as a task; callers arriving while it
+  is still running await the same task and receive its result or exception.
+  The key is released as soon as the task finishes, so later calls run again.
+  """
+
+  def __init__(self, name: str):
+    self.name = name
+    # tasks belong to an event loop, so in-flight calls are tracked per loop
+    self._calls = weakref.WeakKeyDictionary()
+
+  async def do(self, key: str, fn):
+    loop = asyncio.get_running_loop()
+    calls = self._calls.setdefault(loop, {})
+    task = calls.get(key)
+    if task is None:
+      task = loop.create_task(fn())
+      calls[key] = task
+      task.add_done_callback(lambda _: calls.pop(key, None))
+      metrics.incr(f"{self.name}.calls")
+    else:
+      metrics.incr(f"{self.name}.coalesced")
+
+    # shield so one caller going away (e.g. a closed request) doesn't cancel the call for the others
+    return await asyncio.shield(task)
+
+  def in_flight(self) -> int:
+    try:
+      return len(self._calls.get(asyncio.get_running_loop(), {}))
+    except RuntimeError:
+      return 0
@@ -0,0 +1,89 @@
+"""Per-request authentication overhead with and without the token and principal caches.
+
+Two measurements:
+
+* decode: verifying the same bearer token with jwt.decode versus decode_token
+* request: sequential GET /me requests, which only authenticate and serialise the user
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_auth --iterations 20000 --requests 2000
+"""
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+
+import httpx
+import jwt
+
+from app import models
+from app.auth import (
+    ALGORITHM, SECRET_KEY, _token_digest, create_access_token, decode_token, principal_cache, token_cache,
+)
+from app.database import Base, SessionLocal, async_engine, engine
+from app.main import app
+
+
+def seed() -> str:
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        user = models.User(name="Bench", email=f"bench-{time.time_ns()}@example.com", hashed_password="-")
+        db.add(user)
+        db.commit()
+        return create_access_token({"user_id": str(user.id)}, expires_delta=timedelta(hours=1))
+
+
+def set_caching(enabled: bool):
+    for cache, ttl in ((token_cache, 3600), (principal_cache, 30)):
+        cache.ttl = ttl if enabled else 0
+        cache.clear()
+
+
+def bench_decode(token: str, iterations: int):
+    digest = _token_digest(token)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    uncached = (time.perf_counter() - start) / iterations
+
+    set_caching(True)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decode_token(token, digest)
+    cached = (time.perf_counter() - start) / iterations
+    return uncached, cached
+
+
+async def bench_requests(token: str, total: int) -> float:
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        (await client.get("/me", headers=headers)).raise_for_status()  # warm up
+        start = time.perf_counter()
+        for _ in range(total):
+            (await client.get("/me", headers=headers)).raise_for_status()
+        elapsed = (time.perf_counter() - start) / total
+    await async_engine.dispose()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    token = seed()
+    uncached, cached = bench_decode(token, args.iterations)
+    print(f" decode: {uncached * 1e6:8.2f} us uncached, {cached * 1e6:8.2f} us cached")
+
+    results = {}
+    for enabled in (False, True):
+        set_caching(enabled)
+        results[enabled] = asyncio.run(bench_requests(token, args.requests))
+    print(f"request: {results[False] * 1e3:8.3f} ms uncached, {results[True] * 1e3:8.3f} ms cached  ({args.requests} GET /me)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Compare requests per second for the sync (get_db) and async (get_async_db) stacks.
+
+Both endpoints run the same workload: load a user's folders and the flashcards of
+the first one. The sync endpoint is a plain `def` route, so every request waits for
+one of AnyIO's 40 worker threads; the async endpoint awaits the driver on the loop.
+
+Point DATABASE_URL at Postgres for meaningful numbers: aiosqlite runs every SQLite
+connection on its own thread, so on SQLite both stacks end up thread-bound.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_db_stacks --requests 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import Base, SessionLocal, async_engine, engine, get_async_db, get_db
+
+bench_app = FastAPI()
+
+
+@bench_app.get("/sync/{user_id}")
+def sync_workload(user_id: int, db: Session = Depends(get_db)):
+    folders = db.query(models.StudyFolder).filter(models.StudyFolder.user_id == user_id).all()
+    cards = db.query(models.Flashcard).filter(models.Flashcard.folder_id == folders[0].id).all()
+    return {"folders": len(folders), "flashcards": len(cards)}
+
+
+@bench_app.get("/async/{user_id}")
+async def async_workload(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    folders = (await db.execute(select(models.StudyFolder).where(models.StudyFolder.user_id == user_id))).scalars().all()
+    cards = (await db.execute(select(models.Flashcard).where(models.Flashcard.folder_id == folders[0].id))).scalars().all()
+    return {"folders": len(folders), "flashcards": len(cards)}
+
+
+def seed() -> int:
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        user = models.User(name="Bench", email=f"bench-{time.time_ns()}@example.com", hashed_password="-")
+        db.add(user)
+        db.flush()
+        folders = [models.StudyFolder(name=f"Folder {i}", user_id=user.id) for i in range(10)]
+        db.add_all(folders)
+        db.flush()
+        db.add_all(
+            models.Flashcard(question=f"Q{i}", answer=f"A{i}", user_id=user.id, folder_id=folders[0].id)
+            for i in range(50)
+        )
+        db.commit()
+        return user.id
+
+
+async def run(path: str, total: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=bench_app)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def one():
+            async with semaphore:
+                response = await client.get(path)
+                response.raise_for_status()
+
+        await client.get(path)  # warm up the pool
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(total)])
+        rate = total / (time.perf_counter() - start)
+
+    # pooled async connections belong to this event loop
+    await async_engine.dispose()
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    user_id = seed()
+    for name in ("sync", "async"):
+        rate = asyncio.run(run(f"/{name}/{user_id}", args.requests, args.concurrency))
+        print(f"{name:>5}: {rate:8.1f} req/s  ({args.requests} requests, concurrency {args.concurrency})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Pick a free name for one more notes.pdf in a folder already holding thousands of them.
+
+Compares the old per-candidate loop, which asks the database about "notes (1).pdf",
+"notes (2).pdf", ... one query at a time, with unique_filenames, which fetches every
+clashing name in one query and numbers in memory. Both pick the same name.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_filenames --files 5000 --iterations 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from sqlalchemy import event, insert, select
+
+from app import models
+from app.database import AsyncSessionLocal, Base, SessionLocal, async_engine, engine
+from app.services import acl  # keeps folder_acl in sync for the seeded folder
+from app.services.uploads import unique_filenames
+
+
+async def loop_unique_filename(db, folder_id: int, filename: str) -> str:
+    """The per-candidate loop unique_filenames replaced."""
+    base_name, extension = os.path.splitext(filename)
+    candidate = filename
+    duplicate_count = 1
+    while (await db.execute(select(models.File.id).filter_by(folder_id=folder_id, filename=candidate))).first():
+        candidate = f"{base_name} ({duplicate_count}){extension}"
+        duplicate_count += 1
+    return candidate
+
+
+async def set_based(db, folder_id: int, filename: str) -> str:
+    return (await unique_filenames(db, folder_id, [filename]))[0]
+
+
+def seed(files: int) -> int:
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        user = models.User(name="Bench", email=f"bench-{time.time_ns()}@example.com", hashed_password="-")
+        db.add(user)
+        db.flush()
+        folder = models.StudyFolder(name="Notes", user_id=user.id)
+        db.add(folder)
+        db.flush()
+        names = ["notes.pdf"] + [f"notes ({n}).pdf" for n in range(1, files)]
+        db.execute(insert(models.File), [
+            {"filename": name, "s3_key": f"bench/{folder.id}/{name}", "user_id": user.id, "folder_id": folder.id} for name in names
+        ])
+        db.commit()
+        return folder.id
+
+
+async def measure(pick, folder_id: int, iterations: int):
+    statements = 0
+
+    def count(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    latencies = []
+    try:
+        for _ in range(iterations):
+            async with AsyncSessionLocal() as db:
+                start = time.perf_counter()
+                name = await pick(db, folder_id, "notes.pdf")
+                latencies.append(time.perf_counter() - start)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+    await async_engine.dispose()
+    return name, statements / iterations, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    folder_id = seed(args.files)
+    for label, pick in (("loop", loop_unique_filename), ("set", set_based)):
+        name, round_trips, latencies = asyncio.run(measure(pick, folder_id, args.iterations))
+        print(f"{label:>4}: {name}  {round_trips:7.1f} round trips  median {statistics.median(latencies) * 1e3:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
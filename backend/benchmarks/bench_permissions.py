@@ -0,0 +1,92 @@
+"""Resolve access for a user with thousands of shared folders: per-folder checks versus one batch query.
+
+Three measurements for a user holding --shares accepted shares:
+
+* per-folder: resolve_folder_access once per folder, as a list endpoint would without the batch API
+* batch: resolve_folder_permissions for the same folder ids
+* listing: the first page of GET /folders?include_shared=true and GET /flashcards, which read folder_acl directly
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_permissions --shares 5000
+"""
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+
+import httpx
+from sqlalchemy import insert
+
+from app import models
+from app.auth import create_access_token
+from app.database import AsyncSessionLocal, Base, SessionLocal, async_engine, engine
+from app.main import app
+from app.services.acl import rebuild_folder_acl
+from app.utils.permissions import resolve_folder_access, resolve_folder_permissions
+
+
+def seed(shares: int):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        owner = models.User(name="Owner", email=f"owner-{time.time_ns()}@example.com", hashed_password="-")
+        member = models.User(name="Member", email=f"member-{time.time_ns()}@example.com", hashed_password="-")
+        db.add_all([owner, member])
+        db.flush()
+        folder_ids = db.scalars(
+            insert(models.StudyFolder).returning(models.StudyFolder.id),
+            [{"name": f"Folder {i}", "user_id": owner.id} for i in range(shares)],
+        ).all()
+        db.execute(insert(models.FolderShare), [
+            {"folder_id": folder_id, "user_id": member.id, "permission_type": ("read", "edit", "admin")[i % 3], "invitation_accepted": True}
+            for i, folder_id in enumerate(folder_ids)
+        ])
+        db.execute(insert(models.Flashcard), [
+            {"question": "Q", "answer": "A", "folder_id": folder_id, "user_id": owner.id} for folder_id in folder_ids
+        ])
+        db.commit()
+        # bulk inserts skip the ORM flush that maintains folder_acl
+        rebuild_folder_acl(db)
+        return member.id, folder_ids
+
+
+async def timed(fn) -> float:
+    start = time.perf_counter()
+    await fn()
+    return time.perf_counter() - start
+
+
+async def run(user_id: int, folder_ids: list):
+    async with AsyncSessionLocal() as db:
+        async def per_folder():
+            for folder_id in folder_ids:
+                await resolve_folder_access(db, folder_id, user_id)
+        per_folder_seconds = await timed(per_folder)
+        batch_seconds = await timed(lambda: resolve_folder_permissions(db, user_id, folder_ids))
+
+    headers = {"Authorization": f"Bearer {create_access_token({'user_id': str(user_id)}, expires_delta=timedelta(minutes=5))}"}
+    listings = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120) as client:
+        for path in ("/folders?include_shared=true", "/flashcards"):
+            await client.get(path, headers=headers)  # warm up
+            listings[path] = await timed(lambda: client.get(path, headers=headers))
+
+    await async_engine.dispose()
+    return per_folder_seconds, batch_seconds, listings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shares", type=int, default=5000)
+    args = parser.parse_args()
+
+    user_id, folder_ids = seed(args.shares)
+    per_folder, batch, listings = asyncio.run(run(user_id, folder_ids))
+    print(f"per-folder: {per_folder * 1e3:9.1f} ms  ({len(folder_ids)} queries)")
+    print(f"     batch: {batch * 1e3:9.1f} ms  (1 query)")
+    for path, seconds in listings.items():
+        print(f"GET {path:<11} {seconds * 1e3:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Read a shared folder's flashcards: route permission checks versus Postgres row-level security.
+
+For a user holding an accepted share, each iteration runs in a fresh transaction:
+
+* checks: verify_folder_access (permission cache cleared) then the flashcard query, as the routes do
+* rls: the same flashcard query alone, filtered by the policies with DB_ROW_LEVEL_SECURITY on
+
+Needs Postgres with the e7f3a9c1d5b2 migration applied. Superusers bypass row-level
+security, so pass --role to run as an ordinary role (it is granted SELECT here).
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_rls --iterations 2000 --role filenest_app
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import event, select, text
+
+from app import database, models
+from app.database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from app.services.acl import rebuild_folder_acl
+from app.utils.permissions import permission_cache, verify_folder_access
+
+
+def seed(cards: int):
+    with SessionLocal() as db:
+        owner = models.User(name="Owner", email=f"owner-{time.time_ns()}@example.com", hashed_password="-")
+        member = models.User(name="Member", email=f"member-{time.time_ns()}@example.com", hashed_password="-")
+        db.add_all([owner, member])
+        db.flush()
+        folder = models.StudyFolder(name="Shared", user_id=owner.id)
+        db.add(folder)
+        db.flush()
+        db.add(models.FolderShare(folder_id=folder.id, user_id=member.id, permission_type="read", invitation_accepted=True))
+        db.add_all(models.Flashcard(question=f"Q{i}", answer=f"A{i}", user_id=owner.id, folder_id=folder.id) for i in range(cards))
+        db.commit()
+        rebuild_folder_acl(db)
+        return member.id, folder.id
+
+
+def flashcards(folder_id: int):
+    return select(models.Flashcard).where(models.Flashcard.folder_id == folder_id)
+
+
+async def with_checks(db, user_id: int, folder_id: int):
+    permission_cache.clear()
+    await verify_folder_access(db, folder_id, user_id)
+    return (await db.execute(flashcards(folder_id))).scalars().all()
+
+
+async def with_rls(db, user_id: int, folder_id: int):
+    return (await db.execute(flashcards(folder_id))).scalars().all()
+
+
+async def measure(workload, user_id: int, folder_id: int, iterations: int):
+    statements = 0
+
+    def count(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    latencies = []
+    try:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            async with AsyncSessionLocal(info={"user_id": user_id}) as db:
+                cards = await workload(db, user_id, folder_id)
+            latencies.append(time.perf_counter() - start)
+            assert cards, "no flashcards visible"
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+    await async_engine.dispose()
+    return statements / iterations, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--cards", type=int, default=50)
+    parser.add_argument("--role", help="non-superuser role to run the queries as")
+    args = parser.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("row-level security needs DATABASE_URL to point at Postgres")
+    with engine.begin() as connection:
+        if not connection.execute(text("SELECT 1 FROM pg_policies WHERE policyname = 'flashcards_access'")).first():
+            raise SystemExit("run `alembic upgrade head` first")
+        if args.role:
+            connection.execute(text(f"GRANT SELECT ON ALL TABLES IN SCHEMA public TO {args.role}"))
+    if args.role:
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def _set_role(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET ROLE {args.role}")
+            cursor.close()
+
+    user_id, folder_id = seed(args.cards)
+    for name, workload, rls in (("checks", with_checks, False), ("rls", with_rls, True)):
+        database.DB_ROW_LEVEL_SECURITY = rls
+        round_trips, latencies = asyncio.run(measure(workload, user_id, folder_id, args.iterations))
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"{name:>6}: {round_trips:4.1f} round trips  p50 {quantiles[49] * 1e3:6.2f} ms  p99 {quantiles[98] * 1e3:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Upload a multi-file drop to S3: the old serial, loop-blocking loop versus the concurrent pipeline.
+
+Both runs upload --files files of --size-mb each while a probe task measures how long
+the event loop goes without running it:
+
+* serial: upload_fileobj called on the event loop, one file after the other
+* pipeline: app.services.s3.upload_file for every file at once, capped at S3_UPLOAD_CONCURRENCY
+
+Without --endpoint a moto server is started in a subprocess as the S3 stand-in;
+pass a MinIO (or real S3) endpoint to measure against that instead.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_uploads --files 20 --size-mb 4
+"""
+import argparse
+import asyncio
+import io
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from uuid import uuid4
+
+from app.services import s3 as s3_service
+
+BUCKET = "filenest-bench"
+
+
+def start_moto():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    endpoint = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(endpoint)
+            break
+        except OSError:
+            time.sleep(0.1)
+    return process, endpoint
+
+
+async def measure(upload, count: int, size: int):
+    """Run `upload(files)` and return (seconds, worst event loop stall)"""
+    worst_lag = 0.0
+    done = asyncio.Event()
+
+    async def probe():
+        nonlocal worst_lag
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            worst_lag = max(worst_lag, time.perf_counter() - start - 0.01)
+
+    files = [io.BytesIO(os.urandom(size)) for _ in range(count)]
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await upload(files)
+    elapsed = time.perf_counter() - start
+    done.set()
+    await probe_task
+    return elapsed, worst_lag
+
+
+async def serial(files):
+    for file in files:
+        s3_service.s3.upload_fileobj(Fileobj=file, Bucket=BUCKET, Key=f"bench/{uuid4().hex}")
+
+
+async def pipeline(files):
+    await asyncio.gather(*[s3_service.upload_file(file, f"bench/{uuid4().hex}") for file in files])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--size-mb", type=float, default=4)
+    parser.add_argument("--endpoint", help="S3-compatible endpoint; starts a moto server when omitted")
+    args = parser.parse_args()
+
+    process = None
+    if args.endpoint is None:
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        process, args.endpoint = start_moto()
+    try:
+        s3_service.s3 = s3_service.create_client(endpoint_url=args.endpoint)
+        s3_service.S3_BUCKET = BUCKET
+        s3_service.s3.create_bucket(Bucket=BUCKET)
+
+        size = int(args.size_mb * s3_service.MB)
+        for name, upload in (("serial", serial), ("pipeline", pipeline)):
+            elapsed, lag = asyncio.run(measure(upload, args.files, size))
+            print(f"{name:>8}: {elapsed:6.2f} s  worst loop stall {lag * 1e3:7.1f} ms  ({args.files} x {args.size_mb} MB)")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
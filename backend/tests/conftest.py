@@ -0,0 +1,224 @@
+import json
+import random
+import string
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+def random_email():
+    """Generate a random email for testing"""
+    letters = string.ascii_lowercase
+    username = ''.join(random.choice(letters) for i in range(8))
+    return f"{username}@example.com"
+
+
+def auth_headers(user_id, minutes=5):
+    """Authorization header with a fresh access token for the user"""
+    from app.auth import create_access_token
+    token = create_access_token({"user_id": str(user_id)}, expires_delta=timedelta(minutes=minutes))
+    return {"Authorization": f"Bearer {token}"}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class FakeLLMServer:
+    """Minimal OpenAI-compatible chat completions server that counts upstream calls"""
+
+    def __init__(self):
+        self.delay = 0.0
+        self.content = "Hello from the fake LLM"
+        self.calls = 0
+        self.chunk_size = 4 # characters per streamed chunk
+        self.chunk_delay = 0.0 # seconds between streamed chunks
+        self.finish_reason = "stop" # sent with the answer (the last chunk when streaming), "length" mimics a cut-off answer
+        self.streams_completed = 0
+        self.streams_aborted = 0
+        self.in_flight = 0
+        self.max_in_flight = 0 # most calls being answered at the same time
+        self.hold_until = 0 # calls wait (up to 5s) until this many are in flight at once, then the hold is lifted
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with server._arrived:
+                    server.calls += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    if server.in_flight >= server.hold_until:
+                        server.hold_until = 0
+                    server._arrived.notify_all()
+                    server._arrived.wait_for(lambda: server.in_flight >= server.hold_until, timeout=5)
+                try:
+                    self._answer(body)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _answer(self, body):
+                time.sleep(server.delay)
+                if body.get("stream"):
+                    return self._stream(body)
+                payload = json.dumps({
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": server.content},
+                        "finish_reason": server.finish_reason,
+                    }],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, body):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                content = server.content
+                try:
+                    for start in range(0, len(content), server.chunk_size):
+                        chunk = {
+                            "id": "chatcmpl-fake",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": body.get("model", "fake"),
+                            "choices": [{
+                                "index": 0,
+                                "delta": {"content": content[start:start + server.chunk_size]},
+                                "finish_reason": None,
+                            }],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                        time.sleep(server.chunk_delay)
+                    final = {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "fake"),
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": server.finish_reason}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(final)}\n\n".encode())
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    with server._lock:
+                        server.streams_aborted += 1
+                    return
+                with server._lock:
+                    server.streams_completed += 1
+                self.close_connection = True
+
+        self.httpd = _Server(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Point the LLM clients at a local fake server for the duration of a test"""
+    server = FakeLLMServer()
+    server.start()
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    from app.utils import gpt, llm_cache
+    gpt._async_clients.clear()
+    # cached answers from earlier tests would hide upstream calls
+    llm_cache.clear()
+    yield server
+    gpt._async_clients.clear()
+    server.stop()
+
+
+@pytest.fixture
+def live_server():
+    """Serve the app with uvicorn on a local port, for tests that need real streaming"""
+    import socket
+    import uvicorn
+    from app.main import app
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture(scope="session")
+def s3_endpoint():
+    """A moto S3 server on a local port, standing in for S3"""
+    import socket
+    moto_server = pytest.importorskip("moto.server")
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def bucket(s3_endpoint, monkeypatch):
+    """Point app.services.s3 at a fresh bucket on the moto server; yields the client"""
+    from sqlalchemy import delete
+    from app import models
+    from app.database import SessionLocal
+    from app.services import s3
+
+    # blobs recorded by earlier tests, and the files sharing them, point at objects the fresh bucket doesn't have
+    with SessionLocal() as db:
+        db.execute(delete(models.File).where(models.File.blob_sha256.is_not(None)))
+        db.execute(delete(models.Blob))
+        db.commit()
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    client = s3.create_client(endpoint_url=s3_endpoint)
+    client.create_bucket(Bucket="filenest-test")
+    monkeypatch.setattr(s3, "s3", client)
+    monkeypatch.setattr(s3, "S3_BUCKET", "filenest-test")
+    monkeypatch.setattr(s3, "S3_ENDPOINT_URL", s3_endpoint)
+    yield client
+    for upload in client.list_multipart_uploads(Bucket="filenest-test").get("Uploads", []):
+        client.abort_multipart_upload(Bucket="filenest-test", Key=upload["Key"], UploadId=upload["UploadId"])
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket="filenest-test"):
+        for item in page.get("Contents", []):
+            client.delete_object(Bucket="filenest-test", Key=item["Key"])
+    client.delete_bucket(Bucket="filenest-test")
@@ -0,0 +1,92 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, insert
+from app.main import app
+from app.database import get_db
+from app.services.acl import rebuild_folder_acl
+from app import models
+from conftest import random_email, auth_headers
+
+
+@pytest.fixture
+def db():
+    db = next(get_db())
+    yield db
+    db.close()
+
+def _acl_rows(db, folder_id):
+    rows = db.query(models.FolderACL).filter(models.FolderACL.folder_id == folder_id)
+    return {row.user_id: row.permission_rank for row in rows}
+
+def _acl(db, folder_id):
+    db.expire_all()
+    return _acl_rows(db, folder_id)
+
+def test_routes_keep_acl_in_sync(db):
+    """Test folder and share mutations maintain folder_acl in the same transaction"""
+    owner = models.User(email=random_email(), name="Owner", hashed_password="not-used")
+    member = models.User(email=random_email(), name="Member", hashed_password="not-used")
+    db.add_all([owner, member])
+    db.commit()
+
+    with TestClient(app) as client:
+        folder_id = client.post("/folders", json={"name": "ACL"}, headers=auth_headers(owner.id)).json()["id"]
+        assert _acl(db, folder_id) == {owner.id: 4}
+
+        share = client.post(f"/folders/{folder_id}/share", json={"folder_id": folder_id, "user_email": member.email, "permission_type": "edit"}, headers=auth_headers(owner.id)).json()
+        # a pending invitation grants nothing yet
+        assert _acl(db, folder_id) == {owner.id: 4}
+
+        client.post(f"/shares/{share['id']}/accept", headers=auth_headers(member.id))
+        assert _acl(db, folder_id) == {owner.id: 4, member.id: 2}
+
+        client.put(f"/shares/{share['id']}", json={"permission_type": "read"}, headers=auth_headers(owner.id))
+        assert _acl(db, folder_id) == {owner.id: 4, member.id: 1}
+
+        client.delete(f"/shares/{share['id']}", headers=auth_headers(owner.id))
+        assert _acl(db, folder_id) == {owner.id: 4}
+
+        client.delete(f"/folders/{folder_id}", headers=auth_headers(owner.id))
+        assert _acl(db, folder_id) == {}
+
+def _users(db, count):
+    users = [models.User(email=random_email(), name=f"User {i}", hashed_password="not-used") for i in range(count)]
+    db.add_all(users)
+    db.commit()
+    return [user.id for user in users]
+
+def test_rolled_back_share_leaves_acl_untouched(db):
+    """Test that ACL rows written during a flush roll back with it"""
+    owner, member = _users(db, 2)
+    folder = models.StudyFolder(name="Rollback", user_id=owner)
+    db.add(folder)
+    db.commit()
+
+    db.add(models.FolderShare(folder_id=folder.id, user_id=member, permission_type="admin", invitation_accepted=True))
+    db.flush()
+    assert _acl_rows(db, folder.id) == {owner: 4, member: 3}
+    db.rollback()
+
+    assert _acl(db, folder.id) == {owner: 4}
+
+def test_rebuild_repairs_drift(db):
+    """Test the rebuild command restores missing, stray and wrong rows"""
+    owner, member, stranger = _users(db, 3)
+    folder = models.StudyFolder(name="Drift", user_id=owner)
+    db.add(folder)
+    db.commit()
+    db.add(models.FolderShare(folder_id=folder.id, user_id=member, permission_type="edit", invitation_accepted=True))
+    db.commit()
+
+    # drift: the owner row vanishes, the share row is wrong and a stranger gets a row
+    db.execute(delete(models.FolderACL).where(models.FolderACL.folder_id == folder.id, models.FolderACL.user_id == owner))
+    db.query(models.FolderACL).filter(models.FolderACL.folder_id == folder.id).update({"permission_rank": 3})
+    db.execute(insert(models.FolderACL.__table__).values(user_id=stranger, folder_id=folder.id, permission_rank=1))
+    db.commit()
+
+    assert rebuild_folder_acl(db, dry_run=True) == (1, 1, 1)
+    assert _acl(db, folder.id) == {member: 3, stranger: 1}
+
+    assert rebuild_folder_acl(db) == (1, 1, 1)
+    assert _acl(db, folder.id) == {owner: 4, member: 2}
+    assert rebuild_folder_acl(db, dry_run=True) == (0, 0, 0)
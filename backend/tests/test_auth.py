@@ -0,0 +1,213 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from app.main import app
+from app.database import get_db, async_engine
+from app import auth
+from app.auth import create_access_token
+from app.utils import invalidation, metrics
+from app.utils.cache import TTLCache
+from app.utils.invalidation import PostgresChannel
+from app import models
+from conftest import random_email, auth_headers
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def db():
+    db = next(get_db())
+    yield db
+    db.close()
+
+@pytest.fixture
+def test_user(db):
+    user = models.User(email=random_email(), name="Cached User", hashed_password="not-used")
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+@pytest.fixture
+def user_queries():
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "FROM users" in statement:
+            statements.append(statement)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+def test_repeat_requests_skip_the_users_query(client, test_user, user_queries):
+    """Test that the same token only loads the user once"""
+    headers = auth_headers(test_user.id)
+    hits = metrics.get_counter("auth.principal_cache.hits")
+
+    for _ in range(5):
+        response = client.get("/me", headers=headers)
+        assert response.json() == {"id": test_user.id, "name": "Cached User", "email": test_user.email}
+
+    assert len(user_queries) == 1
+    assert metrics.get_counter("auth.principal_cache.hits") == hits + 4
+
+def test_another_token_is_looked_up_again(client, test_user, user_queries):
+    """Test that cache entries are tied to the token, not just the user"""
+    client.get("/me", headers=auth_headers(test_user.id, minutes=5))
+    client.get("/me", headers=auth_headers(test_user.id, minutes=6))
+
+    assert len(user_queries) == 2
+
+def test_user_update_invalidates_cached_principal(client, test_user, db):
+    """Test that changing the user row is visible on the next request"""
+    headers = auth_headers(test_user.id)
+    assert client.get("/me", headers=headers).json()["name"] == "Cached User"
+
+    test_user.name = "Renamed User"
+    db.commit()
+
+    assert client.get("/me", headers=headers).json()["name"] == "Renamed User"
+
+def test_token_is_verified_once(client, test_user, monkeypatch):
+    """Test that repeat requests reuse the decoded claims"""
+    calls = []
+    decode = auth.jwt.decode
+    monkeypatch.setattr(auth.jwt, "decode", lambda *args, **kwargs: calls.append(1) or decode(*args, **kwargs))
+    headers = auth_headers(test_user.id)
+
+    for _ in range(3):
+        assert client.get("/me", headers=headers).status_code == 200
+
+    assert len(calls) == 1
+
+def test_cached_claims_expire_with_the_token(client, test_user):
+    """Test that a cached token stops working at its exp"""
+    token = create_access_token({"user_id": str(test_user.id)}, expires_delta=timedelta(seconds=1))
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/me", headers=headers).status_code == 200
+
+    time.sleep(1.1)
+    assert client.get("/me", headers=headers).status_code == 401
+
+def test_revoked_token_is_rejected(client, test_user):
+    """Test that logging out purges a cached token and rejects later requests"""
+    headers = auth_headers(test_user.id)
+    assert client.get("/me", headers=headers).status_code == 200
+
+    assert client.post("/logout", headers=headers).status_code == 204
+
+    assert client.get("/me", headers=headers).status_code == 401
+    assert client.get("/me", headers=auth_headers(test_user.id, minutes=7)).status_code == 200
+
+def test_revocation_outlives_the_worker(client, test_user, monkeypatch):
+    """Test that a worker starting after a logout still rejects the token"""
+    headers = auth_headers(test_user.id)
+    assert client.post("/logout", headers=headers).status_code == 204
+
+    # a fresh worker knows nothing but the revoked_tokens table
+    monkeypatch.setattr(auth, "revoked_tokens", {})
+    auth.token_cache.clear()
+    assert client.get("/me", headers=headers).status_code == 200
+    client.portal.call(auth.load_revoked_tokens)
+    assert client.get("/me", headers=headers).status_code == 401
+
+def test_revocations_are_not_evicted(client, test_user, monkeypatch):
+    """Test that no number of other revocations pushes a token out before it expires"""
+    monkeypatch.setattr(auth, "revoked_tokens", {f"{n:064x}": time.time() + 60 for n in range(200000)})
+    headers = auth_headers(test_user.id)
+    assert client.post("/logout", headers=headers).status_code == 204
+    for n in range(3):
+        auth.handle_revocation({"digest": f"other-{n}", "expires_at": time.time() + 60})
+    assert client.get("/me", headers=headers).status_code == 401
+
+def _revoke_elsewhere(db, headers):
+    """Record a revocation the way another worker would, without notifying this one"""
+    token = headers["Authorization"].split()[1]
+    db.add(models.RevokedToken(digest=auth._token_digest(token), expires_at=datetime.now(timezone.utc) + timedelta(minutes=5)))
+    db.commit()
+
+def _rejected_within(client, headers, seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if client.get("/me", headers=headers).status_code == 401:
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_revocations_are_reloaded_periodically(test_user, db, monkeypatch):
+    """Test that a revocation whose notification never arrived is picked up by the periodic reload"""
+    monkeypatch.setattr(auth, "REVOKED_TOKENS_SYNC_INTERVAL", 0.05)
+    headers = auth_headers(test_user.id)
+    with TestClient(app) as client:
+        assert client.get("/me", headers=headers).status_code == 200
+        _revoke_elsewhere(db, headers)
+        assert _rejected_within(client, headers, 2)
+
+def test_listener_reconnects_and_reloads_revocations(test_user, db, monkeypatch):
+    """Test that a dropped listening connection is reopened and the revocations missed meanwhile are loaded"""
+    if not isinstance(auth.revocation_channel, PostgresChannel):
+        pytest.skip("needs the Postgres channel")
+    monkeypatch.setattr(invalidation, "INVALIDATION_RECONNECT_INTERVAL", 0.05)
+    headers = auth_headers(test_user.id)
+    with TestClient(app) as client:
+        assert client.get("/me", headers=headers).status_code == 200
+        listener = auth.revocation_channel._connection
+        db.execute(text("SELECT pg_terminate_backend(:pid)"), {"pid": listener.get_server_pid()})
+        _revoke_elsewhere(db, headers)
+        assert _rejected_within(client, headers, 2)
+        assert auth.revocation_channel._connection is not listener
+
+def test_password_change_rejects_every_earlier_token(client, db):
+    """Test that changing the password rejects all tokens issued before it and hands out a working one"""
+    user = models.User(email=random_email(), name="Changing", hashed_password=models.User.get_password_hash("old-password"))
+    db.add(user)
+    db.commit()
+    headers = auth_headers(user.id)
+    other_session = {"Authorization": f"Bearer {client.post('/login', json={'email': user.email, 'password': 'old-password'}).json()['access_token']}"}
+    assert client.get("/me", headers=other_session).status_code == 200
+
+    change = {"current_password": "wrong-password", "new_password": "new-password"}
+    assert client.put("/me/password", json=change, headers=headers).status_code == 400
+
+    change["current_password"] = "old-password"
+    response = client.put("/me/password", json=change, headers=headers)
+    assert response.status_code == 200
+    assert client.get("/me", headers=headers).status_code == 401
+    assert client.get("/me", headers=other_session).status_code == 401
+    new_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert client.get("/me", headers=new_headers).status_code == 200
+    login = client.post("/login", json={"email": user.email, "password": "new-password"})
+    assert login.status_code == 200
+    assert client.get("/me", headers={"Authorization": f"Bearer {login.json()['access_token']}"}).status_code == 200
+
+def test_password_change_reaches_other_workers(client, test_user):
+    """Test that a worker still holding the user's principal drops it when told about a password change"""
+    headers = auth_headers(test_user.id)
+    digest = auth._token_digest(headers["Authorization"].split()[1])
+    assert client.get("/me", headers=headers).status_code == 200
+    assert auth._cached_principal(test_user.id, digest) is not None
+
+    auth.handle_revocation({"user_id": test_user.id})
+    assert auth._cached_principal(test_user.id, digest) is None
+
+def test_ttl_cache_expires_and_evicts():
+    """Test TTL expiry, explicit deadlines and LRU eviction"""
+    cache = TTLCache("test.ttl_cache", maxsize=2, ttl=0.2)
+    cache.set("a", 1)
+    cache.set("b", 2, expires_at=time.monotonic() - 1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+
+    cache.set("b", 2)
+    cache.get("a") # "a" is now the most recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    time.sleep(0.25)
+    assert cache.get("a") is None
@@ -0,0 +1,170 @@
+import hashlib
+import io
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+from app.main import app
+from app.database import AsyncSessionLocal, SessionLocal
+from app.auth import create_access_token
+from app.services import s3 as s3_service
+from app.services.blobs import blob_key, delete_released_objects, hash_file, release_blobs
+from app import models
+from conftest import random_email
+
+@pytest.fixture
+def folders():
+    with SessionLocal() as db:
+        user = models.User(email=random_email(), name="Student", hashed_password="not-used")
+        db.add(user)
+        db.commit()
+        folders = [models.StudyFolder(name=name, user_id=user.id) for name in ("Physics", "Chemistry")]
+        db.add_all(folders)
+        db.commit()
+        token = create_access_token({"user_id": str(user.id)}, expires_delta=timedelta(minutes=5))
+        return [folder.id for folder in folders], {"Authorization": f"Bearer {token}"}
+
+def _upload(client, headers, folder_id, files):
+    response = client.post(
+        "/upload",
+        files=[("file", (name, content, "application/pdf")) for name, content in files],
+        data={"folder_id": str(folder_id)},
+        headers=headers
+    )
+    assert response.status_code == 200
+    return response.json()
+
+def _objects(bucket):
+    return [item["Key"] for item in bucket.list_objects_v2(Bucket=s3_service.S3_BUCKET).get("Contents", [])]
+
+def _blob(digest):
+    with SessionLocal() as db:
+        return db.get(models.Blob, digest)
+
+def test_hash_file_streams_and_rewinds():
+    """Test that hashing reads the whole file in chunks and leaves it ready to upload"""
+    content = random.randbytes(3 * 1024 * 1024 + 17)
+    file_object = io.BytesIO(content)
+    assert hash_file(file_object) == (hashlib.sha256(content).hexdigest(), len(content))
+    assert file_object.tell() == 0
+
+def test_same_content_is_stored_once(bucket, folders):
+    """Test that one syllabus uploaded into several folders, and twice in one batch, is one S3 object"""
+    (physics, chemistry), headers = folders
+    syllabus = random.randbytes(4096)
+    digest = hashlib.sha256(syllabus).hexdigest()
+    with TestClient(app) as client:
+        _upload(client, headers, physics, [("syllabus.pdf", syllabus), ("copy.pdf", syllabus), ("notes.pdf", b"notes")])
+        uploaded = _upload(client, headers, chemistry, [("syllabus.pdf", syllabus)])
+
+    assert sorted(_objects(bucket)) == sorted([blob_key(digest), blob_key(hashlib.sha256(b"notes").hexdigest())])
+    assert _blob(digest).refcount == 3
+    with SessionLocal() as db:
+        record = db.get(models.File, uploaded[0]["file_id"])
+        assert (record.s3_key, record.blob_sha256, record.folder_id) == (blob_key(digest), digest, chemistry)
+    assert bucket.get_object(Bucket=s3_service.S3_BUCKET, Key=blob_key(digest))["Body"].read() == syllabus
+
+def test_last_delete_frees_the_object(bucket, folders):
+    """Test that deleting a file keeps shared content until its last file is gone"""
+    (physics, chemistry), headers = folders
+    syllabus = random.randbytes(4096)
+    digest = hashlib.sha256(syllabus).hexdigest()
+    with TestClient(app) as client:
+        first = _upload(client, headers, physics, [("syllabus.pdf", syllabus)])[0]
+        second = _upload(client, headers, chemistry, [("syllabus.pdf", syllabus)])[0]
+
+        assert client.delete(f"/files/{first['file_id']}", headers=headers).status_code == 200
+        assert _blob(digest).refcount == 1
+        assert _objects(bucket) == [blob_key(digest)]
+
+        assert client.delete(f"/files/{second['file_id']}", headers=headers).status_code == 200
+    assert _blob(digest) is None
+    assert _objects(bucket) == []
+
+def test_folder_delete_releases_its_files(bucket, folders):
+    """Test that deleting a folder drops its references and frees content only it used"""
+    (physics, chemistry), headers = folders
+    shared, own = random.randbytes(4096), random.randbytes(4096)
+    with TestClient(app) as client:
+        _upload(client, headers, physics, [("shared.pdf", shared), ("own.pdf", own), ("own again.pdf", own)])
+        _upload(client, headers, chemistry, [("shared.pdf", shared)])
+
+        assert client.delete(f"/folders/{physics}", headers=headers).status_code == 204
+
+    assert _blob(hashlib.sha256(shared).hexdigest()).refcount == 1
+    assert _blob(hashlib.sha256(own).hexdigest()) is None
+    assert _objects(bucket) == [blob_key(hashlib.sha256(shared).hexdigest())]
+
+def test_uncommitted_release_keeps_the_object(bucket, folders):
+    """Test that a release rolled back after the fact leaves the content where it was"""
+    (physics, _), headers = folders
+    syllabus = random.randbytes(4096)
+    digest = hashlib.sha256(syllabus).hexdigest()
+
+    async def release_and_roll_back(file_id):
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(models.File).where(models.File.id == file_id))
+            freed = await release_blobs(db, {digest: 1})
+            objects = _objects(bucket)
+            await db.rollback()
+            return freed, objects
+
+    with TestClient(app) as client:
+        uploaded = _upload(client, headers, physics, [("syllabus.pdf", syllabus)])[0]
+        freed, objects_before_commit = client.portal.call(release_and_roll_back, uploaded["file_id"])
+
+    assert freed == {digest}
+    assert objects_before_commit == [blob_key(digest)]
+    assert _blob(digest).refcount == 1
+    assert _objects(bucket) == [blob_key(digest)]
+
+def test_content_stored_again_keeps_its_object(bucket, folders):
+    """Test that an object freed by one delete survives when an upload stores the same content before it goes"""
+    (physics, chemistry), headers = folders
+    syllabus = random.randbytes(4096)
+    digest = hashlib.sha256(syllabus).hexdigest()
+
+    async def release(file_id):
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(models.File).where(models.File.id == file_id))
+            freed = await release_blobs(db, {digest: 1})
+            await db.commit()
+            return freed
+
+    async def delete_objects(freed):
+        async with AsyncSessionLocal() as db:
+            await delete_released_objects(db, freed)
+
+    with TestClient(app) as client:
+        uploaded = _upload(client, headers, physics, [("syllabus.pdf", syllabus)])[0]
+        freed = client.portal.call(release, uploaded["file_id"])
+        # the same syllabus is uploaded again before the object is deleted
+        _upload(client, headers, chemistry, [("syllabus.pdf", syllabus)])
+        client.portal.call(delete_objects, freed)
+
+    assert _blob(digest).refcount == 1
+    assert bucket.get_object(Bucket=s3_service.S3_BUCKET, Key=blob_key(digest))["Body"].read() == syllabus
+
+def test_concurrent_uploads_of_new_content_store_it_once(bucket, folders, live_server):
+    """Test that uploads racing to store the same new content all end up sharing one blob"""
+    (physics, chemistry), headers = folders
+    syllabus = random.randbytes(64 * 1024)
+    digest = hashlib.sha256(syllabus).hexdigest()
+
+    def upload(index):
+        response = httpx.post(
+            f"{live_server}/upload",
+            files=[("file", (f"syllabus {index}.pdf", syllabus, "application/pdf"))],
+            data={"folder_id": str((physics, chemistry)[index % 2])},
+            headers=headers, timeout=30
+        )
+        return response.status_code
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        assert list(pool.map(upload, range(6))) == [200] * 6
+    assert _blob(digest).refcount == 6
+    assert _objects(bucket) == [blob_key(digest)]
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from app.main import app
+from app.auth import get_current_user
+from app import models
+from app.utils import gpt
+
+
+@pytest.fixture
+def chat_user():
+    """Skip the token round trip; /chat only needs an authenticated principal"""
+    app.dependency_overrides[get_current_user] = lambda: models.User(id=1, name="Chat User", email="chat@example.com")
+    yield
+    app.dependency_overrides.pop(get_current_user, None)
+
+
+async def _run_chats(count):
+    """Fire `count` concurrent chats; returns the responses and how long they took"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as ac:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            ac.post("/chat", json={"message": f"question {i}"}) for i in range(count)
+        ])
+        elapsed = time.perf_counter() - start
+    return responses, elapsed
+
+
+def test_chat_returns_llm_response(fake_llm, chat_user):
+    """Test that /chat answers through the async client"""
+    responses, _ = asyncio.run(_run_chats(1))
+
+    assert responses[0].status_code == 200
+    assert responses[0].json() == {"response": fake_llm.content}
+    assert fake_llm.calls == 1
+
+
+def test_chat_load_keeps_event_loop_responsive(fake_llm, chat_user, monkeypatch):
+    """Load test: 100 chats in flight at once reach the upstream side by side rather than one at a time"""
+    monkeypatch.setattr(gpt, "LLM_MAX_CONCURRENCY", 50)
+    # the upstream holds its first calls until 50 are open at once, which a client
+    # blocking the event loop (one call at a time) could never get to
+    fake_llm.hold_until = 50
+
+    responses, _ = asyncio.run(_run_chats(100))
+
+    assert all(r.status_code == 200 for r in responses)
+    assert fake_llm.calls == 100
+    assert fake_llm.max_in_flight == 50
+
+
+def test_chat_concurrency_is_bounded(fake_llm, chat_user, monkeypatch):
+    """Test that upstream calls are capped at LLM_MAX_CONCURRENCY"""
+    fake_llm.delay = 0.1
+    fake_llm.hold_until = 5
+    monkeypatch.setattr(gpt, "LLM_MAX_CONCURRENCY", 5)
+
+    responses, _ = asyncio.run(_run_chats(20))
+
+    assert all(r.status_code == 200 for r in responses)
+    assert fake_llm.max_in_flight == 5
+
+
+def test_chat_upstream_timeout(fake_llm, chat_user, monkeypatch):
+    """Test that a slow upstream is cut off and reported as a gateway timeout"""
+    fake_llm.delay = 1.0
+    monkeypatch.setattr(gpt, "LLM_TIMEOUT", 0.2)
+    monkeypatch.setattr(gpt, "LLM_MAX_RETRIES", 0)
+
+    responses, elapsed = asyncio.run(_run_chats(1))
+
+    assert responses[0].status_code == 504
+    assert elapsed < 1.0
+
+
+def _read_events(response):
+    """Yield (event, data) pairs from a Server-Sent Events response"""
+    event = None
+    for line in response.iter_lines():
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[len("data: "):])
+            event = None
+
+
+def test_chat_stream_sends_first_token_early(fake_llm, chat_user, live_server):
+    """Test that tokens are forwarded as the model produces them"""
+    fake_llm.content = "Photosynthesis turns light into chemical energy."
+    fake_llm.chunk_delay = 0.1
+
+    start = time.perf_counter()
+    first_token_at = None
+    deltas = []
+    with httpx.stream("POST", f"{live_server}/chat/stream", json={"message": "photosynthesis?"}, timeout=10) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        for event, data in _read_events(response):
+            if event == "done":
+                break
+            if first_token_at is None:
+                first_token_at = time.perf_counter() - start
+            deltas.append(data["delta"])
+    total = time.perf_counter() - start
+
+    assert "".join(deltas) == fake_llm.content
+    # the whole answer takes over a second, the first token must not wait for it
+    assert total > 1.0
+    assert first_token_at < 0.3
+
+
+def test_chat_stream_disconnect_cancels_upstream(fake_llm, chat_user, live_server):
+    """Test that a client hanging up stops the upstream generation"""
+    fake_llm.content = "x" * 400
+    fake_llm.chunk_delay = 0.02
+
+    with httpx.stream("POST", f"{live_server}/chat/stream", json={"message": "long answer"}, timeout=10) as response:
+        next(_read_events(response))
+
+    deadline = time.monotonic() + 5
+    while fake_llm.streams_aborted == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert fake_llm.streams_aborted == 1
+    assert fake_llm.streams_completed == 0
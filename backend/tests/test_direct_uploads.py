@@ -0,0 +1,169 @@
+import hashlib
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database import SessionLocal
+from app.services import s3 as s3_service
+from app import models
+from conftest import random_email, auth_headers
+
+
+@pytest.fixture
+def uploader():
+    with SessionLocal() as db:
+        users = [models.User(email=random_email(), name=name, hashed_password="not-used") for name in ("Uploader", "Other")]
+        db.add_all(users)
+        db.commit()
+        folder = models.StudyFolder(name="Direct", user_id=users[0].id)
+        db.add(folder)
+        db.commit()
+        return users[0].id, users[1].id, folder.id
+
+def _post_form(initiated, content):
+    """Send the file to S3 the way a browser would with the presigned POST"""
+    response = httpx.post(initiated["url"], data=initiated["fields"], files={"file": ("upload", content)})
+    return response.status_code
+
+def test_presigned_post_upload_is_verified_and_recorded(bucket, uploader):
+    """Test the two-phase flow for a small file: presigned POST, then complete"""
+    user_id, _, folder_id = uploader
+    content = b"lecture notes"
+    with TestClient(app) as client:
+        initiated = client.post("/uploads/initiate", json={
+            "filename": "notes.txt", "size": len(content), "content_type": "text/plain",
+            "folder_id": folder_id, "md5": hashlib.md5(content).hexdigest()
+        }, headers=auth_headers(user_id)).json()
+        assert initiated["method"] == "post"
+        assert _post_form(initiated, content) in (200, 204)
+
+        completed = client.post("/uploads/complete", json={"upload_token": initiated["upload_token"]}, headers=auth_headers(user_id))
+        assert completed.status_code == 200
+        assert completed.json()["filename"] == "notes.txt"
+        # completing again doesn't record a second file
+        again = client.post("/uploads/complete", json={"upload_token": initiated["upload_token"]}, headers=auth_headers(user_id))
+        assert again.json()["file_id"] == completed.json()["file_id"]
+
+    with SessionLocal() as db:
+        record = db.get(models.File, completed.json()["file_id"])
+        assert db.query(models.File).filter(models.File.folder_id == folder_id).count() == 1
+    assert bucket.get_object(Bucket=s3_service.S3_BUCKET, Key=record.s3_key)["Body"].read() == content
+
+def test_concurrent_completions_record_one_file(bucket, uploader, live_server):
+    """Test that completions of one upload racing each other all answer with the same single file"""
+    user_id, _, folder_id = uploader
+    content = b"lecture notes"
+    initiated = httpx.post(f"{live_server}/uploads/initiate", json={
+        "filename": "notes.txt", "size": len(content), "folder_id": folder_id
+    }, headers=auth_headers(user_id)).json()
+    assert _post_form(initiated, content) in (200, 204)
+
+    def complete(_):
+        response = httpx.post(f"{live_server}/uploads/complete", json={"upload_token": initiated["upload_token"]}, headers=auth_headers(user_id), timeout=30)
+        return response.status_code, response.json().get("file_id")
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(complete, range(6)))
+    assert {status for status, _ in results} == {200}
+    assert len({file_id for _, file_id in results}) == 1
+    with SessionLocal() as db:
+        assert db.query(models.File).filter(models.File.folder_id == folder_id).count() == 1
+
+def test_size_mismatch_is_rejected_and_removed(bucket, uploader):
+    """Test that an object longer than the declared size is refused and deleted"""
+    user_id, _, folder_id = uploader
+    with TestClient(app) as client:
+        initiated = client.post("/uploads/initiate", json={"filename": "a.txt", "size": 5, "folder_id": folder_id}, headers=auth_headers(user_id)).json()
+        # S3 itself rejects this through the POST policy; the stand-in doesn't, so completion has to catch it
+        _post_form(initiated, b"much longer than five bytes")
+        assert client.post("/uploads/complete", json={"upload_token": initiated["upload_token"]}, headers=auth_headers(user_id)).status_code == 400
+    assert bucket.list_objects_v2(Bucket=s3_service.S3_BUCKET).get("KeyCount", 0) == 0
+
+def test_complete_without_upload_is_rejected(bucket, uploader):
+    """Test that completing before anything reached S3 records nothing"""
+    user_id, _, folder_id = uploader
+    with TestClient(app) as client:
+        initiated = client.post("/uploads/initiate", json={"filename": "a.txt", "size": 5, "folder_id": folder_id}, headers=auth_headers(user_id)).json()
+        assert client.post("/uploads/complete", json={"upload_token": initiated["upload_token"]}, headers=auth_headers(user_id)).status_code == 400
+    with SessionLocal() as db:
+        assert db.query(models.File).filter(models.File.folder_id == folder_id).count() == 0
+
+def test_checksum_mismatch_is_rejected_and_removed(bucket, uploader):
+    """Test that an object whose MD5 differs from the declared one is refused and deleted"""
+    user_id, _, folder_id = uploader
+    content = b"tampered"
+    with TestClient(app) as client:
+        initiated = client.post("/uploads/initiate", json={
+            "filename": "a.txt", "size": len(content), "folder_id": folder_id, "md5": hashlib.md5(b"original").hexdigest()
+        }, headers=auth_headers(user_id)).json()
+        _post_form(initiated, content)
+        assert client.post("/uploads/complete", json={"upload_token": initiated["upload_token"]}, headers=auth_headers(user_id)).status_code == 400
+    assert bucket.list_objects_v2(Bucket=s3_service.S3_BUCKET).get("KeyCount", 0) == 0
+
+def test_multipart_upload_through_presigned_part_urls(bucket, uploader, monkeypatch):
+    """Test that large files are uploaded part by part to presigned URLs and assembled on complete"""
+    monkeypatch.setattr(s3_service, "S3_MULTIPART_THRESHOLD", 5 * s3_service.MB)
+    monkeypatch.setattr(s3_service, "S3_MULTIPART_CHUNKSIZE", 5 * s3_service.MB)
+    user_id, _, folder_id = uploader
+    content = random.randbytes(11 * s3_service.MB)
+    with TestClient(app) as client:
+        initiated = client.post("/uploads/initiate", json={"filename": "lecture.mp4", "size": len(content), "folder_id": folder_id}, headers=auth_headers(user_id)).json()
+        assert initiated["method"] == "multipart"
+        assert [part["part_number"] for part in initiated["parts"]] == [1, 2, 3]
+
+        size = initiated["part_size"]
+        parts = []
+        for part in initiated["parts"]:
+            chunk = content[(part["part_number"] - 1) * size:part["part_number"] * size]
+            response = httpx.put(part["url"], content=chunk)
+            assert response.status_code == 200
+            parts.append({"part_number": part["part_number"], "etag": response.headers["ETag"]})
+
+        # someone else can't complete it
+        assert client.post("/uploads/complete", json={"upload_token": initiated["upload_token"], "parts": parts}, headers=auth_headers(uploader[1])).status_code == 403
+        # a missing part is refused before anything is assembled
+        assert client.post("/uploads/complete", json={"upload_token": initiated["upload_token"], "parts": parts[:2]}, headers=auth_headers(user_id)).status_code == 400
+
+        completed = client.post("/uploads/complete", json={"upload_token": initiated["upload_token"], "parts": parts}, headers=auth_headers(user_id))
+        assert completed.status_code == 200
+
+    with SessionLocal() as db:
+        record = db.get(models.File, completed.json()["file_id"])
+    assert bucket.get_object(Bucket=s3_service.S3_BUCKET, Key=record.s3_key)["Body"].read() == content
+
+def test_upload_tokens_are_not_access_tokens(bucket, uploader):
+    """Test that an upload token can't authenticate requests and an access token can't complete uploads"""
+    user_id, _, folder_id = uploader
+    with TestClient(app) as client:
+        initiated = client.post("/uploads/initiate", json={"filename": "a.txt", "size": 1, "folder_id": folder_id}, headers=auth_headers(user_id)).json()
+        assert client.get("/me", headers={"Authorization": f"Bearer {initiated['upload_token']}"}).status_code == 401
+        access_token = auth_headers(user_id)["Authorization"].split()[1]
+        assert client.post("/uploads/complete", json={"upload_token": access_token}, headers=auth_headers(user_id)).status_code == 400
+
+def test_initiate_requires_write_access(bucket, uploader):
+    """Test that only users who can edit a folder can upload into it"""
+    _, other, folder_id = uploader
+    with TestClient(app) as client:
+        response = client.post("/uploads/initiate", json={"filename": "a.txt", "size": 1, "folder_id": folder_id}, headers=auth_headers(other))
+    assert response.status_code == 404
+
+def test_complete_rechecks_write_access(bucket, uploader):
+    """Test that losing access to the folder after initiating stops the upload from being recorded"""
+    owner, editor, folder_id = uploader
+    with SessionLocal() as db:
+        share = models.FolderShare(folder_id=folder_id, user_id=editor, permission_type="edit", invitation_accepted=True)
+        db.add(share)
+        db.commit()
+        share_id = share.id
+    with TestClient(app) as client:
+        initiated = client.post("/uploads/initiate", json={"filename": "a.txt", "size": 1, "folder_id": folder_id}, headers=auth_headers(editor)).json()
+        assert _post_form(initiated, b"x") in (200, 204)
+        assert client.delete(f"/shares/{share_id}", headers=auth_headers(owner)).status_code == 204
+
+        assert client.post("/uploads/complete", json={"upload_token": initiated["upload_token"]}, headers=auth_headers(editor)).status_code == 404
+    with SessionLocal() as db:
+        assert db.query(models.File).filter(models.File.folder_id == folder_id).count() == 0
+    assert bucket.list_objects_v2(Bucket=s3_service.S3_BUCKET).get("KeyCount", 0) == 0
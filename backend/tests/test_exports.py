@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, insert
+from app.main import app
+from app.database import SessionLocal, engine
+from app import models
+from conftest import random_email, auth_headers
+
+EXPORT_ROWS = 1_000_000
+# the export reads EXPORT_BATCH_SIZE rows at a time, so its footprint must not scale with the folder
+MAX_RSS_GROWTH = 64 * 1024 * 1024
+
+
+def _user_and_folder():
+    with SessionLocal() as db:
+        owner, stranger = [models.User(email=random_email(), name=name, hashed_password="not-used") for name in ("Owner", "Stranger")]
+        db.add_all([owner, stranger])
+        db.commit()
+        folder = models.StudyFolder(name="Export", user_id=owner.id)
+        db.add(folder)
+        db.commit()
+        return owner.id, stranger.id, folder.id
+
+def _lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_exports_stream_ndjson():
+    """Test that flashcards, files and shares export as one JSON object per line"""
+    owner, stranger, folder_id = _user_and_folder()
+    with SessionLocal() as db:
+        db.add_all(models.Flashcard(question=f"Q{i}", answer=f"A{i}", user_id=owner, folder_id=folder_id) for i in range(5))
+        db.add_all(models.File(filename=f"f{i}.pdf", s3_key=f"{folder_id}/k{i}", user_id=owner, folder_id=folder_id) for i in range(3))
+        db.add(models.FolderShare(folder_id=folder_id, permission_type="read", invitation_email="invitee@example.com"))
+        db.commit()
+
+    with TestClient(app) as client:
+        response = client.get(f"/folders/{folder_id}/flashcards/export", headers=auth_headers(owner))
+        assert response.headers["content-type"] == "application/x-ndjson"
+        flashcards = _lines(response)
+        assert [card["question"] for card in flashcards] == [f"Q{i}" for i in range(5)]
+        assert set(flashcards[0]) == {"id", "question", "answer", "user_id", "folder_id", "created_at", "updated_at"}
+
+        files = _lines(client.get(f"/folders/{folder_id}/files/export", headers=auth_headers(owner)))
+        assert [file["filename"] for file in files] == ["f0.pdf", "f1.pdf", "f2.pdf"]
+        assert "s3_key" not in files[0]
+
+        shares = _lines(client.get(f"/folders/{folder_id}/shares/export", headers=auth_headers(owner)))
+        assert [share["invitation_email"] for share in shares] == ["invitee@example.com"]
+
+        for kind in ("flashcards", "files", "shares"):
+            assert client.get(f"/folders/{folder_id}/{kind}/export", headers=auth_headers(stranger)).status_code == 404
+
+def _rss() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="reads RSS from /proc")
+def test_million_row_export_keeps_memory_flat(live_server):
+    """Test that exporting 1M flashcards doesn't grow the server's memory with the row count"""
+    owner, _, folder_id = _user_and_folder()
+    with engine.begin() as connection:
+        for start in range(0, EXPORT_ROWS, 50_000):
+            connection.execute(insert(models.Flashcard), [
+                {"question": f"Question {i}", "answer": f"Answer {i}", "user_id": owner, "folder_id": folder_id}
+                for i in range(start, start + 50_000)
+            ])
+
+    # the server runs in this process, so sample its RSS while the client reads the stream
+    baseline = _rss()
+    peak = baseline
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, _rss())
+            time.sleep(0.01)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    rows = 0
+    try:
+        with httpx.stream("GET", f"{live_server}/folders/{folder_id}/flashcards/export", headers=auth_headers(owner), timeout=300) as response:
+            assert response.status_code == 200
+            for line in response.iter_lines():
+                rows += bool(line)
+    finally:
+        done.set()
+        sampler.join()
+        with engine.begin() as connection:
+            connection.execute(delete(models.Flashcard).where(models.Flashcard.folder_id == folder_id))
+
+    assert rows == EXPORT_ROWS
+    assert peak - baseline < MAX_RSS_GROWTH, f"RSS grew by {(peak - baseline) / 2**20:.0f} MiB"
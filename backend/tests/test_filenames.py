@@ -0,0 +1,114 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import httpx
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from app import database, models
+from app.main import app # creates the tables
+from app.auth import create_access_token
+from app.database import SessionLocal
+from app.services import uploads
+from app.services.uploads import add_files, unique_filenames
+from conftest import random_email
+
+@pytest.fixture
+def folder():
+    """A folder holding notes.pdf and notes (1..199).pdf except notes (42).pdf"""
+    with SessionLocal() as db:
+        user = models.User(email=random_email(), name="Student", hashed_password="not-used")
+        db.add(user)
+        db.commit()
+        folder = models.StudyFolder(name="Notes", user_id=user.id)
+        db.add(folder)
+        db.commit()
+        names = ["notes.pdf"] + [f"notes ({n}).pdf" for n in range(1, 200) if n != 42]
+        names += ["notes (draft).pdf", "100%_done.pdf", "100%_done (1).pdf", "100xydone (2).pdf"]
+        db.add_all(models.File(filename=name, s3_key=f"{folder.id}/{name}", user_id=user.id, folder_id=folder.id) for name in names)
+        db.commit()
+        return user.id, folder.id
+
+def _run_counting(work):
+    """Run `work(db)` on a fresh async session; return its result and the SQL it ran"""
+    async def main():
+        engine = create_async_engine(database.ASYNC_DATABASE_URL)
+        statements = []
+        event.listen(engine.sync_engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+        try:
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                result = await work(session)
+                await session.commit()
+                return result, statements
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+def test_names_come_from_one_query(folder):
+    """Test that a batch gets gap-filling, then next-free, names from a single round trip"""
+    _, folder_id = folder
+    names, statements = _run_counting(lambda db: unique_filenames(db, folder_id, ["notes.pdf", "notes.pdf", "notes.pdf", "new.pdf"]))
+
+    assert names == ["notes (42).pdf", "notes (200).pdf", "notes (201).pdf", "new.pdf"]
+    assert len([statement for statement in statements if statement.lstrip().upper().startswith("SELECT")]) == 1
+
+def test_wildcards_and_lookalikes_are_not_variants(folder):
+    """Test that LIKE wildcards in a name match literally and non-numbered names are ignored"""
+    _, folder_id = folder
+    names, _ = _run_counting(lambda db: unique_filenames(db, folder_id, ["100%_done.pdf", "notes (draft).pdf"]))
+    assert names == ["100%_done (2).pdf", "notes (draft) (1).pdf"]
+
+def test_folder_names_are_unique(folder):
+    """Test that the database itself refuses a second file with the same name in a folder"""
+    user_id, folder_id = folder
+    with SessionLocal() as db:
+        db.add(models.File(filename="notes.pdf", s3_key=f"{folder_id}/again", user_id=user_id, folder_id=folder_id))
+        with pytest.raises(IntegrityError):
+            db.commit()
+
+def test_lost_race_picks_names_again(folder, monkeypatch):
+    """Test that add_files retries with fresh names when another upload takes one first"""
+    user_id, folder_id = folder
+    pick = uploads.unique_filenames
+    calls = 0
+
+    async def pick_then_lose_race(db, folder_id, filenames):
+        nonlocal calls
+        calls += 1
+        names = await pick(db, folder_id, filenames)
+        if calls == 1:
+            # someone else commits the same name between our lookup and insert
+            with SessionLocal() as other:
+                other.add(models.File(filename=names[0], s3_key=f"{folder_id}/racer", user_id=user_id, folder_id=folder_id))
+                other.commit()
+        return names
+
+    monkeypatch.setattr(uploads, "unique_filenames", pick_then_lose_race)
+    record = models.File(filename="notes.pdf", s3_key=f"{folder_id}/mine", user_id=user_id, folder_id=folder_id)
+    (saved,), _ = _run_counting(lambda db: add_files(db, folder_id, [record]))
+
+    assert calls == 2
+    assert saved.filename == "notes (200).pdf"
+    with SessionLocal() as db:
+        assert db.query(models.File).filter_by(folder_id=folder_id, filename="notes (42).pdf").one().s3_key == f"{folder_id}/racer"
+
+def test_concurrent_uploads_get_distinct_names(bucket, folder, live_server):
+    """Test that uploads of the same name racing into one folder all succeed under different names"""
+    user_id, folder_id = folder
+    headers = {"Authorization": f"Bearer {create_access_token({'user_id': str(user_id)}, expires_delta=timedelta(minutes=5))}"}
+
+    def upload(index):
+        response = httpx.post(
+            f"{live_server}/upload",
+            files=[("file", ("notes.pdf", f"version {index}".encode(), "application/pdf"))],
+            data={"folder_id": str(folder_id)},
+            headers=headers, timeout=30
+        )
+        assert response.status_code == 200
+        return response.json()[0]["filename"]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        names = list(pool.map(upload, range(8)))
+    assert sorted(names) == sorted(["notes (42).pdf"] + [f"notes ({n}).pdf" for n in range(200, 207)])
@@ -0,0 +1,106 @@
+import json
+import time
+from datetime import timedelta
+
+import httpx
+import pytest
+from app.database import get_db
+from app.auth import create_access_token
+from app.utils.json_stream import JsonArrayObjectParser
+from app import models
+from conftest import random_email
+
+CARDS = [{"question": f"Question {i}?", "answer": f"Answer {i}."} for i in range(12)]
+
+@pytest.fixture
+def db():
+    db = next(get_db())
+    yield db
+    db.close()
+
+@pytest.fixture
+def test_folder(db):
+    user = models.User(email=random_email(), name="Stream User", hashed_password="not-used")
+    db.add(user)
+    db.commit()
+    folder = models.StudyFolder(name="Stream Folder", user_id=user.id)
+    db.add(folder)
+    db.commit()
+    db.refresh(folder)
+    return folder
+
+@pytest.fixture
+def auth_token(test_folder):
+    token = create_access_token({"user_id": str(test_folder.user_id)}, expires_delta=timedelta(minutes=5))
+    return {"Authorization": f"Bearer {token}"}
+
+def test_parser_yields_objects_as_they_complete():
+    """Test that each array element is returned once its closing brace arrives"""
+    parser = JsonArrayObjectParser()
+    document = json.dumps({"flashcards": [{"question": "a {tricky} \"one\"", "answer": "[b]"}, {"question": "c", "answer": "d"}]})
+
+    seen = []
+    first_at = None
+    for position, char in enumerate(document):
+        seen.extend(parser.feed(char))
+        if seen and first_at is None:
+            first_at = position
+
+    # the first card is available before the second one has even started
+    assert first_at < document.index('"c"')
+    assert seen == [{"question": "a {tricky} \"one\"", "answer": "[b]"}, {"question": "c", "answer": "d"}]
+
+def test_parser_keeps_cards_before_a_malformed_tail():
+    """Test that a broken object only loses itself"""
+    parser = JsonArrayObjectParser()
+    cards = parser.feed('{"flashcards": [{"question": "q1", "answer": "a1"}, {"question": "q2", "answer": ')
+    cards += parser.feed('oops}, {"question": "q3", "answer": "a3"}, {"question": "q4"')
+
+    assert cards == [{"question": "q1", "answer": "a1"}, {"question": "q3", "answer": "a3"}]
+
+def _read_lines(response):
+    for line in response.iter_lines():
+        if line:
+            yield json.loads(line)
+
+def test_cards_are_streamed_as_they_are_saved(fake_llm, live_server, test_folder, auth_token, db):
+    """Test that saved cards reach the client before generation finishes"""
+    fake_llm.content = json.dumps({"flashcards": CARDS})
+    fake_llm.chunk_size = 8
+    fake_llm.chunk_delay = 0.02
+
+    start = time.perf_counter()
+    first_card_at = None
+    received = []
+    with httpx.stream(
+        "POST", f"{live_server}/folders/{test_folder.id}/flashcards/generate/stream",
+        json={"topic": "numbers", "num_flashcards": 12}, headers=auth_token, timeout=10
+    ) as response:
+        assert response.status_code == 200
+        for line in _read_lines(response):
+            if "flashcard" in line:
+                first_card_at = first_card_at or time.perf_counter() - start
+                received.append(line["flashcard"])
+            else:
+                final = line
+    total = time.perf_counter() - start
+
+    assert final == {"done": True, "cards_created": 12}
+    assert [card["question"] for card in received] == [card["question"] for card in CARDS]
+    assert first_card_at < total / 2
+    saved = db.query(models.Flashcard).filter(models.Flashcard.folder_id == test_folder.id).count()
+    assert saved == 12
+
+def test_malformed_tail_keeps_earlier_cards(fake_llm, live_server, test_folder, auth_token, db):
+    """Test that a response cut off part way still persists the complete cards"""
+    fake_llm.content = json.dumps({"flashcards": CARDS[:6]})[:-2] + ', {"question": "broken'
+
+    with httpx.stream(
+        "POST", f"{live_server}/folders/{test_folder.id}/flashcards/generate/stream",
+        json={"topic": "numbers", "num_flashcards": 12}, headers=auth_token, timeout=10
+    ) as response:
+        lines = list(_read_lines(response))
+
+    assert lines[-1] == {"done": True, "cards_created": 6}
+    saved = db.query(models.Flashcard).filter(models.Flashcard.folder_id == test_folder.id).count()
+    assert saved == 6
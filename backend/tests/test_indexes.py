@@ -0,0 +1,88 @@
+import re
+
+import pytest
+from sqlalchemy import insert, or_, select, text
+from app.database import Base, engine
+from app import models
+from app.services.uploads import clashing_filenames
+from app.utils.pagination import Page, keyset
+
+FOLDERS = 2000
+ROWS = 20000 # flashcards, files and shares each
+OWNERS = 500
+
+HOT_TABLES = ("files", "flashcards", "study_folders", "folder_shares")
+# a full pass over a hot table: Postgres names it a Seq Scan, SQLite SCAN (SEARCH when it uses an index)
+FULL_SCAN = re.compile(r"Seq Scan on (%s)\b|^SCAN (%s)\b" % ("|".join(HOT_TABLES), "|".join(HOT_TABLES)), re.MULTILINE)
+
+@pytest.fixture(scope="module")
+def seeded():
+    """A connection holding a large seeded dataset, rolled back afterwards"""
+    Base.metadata.create_all(bind=engine)
+    # create_all skips indexes of tables that already exist, which an older test database may have
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        folder_ids = connection.scalars(
+            insert(models.StudyFolder).returning(models.StudyFolder.id),
+            [{"name": f"Folder {i}", "user_id": 10**6 + i % OWNERS} for i in range(FOLDERS)],
+        ).all()
+        connection.execute(insert(models.Flashcard), [
+            {"question": "Q", "answer": "A", "user_id": 10**6 + i % OWNERS, "folder_id": folder_ids[i % FOLDERS]} for i in range(ROWS)
+        ])
+        connection.execute(insert(models.File), [
+            {"filename": f"file{i}.pdf", "s3_key": f"key{i}", "user_id": 10**6 + i % OWNERS, "folder_id": folder_ids[i % FOLDERS]} for i in range(ROWS)
+        ])
+        connection.execute(insert(models.FolderShare), [
+            {"folder_id": folder_ids[i % FOLDERS], "permission_type": "read", "invitation_accepted": i % 2 == 0, "invitation_email": f"invitee{i}@example.com"}
+            for i in range(ROWS)
+        ])
+        # planner statistics for the new rows; inside the transaction so they roll back too
+        connection.execute(text("ANALYZE"))
+        yield connection, folder_ids
+        transaction.rollback()
+
+def _plan(connection, statement) -> str:
+    sql = str(statement.compile(connection, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN " if connection.dialect.name == "postgresql" else "EXPLAIN QUERY PLAN "
+    rows = connection.execute(text(prefix + sql)).all()
+    # Postgres returns one line per row; SQLite returns (id, parent, notused, detail)
+    return "\n".join(row[-1] for row in rows)
+
+def _hot_queries(folder_ids):
+    folder_id, other_folder_id = folder_ids[7], folder_ids[8]
+    user_id = 10**6 + 7
+    return {
+        "duplicate file name": clashing_filenames(folder_id, ["file7.pdf"]),
+        "folder flashcards": select(models.Flashcard).where(models.Flashcard.folder_id == folder_id),
+        "folder flashcards page": keyset(select(models.Flashcard).where(models.Flashcard.folder_id == folder_id), models.Flashcard.id, Page(5000, 100)),
+        "folder files page": keyset(select(models.File).where(models.File.folder_id == folder_id), models.File.id, Page(5000, 100)),
+        "all flashcards": select(models.Flashcard).where(or_(
+            models.Flashcard.user_id == user_id,
+            models.Flashcard.folder_id.in_([folder_id, other_folder_id])
+        )),
+        "default folder": select(models.StudyFolder).filter_by(user_id=user_id, name="Default"),
+        "accepted share": select(models.FolderShare).where(
+            models.FolderShare.folder_id == folder_id,
+            models.FolderShare.user_id == user_id,
+            models.FolderShare.invitation_accepted == True
+        ),
+        "existing invitation": select(models.FolderShare).where(
+            models.FolderShare.folder_id == folder_id,
+            models.FolderShare.invitation_email == "invitee7@example.com"
+        ),
+        "pending invitations": select(models.FolderShare).where(
+            models.FolderShare.invitation_email == "invitee7@example.com",
+            models.FolderShare.invitation_accepted == False
+        ),
+    }
+
+@pytest.mark.parametrize("name", list(_hot_queries([0] * 9)))
+def test_hot_path_queries_use_indexes(seeded, name):
+    """Test that no hot-path query plans a full scan of a large table"""
+    connection, folder_ids = seeded
+    plan = _plan(connection, _hot_queries(folder_ids)[name])
+    assert not FULL_SCAN.search(plan), f"{name} scans a whole table:\n{plan}"
@@ -0,0 +1,156 @@
+import json
+import time
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database import get_db
+from app.auth import create_access_token
+from app import models
+from app.services import jobs
+from conftest import random_email
+
+
+@pytest.fixture
+def client():
+    # entering the client runs the lifespan, which starts the job workers
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def db():
+    db = next(get_db())
+    yield db
+    db.close()
+
+@pytest.fixture
+def test_user(db):
+    user = models.User(email=random_email(), name="Job User", hashed_password="not-used")
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+@pytest.fixture
+def auth_token(test_user):
+    token = create_access_token({"user_id": str(test_user.id)}, expires_delta=timedelta(minutes=5))
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def test_folder(db, test_user):
+    folder = models.StudyFolder(name="Job Folder", user_id=test_user.id)
+    db.add(folder)
+    db.commit()
+    db.refresh(folder)
+    return folder
+
+def wait_for_job(client, job_id, headers, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}", headers=headers).json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+def test_generate_returns_job_immediately(client, fake_llm, test_folder, auth_token, db):
+    """Test that the POST returns before the LLM answers and the worker stores the cards"""
+    fake_llm.delay = 0.5
+    fake_llm.content = json.dumps({"flashcards": [
+        {"question": "What is ATP?", "answer": "The energy currency of the cell."},
+        {"question": "Where does photosynthesis happen?", "answer": "In the chloroplasts."},
+    ]})
+
+    start = time.perf_counter()
+    response = client.post(
+        f"/folders/{test_folder.id}/flashcards/generate",
+        json={"topic": "photosynthesis", "num_flashcards": 2},
+        headers=auth_token
+    )
+    assert time.perf_counter() - start < 0.5
+
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] in ("pending", "running")
+    assert job["cards_created"] == 0
+
+    job = wait_for_job(client, job["id"], auth_token)
+    assert job["status"] == "completed"
+    assert job["cards_created"] == 2
+
+    cards = db.query(models.Flashcard).filter(models.Flashcard.folder_id == test_folder.id).all()
+    assert sorted(card.question for card in cards) == ["What is ATP?", "Where does photosynthesis happen?"]
+
+def test_failed_generation_is_reported(client, fake_llm, test_folder, auth_token):
+    """Test that an unparseable LLM answer marks the job as failed"""
+    fake_llm.content = "not json"
+
+    response = client.post(
+        f"/folders/{test_folder.id}/flashcards/generate",
+        json={"topic": "photosynthesis", "num_flashcards": 2},
+        headers=auth_token
+    )
+
+    job = wait_for_job(client, response.json()["id"], auth_token)
+    assert job["status"] == "failed"
+    assert job["error"]
+
+def test_job_hidden_from_other_users(client, fake_llm, test_folder, auth_token, db):
+    """Test that only the requesting user can poll a job"""
+    fake_llm.content = json.dumps({"flashcards": []})
+    response = client.post(
+        f"/folders/{test_folder.id}/flashcards/generate",
+        json={"topic": "photosynthesis"},
+        headers=auth_token
+    )
+
+    other = models.User(email=random_email(), name="Other", hashed_password="not-used")
+    db.add(other)
+    db.commit()
+    token = create_access_token({"user_id": str(other.id)}, expires_delta=timedelta(minutes=5))
+
+    response = client.get(f"/jobs/{response.json()['id']}", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 404
+
+def _pending_job(db, folder):
+    job = models.FlashcardJob(user_id=folder.user_id, folder_id=folder.id, topic="claims", num_flashcards=1)
+    db.add(job)
+    db.commit()
+    return job.id
+
+def test_job_is_claimed_once(test_folder, db):
+    """Test that a job handed to two workers only runs on the first"""
+    job_id = _pending_job(db, test_folder)
+
+    assert jobs._start_job(job_id)["id"] == job_id
+    assert jobs._start_job(job_id) is None
+    # a running job with a live lease isn't requeued on startup
+    assert job_id not in jobs._unfinished_job_ids()
+
+def test_expired_lease_is_reclaimed_without_duplicate_cards(test_folder, db, monkeypatch):
+    """Test that a job orphaned by a dead worker runs again, and a late finish from the old worker is dropped"""
+    job_id = _pending_job(db, test_folder)
+    job = jobs._start_job(job_id)
+
+    monkeypatch.setattr(jobs, "FLASHCARD_JOB_LEASE", 0)
+    assert job_id in jobs._unfinished_job_ids()
+    assert jobs._start_job(job_id) is not None
+
+    card = [{"question": "Q?", "answer": "A."}]
+    jobs._save_flashcards(job, card)
+    jobs._save_flashcards(job, card)
+    assert db.query(models.Flashcard).filter(models.Flashcard.folder_id == test_folder.id).count() == 1
+
+def test_orphaned_job_is_picked_up_once_its_lease_runs_out(fake_llm, test_folder, auth_token, db, monkeypatch):
+    """Test that a job left running by a worker that died after this one started is finished by the sweep"""
+    fake_llm.content = json.dumps({"flashcards": [{"question": "Q?", "answer": "A."}]})
+    monkeypatch.setattr(jobs, "FLASHCARD_JOB_LEASE", 0.3)
+    with TestClient(app) as client:
+        job_id = _pending_job(db, test_folder)
+        # claimed by another process, which then dies; nothing ever queues it here
+        assert jobs._start_job(job_id) is not None
+
+        job = wait_for_job(client, job_id, auth_token)
+    assert job["status"] == "completed"
+    assert job["cards_created"] == 1
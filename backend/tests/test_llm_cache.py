@@ -0,0 +1,164 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event
+from app.database import SessionLocal, engine
+from app import models
+from app.utils import gpt, llm_cache
+
+CARDS = {"flashcards": [{"question": "What is chlorophyll?", "answer": "A green pigment."}]}
+
+def test_repeated_generation_is_served_from_cache(fake_llm):
+    """Test that the same normalized request only reaches the LLM once"""
+    fake_llm.content = json.dumps(CARDS)
+    fake_llm.delay = 0.3
+    before = llm_cache.stats()
+
+    first = asyncio.run(gpt.generate_flashcards("Photosynthesis", 10))
+    start = time.perf_counter()
+    second = asyncio.run(gpt.generate_flashcards("  photosynthesis ", 10))
+    elapsed = time.perf_counter() - start
+
+    assert first == second == CARDS["flashcards"]
+    assert fake_llm.calls == 1
+    assert elapsed < 0.3
+    after = llm_cache.stats()
+    assert after["hits"] - before["hits"] == 1
+    assert after["misses"] - before["misses"] == 1
+
+def test_cache_key_covers_all_inputs(fake_llm):
+    """Test that card count, focus and model are part of the key"""
+    fake_llm.content = json.dumps(CARDS)
+
+    asyncio.run(gpt.generate_flashcards("photosynthesis", 10))
+    asyncio.run(gpt.generate_flashcards("photosynthesis", 5))
+    asyncio.run(gpt.generate_flashcards("photosynthesis", 10, focus="light reactions"))
+
+    assert fake_llm.calls == 3
+    assert llm_cache.make_key("flashcards", "a", {"topic": "x"}) != llm_cache.make_key("flashcards", "b", {"topic": "x"})
+
+def test_chat_responses_are_cached(fake_llm):
+    """Test that generate_response shares the cache"""
+    asyncio.run(gpt.generate_response("What is the Krebs cycle?"))
+    asyncio.run(gpt.generate_response("What is the Krebs cycle?"))
+
+    assert fake_llm.calls == 1
+
+def test_chat_messages_are_keyed_exactly(fake_llm):
+    """Test that chat messages differing only in case or spacing get their own answers"""
+    for message in ("what does `ls -L` do", "what does `ls -l` do", "def f():\n    return 1", "def f():\n  return 1"):
+        asyncio.run(gpt.generate_response(message))
+
+    assert fake_llm.calls == 4
+
+def test_expired_entries_are_regenerated(fake_llm):
+    """Test that entries past their TTL count as misses"""
+    fake_llm.content = json.dumps(CARDS)
+    asyncio.run(gpt.generate_flashcards("mitosis", 10))
+
+    with SessionLocal() as db:
+        db.query(models.LLMCacheEntry).update({"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)})
+        db.commit()
+
+    asyncio.run(gpt.generate_flashcards("mitosis", 10))
+    assert fake_llm.calls == 2
+
+def test_least_recently_used_entries_are_evicted(fake_llm, monkeypatch):
+    """Test that the store never grows past LLM_CACHE_MAX_ENTRIES"""
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_MAX_ENTRIES", 2)
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_TOUCH_INTERVAL", 0)
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_EVICT_INTERVAL", 0)
+    fake_llm.content = json.dumps(CARDS)
+
+    asyncio.run(gpt.generate_flashcards("topic a", 10))
+    asyncio.run(gpt.generate_flashcards("topic b", 10))
+    asyncio.run(gpt.generate_flashcards("topic a", 10)) # refresh a, b is now least recently used
+    asyncio.run(gpt.generate_flashcards("topic c", 10))
+
+    with SessionLocal() as db:
+        assert db.query(models.LLMCacheEntry).count() == 2
+
+    asyncio.run(gpt.generate_flashcards("topic a", 10))
+    assert fake_llm.calls == 3
+    asyncio.run(gpt.generate_flashcards("topic b", 10))
+    assert fake_llm.calls == 4
+
+@pytest.fixture
+def cache_statements():
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "llm_cache" in statement:
+            statements.append(statement)
+    event.listen(engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine, "before_cursor_execute", record)
+
+def test_hits_only_read(fake_llm, cache_statements):
+    """Test that hits within LLM_CACHE_TOUCH_INTERVAL of the last touch don't write"""
+    fake_llm.content = json.dumps(CARDS)
+    asyncio.run(gpt.generate_flashcards("osmosis", 10))
+    cache_statements.clear()
+
+    for _ in range(3):
+        asyncio.run(gpt.generate_flashcards("osmosis", 10))
+
+    assert fake_llm.calls == 1
+    assert len(cache_statements) == 3
+    assert all(statement.lstrip().startswith("SELECT") for statement in cache_statements)
+
+def test_inserts_evict_once_per_interval(fake_llm, cache_statements, monkeypatch):
+    """Test that only the first insert in an LLM_CACHE_EVICT_INTERVAL counts the table"""
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_EVICT_INTERVAL", 60)
+    monkeypatch.setattr(llm_cache, "_last_eviction", None)
+    fake_llm.content = json.dumps(CARDS)
+
+    for topic in ("diffusion", "active transport", "endocytosis"):
+        asyncio.run(gpt.generate_flashcards(topic, 10))
+
+    assert len([statement for statement in cache_statements if "count(" in statement.lower()]) == 1
+
+def _stream(topic):
+    async def collect():
+        return [card async for card in gpt.stream_flashcards(topic, 3)]
+    return asyncio.run(collect())
+
+def test_complete_stream_is_cached(fake_llm):
+    """Test that a fully received streamed answer is reused by generate_flashcards"""
+    fake_llm.content = json.dumps(CARDS)
+    assert _stream("chlorophyll") == CARDS["flashcards"]
+    assert asyncio.run(gpt.generate_flashcards("chlorophyll", 3)) == CARDS["flashcards"]
+    assert fake_llm.calls == 1
+
+def test_truncated_stream_is_not_cached(fake_llm):
+    """Test that a cut-off or malformed stream yields its complete cards but leaves the cache empty"""
+    cards = [{"question": f"Q{i}?", "answer": f"A{i}."} for i in range(3)]
+    document = json.dumps({"flashcards": cards})
+    for content, finish_reason in (
+        (document[:document.index('{"question": "Q2')], "length"), # cut off by the token limit
+        (document.replace('"A1."', 'A1.'), "stop"), # a malformed card in an otherwise finished answer
+    ):
+        llm_cache.clear()
+        fake_llm.content, fake_llm.finish_reason = content, finish_reason
+        assert len(_stream("truncation")) == 2
+        assert asyncio.run(llm_cache.lookup("flashcards", gpt.FLASHCARD_MODEL, {"topic": "truncation", "card_count": 3, "focus": None})) is None
+
+def _stream_chat(message):
+    async def collect():
+        return "".join([delta async for delta in gpt.stream_response(message)])
+    return asyncio.run(collect())
+
+def test_cut_off_chat_answers_are_not_cached(fake_llm):
+    """Test that chat answers stopped by the token limit are returned but not cached, streamed or not"""
+    fake_llm.finish_reason = "length"
+    for _ in range(2):
+        assert asyncio.run(gpt.generate_response("Explain entropy")) == fake_llm.content
+        assert _stream_chat("Explain enthalpy") == fake_llm.content
+    assert fake_llm.calls == 4
+
+    fake_llm.finish_reason = "stop"
+    _stream_chat("Explain enthalpy")
+    assert asyncio.run(gpt.generate_response("Explain enthalpy")) == fake_llm.content
+    assert fake_llm.calls == 5
@@ -0,0 +1,66 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app.main import app
+from app import database
+from app.routes import metrics as metrics_route
+from app.utils import metrics
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(metrics_route, "METRICS_TOKEN", "s3cret")
+    return {"X-Metrics-Token": "s3cret"}
+
+def test_endpoint_reports_pool_state(client, token):
+    """Test that the endpoint shows checked-out connections and checkout counters"""
+    before = metrics.get_counter("db.pool.primary.checkouts")
+    with database.engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        body = client.get("/internal/metrics", headers=token).json()
+
+    primary = body["pools"]["primary"]
+    assert primary["checked_out"] >= 1
+    assert primary["size"] == database.DB_POOL_SIZE
+    assert primary["max_overflow"] == database.DB_MAX_OVERFLOW
+    assert body["counters"]["db.pool.primary.checkins"] > 0
+    assert body["counters"]["db.pool.primary.checkouts"] > before
+    assert body["histograms"]["db.pool.primary.wait_seconds"]["count"] > 0
+    assert "primary_async" in body["pools"]
+
+def test_endpoint_is_hidden_without_a_token(client, monkeypatch):
+    """Test that the endpoint stays hidden until METRICS_TOKEN is configured"""
+    monkeypatch.setattr(metrics_route, "METRICS_TOKEN", None)
+    assert client.get("/internal/metrics").status_code == 404
+    assert client.get("/internal/metrics", headers={"X-Metrics-Token": ""}).status_code == 404
+
+def test_endpoint_requires_token_when_configured(client, token):
+    """Test that METRICS_TOKEN hides the endpoint from callers without it"""
+    assert client.get("/internal/metrics").status_code == 404
+    assert client.get("/internal/metrics", headers={"X-Metrics-Token": "wrong"}).status_code == 404
+    assert client.get("/internal/metrics", headers={"X-Metrics-Token": "s3cret"}).status_code == 200
+
+def test_pool_settings_come_from_config(tmp_path, monkeypatch):
+    """Test that an exhausted pool waits DB_POOL_TIMEOUT and records the timeout"""
+    monkeypatch.setattr(database, "DB_POOL_SIZE", 1)
+    monkeypatch.setattr(database, "DB_MAX_OVERFLOW", 0)
+    monkeypatch.setattr(database, "DB_POOL_TIMEOUT", 0.2)
+    url = f"sqlite:///{tmp_path / 'pool.db'}"
+    engine = database._instrument(create_engine(url, **database._engine_options(url, "test_pool")), "test_pool")
+    try:
+        with engine.connect():
+            with pytest.raises(PoolTimeoutError):
+                engine.connect()
+
+        assert metrics.get_counter("db.pool.test_pool.timeouts") == 1
+        assert metrics.get_counter("db.pool.test_pool.connects") == 1
+        assert metrics.snapshot()["histograms"]["db.pool.test_pool.wait_seconds"]["sum"] >= 0.2
+    finally:
+        engine.dispose()
+        database.pools.pop("test_pool", None)
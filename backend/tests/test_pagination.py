@@ -0,0 +1,66 @@
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database import get_db
+from app import models
+from conftest import random_email, auth_headers
+
+
+@pytest.fixture
+def db():
+    db = next(get_db())
+    yield db
+    db.close()
+
+@pytest.fixture
+def owner(db):
+    user = models.User(email=random_email(), name="Pager", hashed_password="not-used")
+    db.add(user)
+    db.commit()
+    folders = [models.StudyFolder(name=f"Folder {i}", user_id=user.id) for i in range(5)]
+    db.add_all(folders)
+    db.commit()
+    db.add_all(models.Flashcard(question=f"Q{i}", answer=f"A{i}", user_id=user.id, folder_id=folders[0].id) for i in range(23))
+    db.commit()
+    return user.id, [folder.id for folder in folders]
+
+def _walk(client, path, key, headers, limit):
+    """Follow next_cursor from the first page to the last, returning each page's ids"""
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get(path, params=params, headers=headers)
+        assert response.status_code == 200
+        body = response.json()
+        pages.append([item["id"] for item in body[key]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+def test_pages_cover_every_row_once(owner):
+    """Test that following cursors returns every row once, in id order"""
+    user_id, folder_ids = owner
+    headers = auth_headers(user_id)
+    with TestClient(app) as client:
+        pages = _walk(client, f"/folders/{folder_ids[0]}/flashcards", "flashcards", headers, limit=10)
+        assert [len(page) for page in pages] == [10, 10, 3]
+        ids = [id for page in pages for id in page]
+        assert ids == sorted(ids) and len(set(ids)) == 23
+
+        assert _walk(client, "/flashcards", "flashcards", headers, limit=10) == pages
+        assert _walk(client, "/folders", "folders", headers, limit=2) == [folder_ids[0:2], folder_ids[2:4], folder_ids[4:]]
+
+def test_exact_page_has_no_next_cursor(owner):
+    """Test that a page that happens to hold the last row doesn't promise another"""
+    user_id, folder_ids = owner
+    with TestClient(app) as client:
+        body = client.get("/folders", params={"limit": 5}, headers=auth_headers(user_id)).json()
+    assert [folder["id"] for folder in body["folders"]] == folder_ids
+    assert body["next_cursor"] is None
+
+def test_bad_cursor_and_page_size_are_rejected(owner):
+    """Test that a tampered cursor is a 400 and an oversized page a 422"""
+    user_id, folder_ids = owner
+    with TestClient(app) as client:
+        assert client.get("/folders", params={"cursor": "not-a-cursor"}, headers=auth_headers(user_id)).status_code == 400
+        assert client.get("/folders", params={"limit": 10**6}, headers=auth_headers(user_id)).status_code == 422
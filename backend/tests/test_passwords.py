@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database import get_db
+from app.utils import metrics, passwords
+from app import models
+from conftest import random_email
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def db():
+    db = next(get_db())
+    yield db
+    db.close()
+
+@pytest.fixture
+def cheap_rounds():
+    # keep the hashes fast; restored so other tests see the calibrated cost
+    rounds = passwords.pwd_context.to_dict().get("bcrypt__default_rounds", 12)
+    passwords.set_bcrypt_rounds(5)
+    yield 5
+    passwords.set_bcrypt_rounds(rounds)
+
+def test_signup_then_login(client, cheap_rounds):
+    """Test the async signup and login routes end to end"""
+    email = random_email()
+    response = client.post("/signup", json={"email": email, "name": "New User", "password": "password123"})
+    assert response.status_code == 200
+
+    assert client.post("/login", json={"email": email, "password": "wrong-password"}).status_code == 401
+    token = client.post("/login", json={"email": email, "password": "password123"}).json()["access_token"]
+    me = client.get("/me", headers={"Authorization": f"Bearer {token}"}).json()
+    assert me["email"] == email
+
+def test_login_rehashes_outdated_cost(client, db, cheap_rounds):
+    """Test that a hash below the configured cost is replaced on a successful login"""
+    old_hash = passwords.pwd_context.handler("bcrypt").using(rounds=4).hash("password123")
+    user = models.User(email=random_email(), name="Old Hash", hashed_password=old_hash)
+    db.add(user)
+    db.commit()
+
+    assert client.post("/login", json={"email": user.email, "password": "password123"}).status_code == 200
+
+    db.refresh(user)
+    assert user.hashed_password != old_hash
+    assert user.hashed_password.startswith("$2b$05$")
+    assert passwords.pwd_context.verify("password123", user.hashed_password)
+
+def test_hashing_runs_on_the_password_pool(cheap_rounds):
+    """Test that bcrypt runs off the event loop thread and the queue depth is tracked"""
+    threads = []
+    def record(password):
+        threads.append(threading.current_thread().name)
+        return passwords.pwd_context.hash(password)
+
+    async def run():
+        return await asyncio.gather(*[passwords._run(record, "secret") for _ in range(6)])
+
+    hashes = asyncio.run(run())
+
+    assert len(hashes) == 6
+    assert all(name.startswith("password") for name in threads)
+    assert metrics.get_gauge("passwords.queue_depth") == 0
+
+def test_full_queue_is_rejected(monkeypatch):
+    """Test that password work beyond the queue limit fails fast with a 503"""
+    monkeypatch.setattr(passwords, "PASSWORD_HASH_QUEUE_LIMIT", 0)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(passwords.hash_password("secret"))
+    assert error.value.status_code == 503
+
+def test_calibration_meets_target(monkeypatch):
+    """Test that the calibrated cost stays within the latency target"""
+    monkeypatch.setattr(passwords, "BCRYPT_MIN_ROUNDS", 4)
+    rounds = passwords.calibrate_bcrypt_rounds(target=0.05)
+
+    assert 4 <= rounds < passwords.BCRYPT_MAX_ROUNDS
+    # one more round would double the time, so the chosen cost is the highest under target
+    handler = passwords.pwd_context.handler("bcrypt").using(rounds=rounds)
+    assert min(_timed(handler.hash, "x") for _ in range(3)) < 0.05 * 1.5
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
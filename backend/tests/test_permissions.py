@@ -0,0 +1,247 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from app.main import app
+from app import database, models
+from app.database import Base, RoutingSession, get_db
+from app.utils import permissions as permissions_module
+from app.utils.cache import TTLCache
+from app.utils.permissions import forget_permissions, get_folder_permission, permission_cache, resolve_folder_access, resolve_folder_permissions, verify_folder_access, verify_flashcard_access
+from conftest import random_email, auth_headers
+
+
+@pytest.fixture(autouse=True)
+def empty_permission_cache():
+    permission_cache.clear()
+
+@pytest.fixture
+def db():
+    db = next(get_db())
+    yield db
+    db.close()
+
+@pytest.fixture
+def shared_folder(db):
+    """A folder with an owner, a reader, an editor (with a second, weaker share) and a stranger"""
+    users = {role: models.User(email=random_email(), name=role, hashed_password="not-used") for role in ("owner", "reader", "editor", "stranger")}
+    db.add_all(users.values())
+    db.commit()
+    folder = models.StudyFolder(name="Shared", user_id=users["owner"].id)
+    db.add(folder)
+    db.commit()
+    db.add_all([
+        models.FolderShare(folder_id=folder.id, user_id=users["reader"].id, permission_type="read", invitation_accepted=True),
+        models.FolderShare(folder_id=folder.id, user_id=users["editor"].id, permission_type="edit", invitation_accepted=True),
+        models.FolderShare(folder_id=folder.id, user_id=users["editor"].id, permission_type="read", invitation_accepted=True),
+        models.FolderShare(folder_id=folder.id, user_id=users["stranger"].id, permission_type="admin", invitation_accepted=False),
+    ])
+    flashcard = models.Flashcard(question="Q", answer="A", folder_id=folder.id, user_id=users["owner"].id)
+    db.add(flashcard)
+    db.commit()
+    return folder.id, flashcard.id, {role: user.id for role, user in users.items()}
+
+def _run_counting(check):
+    """Run `check(db)` on a fresh async session; return its result (or HTTPException) and the SQL it ran"""
+    async def main():
+        engine = create_async_engine(database.ASYNC_DATABASE_URL)
+        statements = []
+        event.listen(engine.sync_engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+        try:
+            async with AsyncSession(engine) as session:
+                try:
+                    return await check(session), statements
+                except HTTPException as error:
+                    return error, statements
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+@pytest.mark.parametrize("role, permission", [("owner", "owner"), ("reader", "read"), ("editor", "edit"), ("stranger", None)])
+def test_resolver_returns_effective_permission_in_one_query(shared_folder, role, permission):
+    """Test the folder and permission come back from a single round trip"""
+    folder_id, _, users = shared_folder
+    access, statements = _run_counting(lambda session: resolve_folder_access(session, folder_id, users[role]))
+
+    assert access.folder.id == folder_id
+    assert access.permission == permission
+    assert len(statements) == 1
+
+def test_verify_folder_access_checks_permission_types(shared_folder):
+    """Test that required permission types are enforced with one query per check"""
+    folder_id, _, users = shared_folder
+
+    permission, statements = _run_counting(lambda session: verify_folder_access(session, folder_id, users["editor"], ["edit", "admin"]))
+    assert permission == "edit" and len(statements) == 1
+
+    error, statements = _run_counting(lambda session: verify_folder_access(session, folder_id, users["reader"], ["edit", "admin"]))
+    assert error.status_code == 404 and len(statements) == 1
+
+    error, _ = _run_counting(lambda session: verify_folder_access(session, 10**9, users["owner"]))
+    assert error.status_code == 404
+
+def test_verify_flashcard_access_in_one_query(shared_folder):
+    """Test flashcard checks load the card and the folder permission together"""
+    _, flashcard_id, users = shared_folder
+
+    flashcard, statements = _run_counting(lambda session: verify_flashcard_access(session, flashcard_id, users["reader"]))
+    assert flashcard.id == flashcard_id and len(statements) == 1
+
+    error, statements = _run_counting(lambda session: verify_flashcard_access(session, flashcard_id, users["stranger"]))
+    assert error.status_code == 403 and len(statements) == 1
+
+def test_batch_resolver_in_one_query(shared_folder, db):
+    """Test that many folders are resolved at once, leaving out inaccessible ones"""
+    folder_id, _, users = shared_folder
+    own_folder = models.StudyFolder(name="Editor's own", user_id=users["editor"])
+    db.add(own_folder)
+    db.commit()
+
+    permissions, statements = _run_counting(lambda session: resolve_folder_permissions(session, users["editor"], [folder_id, own_folder.id, 10**9]))
+    assert permissions == {folder_id: "edit", own_folder.id: "owner"}
+    assert len(statements) == 1
+
+    permissions, statements = _run_counting(lambda session: resolve_folder_permissions(session, users["editor"]))
+    assert permissions == {folder_id: "edit", own_folder.id: "owner"}
+    assert len(statements) == 1
+
+    permissions, _ = _run_counting(lambda session: resolve_folder_permissions(session, users["stranger"]))
+    assert permissions == {}
+
+def test_listings_include_shared_folders(shared_folder):
+    """Test GET /folders lists shared folders only when asked, and GET /flashcards covers them"""
+    folder_id, flashcard_id, users = shared_folder
+
+    with TestClient(app) as client:
+        assert client.get("/folders", headers=auth_headers(users["reader"])).json()["folders"] == []
+        folders = client.get("/folders", params={"include_shared": "true"}, headers=auth_headers(users["reader"])).json()["folders"]
+        assert [(folder["id"], folder["permission"]) for folder in folders] == [(folder_id, "read")]
+        for params in ({}, {"include_shared": "true"}):
+            folders = client.get("/folders", params=params, headers=auth_headers(users["owner"])).json()["folders"]
+            assert [(folder["id"], folder["permission"]) for folder in folders] == [(folder_id, "owner")]
+
+        flashcards = client.get("/flashcards", headers=auth_headers(users["reader"])).json()["flashcards"]
+        assert [flashcard["id"] for flashcard in flashcards] == [flashcard_id]
+        # the owner created the card and owns the folder, but gets it once
+        flashcards = client.get("/flashcards", headers=auth_headers(users["owner"])).json()["flashcards"]
+        assert [flashcard["id"] for flashcard in flashcards] == [flashcard_id]
+        assert client.get("/flashcards", headers=auth_headers(users["stranger"])).json()["flashcards"] == []
+
+        # a card an editor adds to the owner's folder is the editor's, and the reader's through the share
+        added = client.post("/flashcards", json={"question": "Q2", "answer": "A2", "folder_id": folder_id}, headers=auth_headers(users["editor"])).json()["id"]
+        for role, expected in (("owner", [flashcard_id]), ("editor", [flashcard_id, added]), ("reader", [flashcard_id, added])):
+            flashcards = client.get("/flashcards", headers=auth_headers(users[role])).json()["flashcards"]
+            assert [flashcard["id"] for flashcard in flashcards] == expected
+
+def test_flashcard_routes_enforce_share_permissions(shared_folder):
+    """Test that readers can't edit, editors can't delete and owners can do both"""
+    _, flashcard_id, users = shared_folder
+    headers = lambda role: auth_headers(users[role])
+
+    with TestClient(app) as client:
+        assert client.put(f"/flashcards/{flashcard_id}", json={"answer": "B"}, headers=headers("reader")).status_code == 403
+        assert client.put(f"/flashcards/{flashcard_id}", json={"answer": "B"}, headers=headers("editor")).json()["answer"] == "B"
+        assert client.delete(f"/flashcards/{flashcard_id}", headers=headers("editor")).status_code == 403
+        assert client.delete(f"/flashcards/{flashcard_id}", headers=headers("owner")).status_code == 204
+
+def test_repeat_checks_are_served_from_cache(shared_folder):
+    """Test that a second check of the same (user, folder) needs no query"""
+    folder_id, _, users = shared_folder
+    _run_counting(lambda session: verify_folder_access(session, folder_id, users["reader"]))
+
+    permission, statements = _run_counting(lambda session: verify_folder_access(session, folder_id, users["reader"]))
+    assert permission == "read" and statements == []
+
+    # denials aren't cached, so access granted later is seen straight away
+    _run_counting(lambda session: verify_folder_access(session, folder_id, users["stranger"]))
+    error, statements = _run_counting(lambda session: verify_folder_access(session, folder_id, users["stranger"]))
+    assert error.status_code == 404 and len(statements) == 1
+
+def test_share_mutations_invalidate_cached_permissions(shared_folder, db):
+    """Test update, delete and accept of shares take effect on the next request"""
+    folder_id, _, users = shared_folder
+    reader_share, stranger_share = (
+        db.query(models.FolderShare).filter(models.FolderShare.folder_id == folder_id, models.FolderShare.user_id == users[role]).one()
+        for role in ("reader", "stranger")
+    )
+    stranger_email = db.get(models.User, users["stranger"]).email
+    stranger_share.invitation_email = stranger_email
+    db.commit()
+    new_card = {"question": "New", "answer": "Card", "folder_id": folder_id}
+
+    with TestClient(app) as client:
+        reader, owner, stranger = auth_headers(users["reader"]), auth_headers(users["owner"]), auth_headers(users["stranger"])
+        assert client.post(f"/folders/{folder_id}/flashcards", json=new_card, headers=reader).status_code == 404
+
+        assert client.put(f"/shares/{reader_share.id}", json={"permission_type": "edit"}, headers=owner).status_code == 200
+        assert client.post(f"/folders/{folder_id}/flashcards", json=new_card, headers=reader).status_code == 200
+
+        assert client.delete(f"/shares/{reader_share.id}", headers=owner).status_code == 204
+        assert client.get(f"/folders/{folder_id}/flashcards", headers=reader).status_code == 404
+
+        assert client.get(f"/folders/{folder_id}/flashcards", headers=stranger).status_code == 404
+        assert client.post(f"/shares/{stranger_share.id}/accept", headers=stranger).status_code == 200
+        assert client.get(f"/folders/{folder_id}/flashcards", headers=stranger).status_code == 200
+
+def test_invalidations_reach_other_workers(shared_folder, db):
+    """Test that another worker's cache, subscribed to the channel, drops the changed entry"""
+    folder_id, _, users = shared_folder
+    other_worker = TTLCache("test.other_worker", 100, 60)
+    other_worker.set((users["reader"], folder_id), ("read",))
+    other_worker.set((users["editor"], folder_id), ("edit",))
+    def handler(message):
+        forget_permissions(message["folder_id"], message.get("user_id"), cache=other_worker)
+    permissions_module.invalidation_channel.subscribe(handler)
+
+    try:
+        reader_share = db.query(models.FolderShare).filter(models.FolderShare.user_id == users["reader"]).one()
+        with TestClient(app) as client:
+            client.put(f"/shares/{reader_share.id}", json={"permission_type": "admin"}, headers=auth_headers(users["owner"]))
+            assert other_worker.get((users["reader"], folder_id)) is None
+            assert other_worker.get((users["editor"], folder_id)) == ("edit",)
+
+            # deleting the folder drops it for everyone
+            client.delete(f"/folders/{folder_id}", headers=auth_headers(users["owner"]))
+            assert other_worker.get((users["editor"], folder_id)) is None
+    finally:
+        permissions_module.invalidation_channel.unsubscribe(handler)
+
+def test_stale_replica_reads_are_not_cached(shared_folder, db, tmp_path):
+    """Test that a replica still showing a revoked share can't put it back in the cache"""
+    folder_id, _, users = shared_folder
+    reader_share = db.query(models.FolderShare).filter(models.FolderShare.user_id == users["reader"]).one()
+
+    # the replica hasn't caught up with the revoke yet
+    replica_file = tmp_path / "replica.db"
+    replica = create_engine(f"sqlite:///{replica_file}")
+    Base.metadata.create_all(bind=replica)
+    with sessionmaker(bind=replica)() as replica_db:
+        replica_db.add(models.StudyFolder(id=folder_id, name="Shared", user_id=users["owner"]))
+        replica_db.add(models.FolderACL(user_id=users["reader"], folder_id=folder_id, permission_rank=1))
+        replica_db.commit()
+    replica.dispose()
+    with TestClient(app) as client:
+        assert client.delete(f"/shares/{reader_share.id}", headers=auth_headers(users["owner"])).status_code == 204
+
+    async def check_through_replica():
+        async_replica = create_async_engine(f"sqlite+aiosqlite:///{replica_file}")
+        reads = async_sessionmaker(
+            bind=database.async_engine, sync_session_class=RoutingSession,
+            replicas=[async_replica.sync_engine], info={"read_only": True}
+        )
+        try:
+            async with reads() as session:
+                return await get_folder_permission(session, folder_id, users["reader"])
+        finally:
+            await async_replica.dispose()
+            await database.async_engine.dispose()
+
+    assert asyncio.run(check_through_replica()) == "read"
+    assert permission_cache.get((users["reader"], folder_id)) is None
+    # the primary's answer stands
+    error, _ = _run_counting(lambda session: verify_folder_access(session, folder_id, users["reader"]))
+    assert error.status_code == 404
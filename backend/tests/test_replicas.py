@@ -0,0 +1,166 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.main import app
+from app import database, models
+from app.database import Base, RoutingSession, get_db
+from app.auth import create_access_token
+from conftest import random_email
+
+
+@pytest.fixture(autouse=True)
+def no_recent_writes(monkeypatch):
+    # writes recorded by other tests would keep their users' reads on the primary
+    monkeypatch.setattr(database, "_last_writes", {})
+
+@pytest.fixture
+def stand_ins(tmp_path):
+    # two SQLite files standing in for a primary and a lagging replica
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    for engine in (primary, replica):
+        Base.metadata.create_all(bind=engine)
+    yield primary, replica
+    primary.dispose()
+    replica.dispose()
+
+def _folder_names(db, user_id):
+    return [folder.name for folder in db.query(models.StudyFolder).filter(models.StudyFolder.user_id == user_id)]
+
+def test_reads_go_to_replica_until_the_user_writes(stand_ins, monkeypatch):
+    """Test read-your-writes: a user's reads stick to the primary for a while after their write"""
+    primary, replica = stand_ins
+    writes = sessionmaker(class_=RoutingSession, bind=primary, info={"user_id": 1})
+    reads = sessionmaker(class_=RoutingSession, bind=primary, replicas=[replica], info={"read_only": True, "user_id": 1})
+    with sessionmaker(bind=replica)() as db:
+        db.add(models.StudyFolder(name="Replica copy", user_id=1))
+        db.commit()
+
+    with reads() as db:
+        assert _folder_names(db, 1) == ["Replica copy"]
+
+    with writes() as db:
+        db.add(models.StudyFolder(name="Fresh folder", user_id=1))
+        db.commit()
+
+    with reads() as db:
+        assert _folder_names(db, 1) == ["Fresh folder"]
+    # other users are still served by the replica
+    with reads(info={"user_id": 2}) as db:
+        assert _folder_names(db, 1) == ["Replica copy"]
+
+    monkeypatch.setattr(database, "DB_REPLICA_STICKY_SECONDS", 0)
+    with reads() as db:
+        assert _folder_names(db, 1) == ["Replica copy"]
+
+def test_read_session_flushes_to_primary(stand_ins):
+    """Test that a write made through a read session still lands on the primary"""
+    primary, replica = stand_ins
+    reads = sessionmaker(class_=RoutingSession, bind=primary, replicas=[replica], info={"read_only": True})
+
+    with reads() as db:
+        db.add(models.StudyFolder(name="Written", user_id=3))
+        db.commit()
+
+    with sessionmaker(bind=primary)() as db:
+        assert _folder_names(db, 3) == ["Written"]
+    with sessionmaker(bind=replica)() as db:
+        assert _folder_names(db, 3) == []
+
+def test_get_folders_reads_replica_and_sticks_after_create(tmp_path, monkeypatch):
+    """Test GET /folders through the app against a replica stand-in"""
+    db = next(get_db())
+    user = models.User(email=random_email(), name="Replica User", hashed_password="not-used")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    headers = {"Authorization": f"Bearer {create_access_token({'user_id': str(user_id)}, expires_delta=timedelta(minutes=5))}"}
+
+    replica_file = tmp_path / "replica.db"
+    replica = create_engine(f"sqlite:///{replica_file}")
+    Base.metadata.create_all(bind=replica)
+    with sessionmaker(bind=replica)() as replica_db:
+        replica_db.add(models.StudyFolder(name="Replica copy", user_id=user_id))
+        replica_db.commit()
+    replica.dispose()
+
+    async_replica = create_async_engine(f"sqlite+aiosqlite:///{replica_file}")
+    monkeypatch.setattr(database, "AsyncReadSessionLocal", async_sessionmaker(
+        bind=database.async_engine,
+        sync_session_class=RoutingSession,
+        replicas=[async_replica.sync_engine],
+        info={"read_only": True},
+        expire_on_commit=False
+    ))
+    try:
+        with TestClient(app) as client:
+            folders = client.get("/folders", headers=headers).json()["folders"]
+            assert [folder["name"] for folder in folders] == ["Replica copy"]
+
+            assert client.post("/folders", json={"name": "Just created"}, headers=headers).status_code == 200
+            folders = client.get("/folders", headers=headers).json()["folders"]
+            assert [folder["name"] for folder in folders] == ["Just created"]
+    finally:
+        asyncio.run(async_replica.dispose())
+
+def test_session_keeps_its_first_bind(stand_ins):
+    """Test that a session routed to a replica stays there, even if its user writes meanwhile"""
+    primary, replica = stand_ins
+    reads = sessionmaker(class_=RoutingSession, bind=primary, replicas=[replica], info={"read_only": True, "user_id": 4})
+    with sessionmaker(bind=replica)() as db:
+        db.add(models.StudyFolder(name="Replica copy", user_id=4))
+        db.commit()
+
+    with reads() as db:
+        assert _folder_names(db, 4) == ["Replica copy"]
+        database.record_write(4)
+        assert _folder_names(db, 4) == ["Replica copy"]
+    with reads() as db:
+        assert _folder_names(db, 4) == []
+
+def test_write_mark_travels_with_the_client(tmp_path, monkeypatch):
+    """Test read-your-writes when the next read lands on a worker that didn't see the write"""
+    db = next(get_db())
+    user = models.User(email=random_email(), name="Replica User", hashed_password="not-used")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    headers = {"Authorization": f"Bearer {create_access_token({'user_id': str(user_id)}, expires_delta=timedelta(minutes=5))}"}
+
+    replica_file = tmp_path / "replica.db"
+    replica = create_engine(f"sqlite:///{replica_file}")
+    Base.metadata.create_all(bind=replica)
+    replica.dispose()
+    async_replica = create_async_engine(f"sqlite+aiosqlite:///{replica_file}")
+    monkeypatch.setattr(database, "AsyncReadSessionLocal", async_sessionmaker(
+        bind=database.async_engine,
+        sync_session_class=RoutingSession,
+        replicas=[async_replica.sync_engine],
+        info={"read_only": True},
+        expire_on_commit=False
+    ))
+    try:
+        with TestClient(app) as client:
+            created = client.post("/folders", json={"name": "Just created"}, headers=headers)
+            assert created.status_code == 200
+            mark = created.headers[database.LAST_WRITE_HEADER]
+            # another worker knows nothing of the write but the cookie the client sends back
+            database._last_writes.clear()
+            folders = client.get("/folders", headers=headers).json()["folders"]
+            assert [folder["name"] for folder in folders] == ["Just created"]
+
+            # or the header, for clients that don't keep cookies
+            client.cookies.clear()
+            folders = client.get("/folders", headers=headers).json()["folders"]
+            assert folders == []
+            folders = client.get("/folders", headers={**headers, database.LAST_WRITE_HEADER: mark}).json()["folders"]
+            assert [folder["name"] for folder in folders] == ["Just created"]
+    finally:
+        asyncio.run(async_replica.dispose())
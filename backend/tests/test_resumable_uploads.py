@@ -0,0 +1,156 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database import SessionLocal
+from app.services import s3 as s3_service
+from app import models
+from app.routes import uploads as uploads_routes
+from conftest import random_email, auth_headers
+
+
+@pytest.fixture
+def uploader(monkeypatch):
+    # smallest parts S3 accepts, so a few parts stay cheap
+    monkeypatch.setattr(s3_service, "S3_MULTIPART_CHUNKSIZE", 5 * s3_service.MB)
+    with SessionLocal() as db:
+        users = [models.User(email=random_email(), name=name, hashed_password="not-used") for name in ("Uploader", "Other")]
+        db.add_all(users)
+        db.commit()
+        folder = models.StudyFolder(name="Resumable", user_id=users[0].id)
+        db.add(folder)
+        db.commit()
+        return users[0].id, users[1].id, folder.id
+
+def _chunk(content, session, part_number):
+    size = session["part_size"]
+    return content[(part_number - 1) * size:part_number * size]
+
+def test_interrupted_upload_resumes_from_offset(bucket, uploader):
+    """Test that a client that drops out part way only sends what the server doesn't have"""
+    user_id, _, folder_id = uploader
+    content = random.randbytes(12 * s3_service.MB)
+    with TestClient(app) as client:
+        created = client.post("/uploads/sessions", json={"filename": "lecture.mp4", "size": len(content), "folder_id": folder_id}, headers=auth_headers(user_id))
+        assert created.status_code == 201
+        session = created.json()
+        assert session["part_count"] == 3 and session["offset"] == 0
+
+        # the connection drops after the first part
+        first = client.put(f"/uploads/sessions/{session['id']}/parts/1", content=_chunk(content, session, 1), headers=auth_headers(user_id))
+        assert first.json()["offset"] == session["part_size"]
+
+        # a new client asks where to pick up and sends only the rest
+        resumed = client.get(f"/uploads/sessions/{session['id']}", headers=auth_headers(user_id)).json()
+        assert resumed["received_parts"] == [1]
+        next_part = resumed["offset"] // resumed["part_size"] + 1
+        for number in range(next_part, resumed["part_count"] + 1):
+            response = client.put(f"/uploads/sessions/{session['id']}/parts/{number}", content=_chunk(content, session, number), headers=auth_headers(user_id))
+            assert response.status_code == 200
+        assert response.json()["offset"] == len(content)
+
+        completed = client.post(f"/uploads/sessions/{session['id']}/complete", headers=auth_headers(user_id))
+        assert completed.status_code == 200
+        # completing again doesn't record a second file
+        again = client.post(f"/uploads/sessions/{session['id']}/complete", headers=auth_headers(user_id))
+        assert again.json()["file_id"] == completed.json()["file_id"]
+        # nothing more can be sent once it's done
+        assert client.put(f"/uploads/sessions/{session['id']}/parts/1", content=_chunk(content, session, 1), headers=auth_headers(user_id)).status_code == 409
+
+    with SessionLocal() as db:
+        record = db.get(models.File, completed.json()["file_id"])
+        assert record.folder_id == folder_id and record.filename == "lecture.mp4"
+    assert bucket.get_object(Bucket=s3_service.S3_BUCKET, Key=record.s3_key)["Body"].read() == content
+
+def test_parts_out_of_order_and_resent(bucket, uploader):
+    """Test that offset only counts the unbroken start and a resent part replaces the earlier copy"""
+    user_id, _, folder_id = uploader
+    content = random.randbytes(11 * s3_service.MB)
+    with TestClient(app) as client:
+        session = client.post("/uploads/sessions", json={"filename": "a.bin", "size": len(content), "folder_id": folder_id}, headers=auth_headers(user_id)).json()
+        url = f"/uploads/sessions/{session['id']}/parts"
+
+        state = client.put(f"{url}/3", content=_chunk(content, session, 3), headers=auth_headers(user_id)).json()
+        assert state["received_parts"] == [3] and state["offset"] == 0
+
+        # a part sent with the wrong bytes first, then again with the right ones
+        client.put(f"{url}/1", content=bytes(session["part_size"]), headers=auth_headers(user_id))
+        client.put(f"{url}/1", content=_chunk(content, session, 1), headers=auth_headers(user_id))
+        # completing with a gap is refused
+        incomplete = client.post(f"/uploads/sessions/{session['id']}/complete", headers=auth_headers(user_id))
+        assert incomplete.status_code == 400 and "[2]" in incomplete.json()["detail"]
+
+        state = client.put(f"{url}/2", content=_chunk(content, session, 2), headers=auth_headers(user_id)).json()
+        assert state["offset"] == len(content)
+        completed = client.post(f"/uploads/sessions/{session['id']}/complete", headers=auth_headers(user_id))
+        assert completed.status_code == 200
+
+    with SessionLocal() as db:
+        record = db.get(models.File, completed.json()["file_id"])
+    assert bucket.get_object(Bucket=s3_service.S3_BUCKET, Key=record.s3_key)["Body"].read() == content
+
+def test_part_size_and_number_are_checked(bucket, uploader):
+    """Test that only parts of the agreed size and position are accepted"""
+    user_id, _, folder_id = uploader
+    with TestClient(app) as client:
+        session = client.post("/uploads/sessions", json={"filename": "a.bin", "size": 6 * s3_service.MB, "folder_id": folder_id}, headers=auth_headers(user_id)).json()
+        url = f"/uploads/sessions/{session['id']}/parts"
+        assert client.put(f"{url}/1", content=b"short", headers=auth_headers(user_id)).status_code == 400
+        # the last part is whatever is left over
+        assert client.put(f"{url}/2", content=bytes(session["part_size"]), headers=auth_headers(user_id)).status_code == 400
+        assert client.put(f"{url}/2", content=bytes(s3_service.MB), headers=auth_headers(user_id)).status_code == 200
+        assert client.put(f"{url}/3", content=b"x", headers=auth_headers(user_id)).status_code == 400
+        # past S3's 5 TiB limit, where parts would no longer fit in a request
+        too_big = client.post("/uploads/sessions", json={"filename": "b.bin", "size": 6 * 1024 ** 4, "folder_id": folder_id}, headers=auth_headers(user_id))
+        assert too_big.status_code == 413
+
+def test_same_part_sent_twice_at_once(bucket, uploader, live_server, monkeypatch):
+    """Test that two concurrent PUTs of one new part both succeed and record it once"""
+    user_id, _, folder_id = uploader
+    # both requests are still uploading when either records the part; parts spill to disk past 1 MB
+    upload_part = s3_service._upload_part_blocking
+    monkeypatch.setattr(s3_service, "_upload_part_blocking", lambda *args: time.sleep(0.3) or upload_part(*args))
+    monkeypatch.setattr(uploads_routes, "UPLOAD_PART_SPOOL_SIZE", s3_service.MB)
+    content = random.randbytes(6 * s3_service.MB)
+    session = httpx.post(f"{live_server}/uploads/sessions", json={"filename": "a.bin", "size": len(content), "folder_id": folder_id}, headers=auth_headers(user_id)).json()
+
+    def send(_):
+        return httpx.put(f"{live_server}/uploads/sessions/{session['id']}/parts/1", content=_chunk(content, session, 1), headers=auth_headers(user_id), timeout=30)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        responses = list(pool.map(send, range(2)))
+    assert [response.status_code for response in responses] == [200, 200]
+    assert all(response.json()["received_parts"] == [1] for response in responses)
+    with SessionLocal() as db:
+        assert db.query(models.UploadPart).filter(models.UploadPart.session_id == session["id"]).count() == 1
+
+def test_sessions_are_private_and_expire(bucket, uploader):
+    """Test that other users can't see or feed a session, and expired sessions refuse parts"""
+    user_id, other, folder_id = uploader
+    with TestClient(app) as client:
+        session = client.post("/uploads/sessions", json={"filename": "a.txt", "size": 3, "folder_id": folder_id}, headers=auth_headers(user_id)).json()
+        assert client.get(f"/uploads/sessions/{session['id']}", headers=auth_headers(other)).status_code == 404
+        assert client.put(f"/uploads/sessions/{session['id']}/parts/1", content=b"abc", headers=auth_headers(other)).status_code == 404
+        # starting an upload needs write access to the folder
+        assert client.post("/uploads/sessions", json={"filename": "a.txt", "size": 3, "folder_id": folder_id}, headers=auth_headers(other)).status_code == 404
+
+        with SessionLocal() as db:
+            db.get(models.UploadSession, session["id"]).expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+            db.commit()
+        assert client.put(f"/uploads/sessions/{session['id']}/parts/1", content=b"abc", headers=auth_headers(user_id)).status_code == 410
+
+def test_abort_frees_the_multipart_upload(bucket, uploader):
+    """Test that aborting drops the stored parts in S3 and the session refuses further parts"""
+    user_id, _, folder_id = uploader
+    with TestClient(app) as client:
+        session = client.post("/uploads/sessions", json={"filename": "a.txt", "size": 3, "folder_id": folder_id}, headers=auth_headers(user_id)).json()
+        client.put(f"/uploads/sessions/{session['id']}/parts/1", content=b"abc", headers=auth_headers(user_id))
+        assert client.delete(f"/uploads/sessions/{session['id']}", headers=auth_headers(user_id)).status_code == 204
+        assert client.get(f"/uploads/sessions/{session['id']}", headers=auth_headers(user_id)).json()["status"] == "aborted"
+        assert client.put(f"/uploads/sessions/{session['id']}/parts/1", content=b"abc", headers=auth_headers(user_id)).status_code == 409
+    assert bucket.list_multipart_uploads(Bucket=s3_service.S3_BUCKET).get("Uploads", []) == []
@@ -0,0 +1,112 @@
+import importlib.util
+import pathlib
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import select, text
+from app import database
+from app.database import SessionLocal, engine, rls_bypass, set_rls_bypass, set_rls_user
+from app import models
+from app.services import acl # maintains the folder_acl rows the policies read
+from conftest import random_email
+
+pytestmark = pytest.mark.skipif(engine.dialect.name != "postgresql", reason="row-level security needs Postgres")
+
+VERSIONS = pathlib.Path(__file__).parents[1] / "alembic" / "versions"
+# the policies as first added, then made to fail closed
+MIGRATIONS = ("e7f3a9c1d5b2_add_row_level_security.py", "f1c3e5a7b9d2_rls_fail_closed.py")
+# superusers bypass RLS even when it's forced, so the checks run as this role
+ROLE = "filenest_rls_test"
+
+def _migration(filename):
+    spec = importlib.util.spec_from_file_location(filename.removesuffix(".py"), VERSIONS / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _run(step):
+    with engine.begin() as connection:
+        with Operations.context(MigrationContext.configure(connection)):
+            step()
+
+@pytest.fixture(scope="module")
+def policies():
+    models.Base.metadata.create_all(bind=engine)
+    migrations = [_migration(filename) for filename in MIGRATIONS]
+    with engine.connect() as connection:
+        installed = connection.execute(text("SELECT 1 FROM pg_policies WHERE policyname = 'flashcards_access'")).first()
+    if not installed:
+        for migration in migrations:
+            _run(migration.upgrade)
+    with engine.begin() as connection:
+        if not connection.execute(text("SELECT 1 FROM pg_roles WHERE rolname = :role"), {"role": ROLE}).first():
+            connection.execute(text(f"CREATE ROLE {ROLE} NOLOGIN"))
+        connection.execute(text(f"GRANT SELECT ON ALL TABLES IN SCHEMA public TO {ROLE}"))
+    yield
+    if not installed:
+        for migration in reversed(migrations):
+            _run(migration.downgrade)
+
+@pytest.fixture
+def shared_folder():
+    with SessionLocal() as db:
+        owner, member, stranger = users = [models.User(email=random_email(), name=name, hashed_password="not-used") for name in ("Owner", "Member", "Stranger")]
+        db.add_all(users)
+        db.commit()
+        folder = models.StudyFolder(name="RLS", user_id=owner.id)
+        db.add(folder)
+        db.commit()
+        db.add_all(models.Flashcard(question=f"Q{i}", answer=f"A{i}", user_id=owner.id, folder_id=folder.id) for i in range(3))
+        db.add(models.FolderShare(folder_id=folder.id, user_id=member.id, permission_type="read", invitation_accepted=True))
+        db.commit()
+        return folder.id, owner.id, member.id, stranger.id
+
+def _visible(folder_id, user_id, bypass=False):
+    """Counts of the folder's rows a plain, unfiltered query returns as `user_id`"""
+    with engine.begin() as connection:
+        connection.execute(text(f"SET LOCAL ROLE {ROLE}"))
+        set_rls_user(connection, user_id)
+        set_rls_bypass(connection, bypass)
+        folders = connection.execute(text("SELECT count(*) FROM study_folders WHERE id = :id"), {"id": folder_id}).scalar()
+        cards = connection.execute(text("SELECT count(*) FROM flashcards WHERE folder_id = :id"), {"id": folder_id}).scalar()
+        return folders, cards
+
+def test_policies_filter_by_owner_and_share(policies, shared_folder):
+    """Test that only the owner and accepted share holders see a folder's rows"""
+    folder_id, owner, member, stranger = shared_folder
+
+    assert _visible(folder_id, owner) == (1, 3)
+    assert _visible(folder_id, member) == (1, 3)
+    assert _visible(folder_id, stranger) == (0, 0)
+    # no user set: a connection that forgot to scope itself sees nothing
+    assert _visible(folder_id, None) == (0, 0)
+    # only an explicit bypass sees everything
+    assert _visible(folder_id, None, bypass=True) == (1, 3)
+    assert _visible(folder_id, stranger, bypass=True) == (1, 3)
+
+def test_sessions_run_as_their_user(policies, shared_folder, monkeypatch):
+    """Test that sessions set the RLS user per transaction and the ACL sync bypasses it explicitly"""
+    folder_id, owner, member, stranger = shared_folder
+    monkeypatch.setattr(database, "DB_ROW_LEVEL_SECURITY", True)
+    setting = text("SELECT current_setting('app.user_id', true)")
+    bypass = text("SELECT app_rls_bypass()")
+
+    with SessionLocal(info={"user_id": stranger}) as db:
+        assert db.execute(setting).scalar() == str(stranger)
+        assert db.execute(bypass).scalar() is False
+        connection = db.connection()
+        with rls_bypass(connection):
+            assert connection.execute(bypass).scalar() is True
+        assert connection.execute(bypass).scalar() is False
+        assert connection.execute(setting).scalar() == str(stranger)
+
+        # as a non-superuser the stranger's plain query finds nothing
+        db.execute(text(f"SET LOCAL ROLE {ROLE}"))
+        assert db.execute(select(models.StudyFolder).where(models.StudyFolder.id == folder_id)).first() is None
+        db.rollback()
+
+    # a new transaction on the same session is scoped again
+    with SessionLocal(info={"user_id": owner}) as db:
+        db.commit()
+        assert db.execute(setting).scalar() == str(owner)
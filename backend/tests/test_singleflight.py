@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+import pytest
+from app.utils import gpt, metrics
+from app.utils.singleflight import SingleFlight
+
+CARDS = {"flashcards": [{"question": "What is a stoma?", "answer": "A leaf pore."}]}
+
+def test_identical_concurrent_requests_share_one_upstream_call(fake_llm):
+    """Test that 30 students generating the same topic cost one LLM call"""
+    fake_llm.content = json.dumps(CARDS)
+    fake_llm.delay = 0.3
+    coalesced_before = metrics.get_counter("llm.singleflight.coalesced")
+
+    async def burst():
+        return await asyncio.gather(*[gpt.generate_flashcards("Plant anatomy", 10) for _ in range(30)])
+
+    results = asyncio.run(burst())
+
+    assert fake_llm.calls == 1
+    assert all(result == CARDS["flashcards"] for result in results)
+    assert metrics.get_counter("llm.singleflight.coalesced") - coalesced_before == 29
+
+def test_different_requests_are_not_coalesced(fake_llm):
+    """Test that only identical inputs share a call"""
+    fake_llm.content = json.dumps(CARDS)
+    fake_llm.delay = 0.2
+
+    async def burst():
+        return await asyncio.gather(
+            gpt.generate_flashcards("plant anatomy", 10),
+            gpt.generate_flashcards("plant anatomy", 20),
+            gpt.generate_response("plant anatomy"),
+        )
+
+    asyncio.run(burst())
+    assert fake_llm.calls == 3
+
+def test_errors_reach_every_waiter_and_release_the_key():
+    """Test that a failed call is reported to all callers and retried afterwards"""
+    flight = SingleFlight("test.singleflight")
+    attempts = 0
+
+    async def failing():
+        nonlocal attempts
+        attempts += 1
+        await asyncio.sleep(0.05)
+        raise ValueError("upstream broke")
+
+    async def scenario():
+        results = await asyncio.gather(*[flight.do("key", failing) for _ in range(5)], return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight.in_flight() == 0
+        with pytest.raises(ValueError):
+            await flight.do("key", failing)
+
+    asyncio.run(scenario())
+    assert attempts == 2
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    """Test that the first caller disconnecting leaves the shared call running"""
+    flight = SingleFlight("test.singleflight")
+
+    async def slow():
+        await asyncio.sleep(0.1)
+        return "done"
+
+    async def scenario():
+        leader = asyncio.create_task(flight.do("key", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", slow))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(scenario()) == "done"
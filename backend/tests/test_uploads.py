@@ -0,0 +1,114 @@
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+from boto3.s3.transfer import TransferConfig
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database import SessionLocal
+from app.auth import create_access_token
+from app.services import s3 as s3_service
+from app import models
+from conftest import random_email
+
+@pytest.fixture
+def folder():
+    with SessionLocal() as db:
+        user = models.User(email=random_email(), name="Uploader", hashed_password="not-used")
+        db.add(user)
+        db.commit()
+        folder = models.StudyFolder(name="Uploads", user_id=user.id)
+        db.add(folder)
+        db.commit()
+        db.add(models.File(filename="notes.txt", s3_key=f"{folder.id}/existing", user_id=user.id, folder_id=folder.id))
+        db.commit()
+        token = create_access_token({"user_id": str(user.id)}, expires_delta=timedelta(minutes=5))
+        return folder.id, {"Authorization": f"Bearer {token}"}
+
+def _upload(folder, files):
+    folder_id, headers = folder
+    with TestClient(app) as client:
+        return client.post(
+            "/upload",
+            files=[("file", (name, content, "text/plain")) for name, content in files],
+            data={"folder_id": str(folder_id)},
+            headers=headers
+        )
+
+def test_batch_gets_unique_names_and_every_object(bucket, folder):
+    """Test that a batch upload names duplicates within the batch and the folder, and stores every file"""
+    response = _upload(folder, [("notes.txt", b"first"), ("notes.txt", b"second"), ("other.txt", b"third")])
+
+    assert response.status_code == 200
+    uploaded = response.json()
+    assert [file["filename"] for file in uploaded] == ["notes (1).txt", "notes (2).txt", "other.txt"]
+    with SessionLocal() as db:
+        records = {record.id: record for record in db.query(models.File).filter(models.File.folder_id == folder[0])}
+    contents = [bucket.get_object(Bucket=s3_service.S3_BUCKET, Key=records[file["file_id"]].s3_key)["Body"].read() for file in uploaded]
+    assert contents == [b"first", b"second", b"third"]
+
+def test_uploads_run_in_parallel_up_to_the_cap(bucket, folder, monkeypatch):
+    """Test that files upload side by side, never more than S3_UPLOAD_CONCURRENCY at once"""
+    monkeypatch.setattr(s3_service, "S3_UPLOAD_CONCURRENCY", 3)
+    monkeypatch.setattr(s3_service, "_executor", None)
+    in_flight = peak = 0
+    lock = threading.Lock()
+    upload = s3_service._upload_blocking
+
+    def slow_upload(file_object, key):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.2)
+        try:
+            upload(file_object, key)
+        finally:
+            with lock:
+                in_flight -= 1
+
+    monkeypatch.setattr(s3_service, "_upload_blocking", slow_upload)
+    start = time.perf_counter()
+    # different contents, since identical files are only stored once
+    response = _upload(folder, [(f"file{i}.txt", str(i).encode()) for i in range(9)])
+    elapsed = time.perf_counter() - start
+
+    assert response.status_code == 200
+    assert peak == 3
+    # three waves of 0.2s rather than nine
+    assert elapsed < 1.2
+
+def test_failed_upload_removes_what_the_batch_stored(bucket, folder, monkeypatch):
+    """Test that when one file of a batch fails, the others finish and are deleted, and nothing is recorded"""
+    upload = s3_service._upload_blocking
+    finished = []
+
+    def fail_one(file_object, key):
+        if file_object.read() == b"broken":
+            raise RuntimeError("connection reset")
+        file_object.seek(0)
+        time.sleep(0.2) # still sending when the broken one gives up
+        upload(file_object, key)
+        finished.append(key)
+
+    monkeypatch.setattr(s3_service, "_upload_blocking", fail_one)
+    response = _upload(folder, [("a.txt", b"first"), ("b.txt", b"broken"), ("c.txt", b"third")])
+
+    assert response.status_code == 500
+    assert len(finished) == 2
+    assert bucket.list_objects_v2(Bucket=s3_service.S3_BUCKET).get("KeyCount", 0) == 0
+    with SessionLocal() as db:
+        assert db.query(models.File).filter(models.File.folder_id == folder[0], models.File.filename != "notes.txt").count() == 0
+        assert db.query(models.Blob).count() == 0
+
+def test_large_files_go_up_in_parts(bucket, folder, monkeypatch):
+    """Test that files over the multipart threshold are sent as a multipart upload"""
+    monkeypatch.setattr(s3_service, "transfer_config", TransferConfig(multipart_threshold=5 * s3_service.MB, multipart_chunksize=5 * s3_service.MB))
+    response = _upload(folder, [("big.bin", b"b" * (11 * s3_service.MB))])
+
+    assert response.status_code == 200
+    with SessionLocal() as db:
+        record = db.get(models.File, response.json()[0]["file_id"])
+    # S3 ETags of multipart objects end in the number of parts
+    assert bucket.head_object(Bucket=s3_service.S3_BUCKET, Key=record.s3_key)["ETag"].strip('"').endswith("-3")
@@ -43,21 +43,29 @@ export default function FolderContents({ folder }: FolderContentsProps) {
     const fetchFiles = async () => {
       try {
         const token = localStorage.getItem("token");
-        const response = await fetch(
-          `http://localhost:8000/folders/${folder.id}/files`,
-          {
-            headers: {
-              Authorization: `Bearer ${token}`,
-            },
+        // The list comes back a page at a time; follow next_cursor until the last page
+        const allFiles: any[] = [];
+        let cursor: string | null = null;
+        do {
+          const query: string = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+          const response = await fetch(
+            `http://localhost:8000/folders/${folder.id}/files${query}`,
+            {
+              headers: {
+                Authorization: `Bearer ${token}`,
+              },
+            }
+          );
+          if (!response.ok) {
+            throw new Error(`Failed to fetch files: ${response.status}`);
           }
-        );
-        if (!response.ok) {
-          throw new Error(`Failed to fetch files: ${response.status}`);
-        }
-        const data = await response.json();
-        // Assume data is an array of files with id, url, and filename
+          const data = await response.json();
+          // Each page has files with id, url, and filename
+          allFiles.push(...data.files);
+          cursor = data.next_cursor;
+        } while (cursor);
         setFiles(
-          data.map((file: any) => ({
+          allFiles.map((file: any) => ({
             id: file.id,
             name: file.filename,
             url: file.url,
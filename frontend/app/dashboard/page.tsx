@@ -16,24 +16,32 @@ export default function Dashboard() {
         throw new Error("No authentication token found. Please sign in again.");
       }
 
-      const response = await fetch("http://localhost:8000/folders", {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-
-      if (!response.ok) {
-        const errorData = await response.json().catch(() => null);
-        throw new Error(
-          errorData?.detail ||
-            `Failed to fetch folders (Status: ${response.status})`
-        );
-      }
-
-      const data = await response.json();
-      if (!data || !data.folders || !Array.isArray(data.folders)) {
-        throw new Error("Server returned unexpected data format");
-      }
-
-      setFolders(data.folders);
+      // Folders come back a page at a time; follow next_cursor until the last page
+      const allFolders: Folder[] = [];
+      let cursor: string | null = null;
+      do {
+        const query: string = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+        const response = await fetch(`http://localhost:8000/folders${query}`, {
+          headers: { Authorization: `Bearer ${token}` },
+        });
+
+        if (!response.ok) {
+          const errorData = await response.json().catch(() => null);
+          throw new Error(
+            errorData?.detail ||
+              `Failed to fetch folders (Status: ${response.status})`
+          );
+        }
+
+        const data = await response.json();
+        if (!data || !data.folders || !Array.isArray(data.folders)) {
+          throw new Error("Server returned unexpected data format");
+        }
+        allFolders.push(...data.folders);
+        cursor = data.next_cursor;
+      } while (cursor);
+
+      setFolders(allFolders);
     } catch (error) {
       if (error instanceof Error) {
         setError(error.message);